@@ -0,0 +1,287 @@
+# Batch analysis: stream positions from EPD/PGN files through a pool of search workers
+from engine import create_game_state
+from fen import get_fen, parse_epd
+from pgn import read_pgn, replay_game, get_start_fen
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+
+# NOTE's
+"""
+Pipeline:
+    reader thread --> task queue (bounded) --> worker processes --> result queue --> writer
+The reader streams positions from the input file and blocks while the task
+queue is full, so a slow search never causes the whole file to be read into
+memory (backpressure). Workers run a fixed depth or fixed time search on
+each position, and the main process writes every result (JSON Lines or CSV)
+as soon as it arrives, flushing after each one.
+The output file is also the checkpoint: with resume, ids that already have
+a result are skipped, so a stopped run can continue where it left off.
+If a worker process dies (killed, out of memory, crashed) the main process
+notices it the next time no result comes for WORKER_CHECK_INTERVAL seconds:
+it stops the other workers, writes an error row for every position that was
+handed out but has no result (LOST_ERROR), and raises. Resume retries those.
+"""
+
+FIELDS = ("id", "fen", "bestmove", "score", "depth", "nodes", "seconds")
+WORKER_CHECK_INTERVAL = 1.0 # seconds without a result before the workers are checked
+LOST_ERROR = "worker process died" # error rows of positions lost with a worker
+
+def iter_epd_positions(path):
+    """
+    (id, fen) for every EPD line; the id is the "id" operation or the line number.
+    A line that doesn't parse is passed on as it is, so the worker writes an
+    error row for it instead of the whole run stopping.
+    """
+    with open(path) as file:
+        number = 0
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            number += 1
+            try:
+                fen, operations = parse_epd(line)
+            except ValueError:
+                yield str(number), line
+                continue
+            yield operations.get("id", str(number)), fen
+
+def iter_pgn_positions(path, min_ply=0, every=1):
+    """
+    (id, fen) for the positions of every game, id = "game:ply".
+    min_ply skips the opening, every = only every n-th position.
+    """
+    for number, (headers, san_moves) in enumerate(read_pgn(path), start=1):
+        try:
+            game_state = create_game_state(fen=get_start_fen(headers))
+        except ValueError:
+            continue
+        for ply, _ in replay_game(game_state, san_moves):
+            if ply >= min_ply and ply % every == 0:
+                yield f"{number}:{ply}", get_fen(game_state)
+
+def iter_positions(path, min_ply=0, every=1):
+    if path.lower().endswith(".pgn"):
+        return iter_pgn_positions(path, min_ply, every)
+    return iter_epd_positions(path)
+
+def analyse_position(searcher, fen, backend, depth, time_limit):
+    """
+    Search one position, returns a result dict with FIELDS.
+    """
+    game_state = create_game_state(backend, fen)
+    result = searcher.search(game_state, max_depth=depth, time_limit=time_limit)
+    return {"fen": fen,
+            "bestmove": result.best_move.get_chess_notations() if result.best_move else None,
+            "score": result.score, "depth": result.depth, "nodes": result.nodes,
+            "seconds": round(result.seconds, 4)}
+
+def _worker(task_queue, result_queue, backend, depth, time_limit, hash_mb):
+    """
+    Worker process: take (id, fen) off the task queue until None comes.
+    """
+    from search import Searcher
+    from tt import TranspositionTable
+    searcher = Searcher(tt=TranspositionTable(hash_mb) if hash_mb > 0 else None)
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        position_id, fen = task
+        try:
+            result = analyse_position(searcher, fen, backend, depth, time_limit)
+        except Exception as error: #A bad position shouldn't stop the run
+            result = {"fen": fen, "error": str(error)}
+        result_queue.put(dict(id=position_id, **result))
+    result_queue.put(None)
+
+def _reader(positions, done_ids, task_queue, workers, counts, in_flight):
+    try:
+        for position_id, fen in positions:
+            if position_id in done_ids:
+                counts["skipped"] += 1
+                continue
+            in_flight[position_id] = fen #Until its result is written
+            task_queue.put((position_id, fen)) #blocks while the queue is full
+            counts["queued"] += 1
+    except Exception as error: #Handed to the main thread, which raises it at the end
+        counts["error"] = error
+    finally:
+        #Always, or the workers (and run_batch) would wait for tasks forever
+        for _ in range(workers):
+            task_queue.put(None)
+
+def load_done_ids(path, output_format):
+    """
+    Ids that already have a result in the output file (the checkpoint).
+    """
+    done_ids = set()
+    if not os.path.exists(path):
+        return done_ids
+    with open(path, newline="") as file:
+        if output_format == "csv":
+            rows = csv.DictReader(file)
+        else:
+            rows = []
+            for line in file:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    continue #Half written last line after a crash
+        for row in rows:
+            if "id" in row and not (row.get("error") or "").startswith(LOST_ERROR):
+                done_ids.add(row["id"])
+    return done_ids
+
+def drop_partial_line(path):
+    """
+    Cut a half written last line (a run killed mid-write) off the output
+    file, so appended results start on a line of their own.
+    """
+    with open(path, "rb+") as file:
+        position = file.seek(0, os.SEEK_END)
+        while position > 0:
+            step = min(4096, position)
+            position -= step
+            file.seek(position)
+            newline = file.read(step).rfind(b"\n")
+            if newline != -1:
+                file.truncate(position + newline + 1)
+                return
+        file.truncate(0)
+
+class ResultWriter():
+    def __init__(self, path, output_format, append):
+        """
+        Writes results as JSON Lines or CSV, flushing after every result.
+        """
+        self.output_format = output_format
+        write_header = not (append and os.path.exists(path) and os.path.getsize(path) > 0)
+        self.file = open(path, "a" if append else "w", newline="")
+        self.csv_writer = None
+        if output_format == "csv":
+            self.csv_writer = csv.DictWriter(self.file, FIELDS + ("error",), extrasaction="ignore")
+            if write_header:
+                self.csv_writer.writeheader()
+
+    def write(self, result):
+        if self.csv_writer is not None:
+            self.csv_writer.writerow(result)
+        else:
+            self.file.write(json.dumps(result) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def stop_lost_workers(processes, task_queue, in_flight, writer, exit_codes):
+    """
+    A worker died: stop the others and write an error row for every
+    position that was handed out but never got a result. Returns how many.
+    """
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    task_queue.cancel_join_thread() #Nobody reads it anymore, don't wait for it at exit
+    error = f"{LOST_ERROR} (exit code {', '.join(map(str, exit_codes))})"
+    lost = list(in_flight.items())
+    for position_id, fen in lost:
+        writer.write({"id": position_id, "fen": fen, "error": error})
+    return len(lost)
+
+def run_batch(input_path, output_path, workers=None, depth=4, time_limit=None,
+              backend="array", hash_mb=16, queue_size=64, output_format=None,
+              resume=False, min_ply=0, every=1, report_every=100):
+    """
+    Analyse every position of input_path (.epd or .pgn) and write the results
+    to output_path. Returns (positions analysed, seconds).
+    """
+    workers = workers or os.cpu_count() or 1
+    if output_format is None:
+        output_format = "csv" if output_path.lower().endswith(".csv") else "jsonl"
+    if resume and os.path.exists(output_path):
+        drop_partial_line(output_path) #Before reading the ids, a cut off line isn't done
+    done_ids = load_done_ids(output_path, output_format) if resume else set()
+    with open(input_path): #A missing/unreadable input fails here, before any worker starts
+        pass
+
+    task_queue = mp.Queue(maxsize=queue_size)
+    result_queue = mp.Queue()
+    processes = [mp.Process(target=_worker, daemon=True,
+                            args=(task_queue, result_queue, backend, depth, time_limit, hash_mb))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    counts = {"queued": 0, "skipped": 0}
+    in_flight = {} # id -> fen of the positions handed out without a result yet
+    reader = threading.Thread(target=_reader, daemon=True,
+                              args=(iter_positions(input_path, min_ply, every), done_ids,
+                                    task_queue, workers, counts, in_flight))
+    reader.start()
+
+    writer = ResultWriter(output_path, output_format, append=resume)
+    start = time.perf_counter()
+    finished_workers = 0
+    analysed = 0
+    try:
+        while finished_workers < workers:
+            try:
+                result = result_queue.get(timeout=WORKER_CHECK_INTERVAL)
+            except queue.Empty:
+                dead = [process.exitcode for process in processes
+                        if process.exitcode not in (None, 0)]
+                if dead:
+                    lost = stop_lost_workers(processes, task_queue, in_flight, writer, dead)
+                    raise RuntimeError(f"{len(dead)} worker process(es) died (exit code "
+                                       f"{', '.join(map(str, dead))}), {lost} positions "
+                                       f"without a result written as errors")
+                continue
+            if result is None:
+                finished_workers += 1
+                continue
+            in_flight.pop(result["id"], None)
+            writer.write(result)
+            analysed += 1
+            if report_every and analysed % report_every == 0:
+                seconds = time.perf_counter() - start
+                print(f"{analysed} positions  {analysed / seconds:.1f} positions/s  "
+                      f"({counts['skipped']} already done)")
+    finally:
+        writer.close()
+        for process in processes:
+            process.join(timeout=1)
+    seconds = time.perf_counter() - start
+    if "error" in counts:
+        raise counts["error"] #The reader stopped early, the output is incomplete
+    print(f"Done: {analysed} positions in {seconds:.1f}s  "
+          f"{analysed / seconds if seconds > 0 else 0:.1f} positions/s  "
+          f"({counts['skipped']} skipped from checkpoint)")
+    return analysed, seconds
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse the positions of an EPD or PGN file")
+    parser.add_argument("input", help=".epd or .pgn file")
+    parser.add_argument("output", help=".jsonl or .csv file (also the checkpoint)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--depth", type=int, default=4, help="fixed depth")
+    parser.add_argument("--time", type=float, default=None, help="fixed seconds per position")
+    parser.add_argument("--backend", default="array", choices=("array", "bitboard"))
+    parser.add_argument("--hash", type=int, default=16, help="transposition table MB per worker")
+    parser.add_argument("--queue-size", type=int, default=64)
+    parser.add_argument("--format", choices=("jsonl", "csv"), default=None)
+    parser.add_argument("--resume", action="store_true", help="skip positions already in output")
+    parser.add_argument("--min-ply", type=int, default=0, help="PGN: skip the first plies")
+    parser.add_argument("--every", type=int, default=1, help="PGN: every n-th position")
+    args = parser.parse_args()
+    depth = args.depth if args.time is None else 64
+    run_batch(args.input, args.output, args.workers, depth, args.time, args.backend,
+              args.hash, args.queue_size, args.format, args.resume, args.min_ply, args.every)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+# Bitboard backend for GameState
+from engine import GameState, Move, append_pawn_move
+from zobrist import PIECE_KEYS
+from evaluation import MG_TABLE, EG_TABLE, PHASE
+import time
+
+# NOTE's
+"""
+Squares are numbered the same way the board is laid out in engine.py:
+    square = row * 8 + col, so a8 (0,0) is bit 0 and h1 (7,7) is bit 63.
+Every set (bitboard) is a python int where bit n is 1 if square n is in the set.
+"""
+
+PIECES = ("wP", "wN", "wB", "wR", "wQ", "wK",
+          "bP", "bN", "bB", "bR", "bQ", "bK")
+PIECE_INDEX = {piece: i for i, piece in enumerate(PIECES)}
+WHITE, BLACK = 0, 1
+
+ROOK_DIRECTIONS = ((-1,0), (1,0), (0,-1), (0,1)) #up,down,left,right
+BISHOP_DIRECTIONS = ((1,-1), (1,1), (-1,-1), (-1,1))
+KNIGHT_OFFSETS = ((2,1), (2,-1), (1,2), (1,-2),
+                  (-1,2), (-1,-2), (-2,1), (-2,-1))
+KING_OFFSETS = ((-1,-1), (-1,0), (-1,1), (0,-1), (0,1), (1,-1), (1,0), (1,1))
+
+ROW_MASKS = tuple(0xFF << (8 * row) for row in range(8))
+
+def _offset_table(offsets):
+    """
+    For every square, the set of squares reachable with one of the offsets.
+    """
+    table = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        mask = 0
+        for d in offsets:
+            end_row = row + d[0]
+            end_col = col + d[1]
+            if 0 <= end_row < 8 and 0 <= end_col < 8:
+                mask |= 1 << (end_row * 8 + end_col)
+        table.append(mask)
+    return tuple(table)
+
+def _ray_table(direction):
+    """
+    For every square, the set of squares from it to the edge in one direction.
+    """
+    table = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        mask = 0
+        for i in range(1,8):
+            end_row = row + direction[0] * i
+            end_col = col + direction[1] * i
+            if not (0 <= end_row < 8 and 0 <= end_col < 8):
+                break
+            mask |= 1 << (end_row * 8 + end_col)
+        table.append(mask)
+    return tuple(table)
+
+KNIGHT_ATTACKS = _offset_table(KNIGHT_OFFSETS)
+KING_ATTACKS = _offset_table(KING_OFFSETS)
+#PAWN_ATTACKS[color][sq]: squares a pawn of that color on sq attacks
+PAWN_ATTACKS = (_offset_table(((-1,-1), (-1,1))), _offset_table(((1,-1), (1,1))))
+
+#Rays going towards higher square numbers stop at their lowest set bit,
+#rays going towards lower square numbers stop at their highest set bit.
+RAYS = {d: _ray_table(d) for d in ROOK_DIRECTIONS + BISHOP_DIRECTIONS}
+ROOK_RAYS = tuple((RAYS[d], d[0] * 8 + d[1] > 0) for d in ROOK_DIRECTIONS)
+BISHOP_RAYS = tuple((RAYS[d], d[0] * 8 + d[1] > 0) for d in BISHOP_DIRECTIONS)
+
+def _between_table():
+    """
+    BETWEEN[a][b]: squares strictly between a and b if they share a row,
+    column or diagonal, else 0.
+    """
+    table = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        for d in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
+            mask = 0
+            for i in range(1,8):
+                end_row = row + d[0] * i
+                end_col = col + d[1] * i
+                if not (0 <= end_row < 8 and 0 <= end_col < 8):
+                    break
+                table[sq][end_row * 8 + end_col] = mask
+                mask |= 1 << (end_row * 8 + end_col)
+    return tuple(tuple(row) for row in table)
+
+BETWEEN = _between_table()
+
+def lsb(bb):
+    """
+    Index of the lowest set bit.
+    """
+    return (bb & -bb).bit_length() - 1
+
+def msb(bb):
+    """
+    Index of the highest set bit.
+    """
+    return bb.bit_length() - 1
+
+def slide_attacks(sq, occupied, rays):
+    """
+    Squares a sliding piece on sq attacks, stopping at (and including) the
+    first occupied square along every ray.
+    """
+    attacks = 0
+    for table, positive in rays:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            blocker = lsb(blockers) if positive else msb(blockers)
+            ray ^= table[blocker]
+        attacks |= ray
+    return attacks
+
+def rook_attacks(sq, occupied):
+    return slide_attacks(sq, occupied, ROOK_RAYS)
+
+def bishop_attacks(sq, occupied):
+    return slide_attacks(sq, occupied, BISHOP_RAYS)
+
+def queen_attacks(sq, occupied):
+    return (slide_attacks(sq, occupied, ROOK_RAYS) |
+            slide_attacks(sq, occupied, BISHOP_RAYS))
+
+class BitboardGameState(GameState):
+    def __init__(self):
+        """
+        Same game as GameState, but the position is also kept as
+        twelve 64 bit piece sets (self.pieces, in PIECES order) and
+        occupancy sets for each color (self.occupancy) and both (self.occupied).
+        self.board is kept as a plain list of lists so square lookups
+        (Move, main.py drawing) stay cheap.
+        """
+        super().__init__()
+        self.board = [list(row) for row in self.board]
+        self.sync_bitboards()
+
+    def sync_bitboards(self):
+        """
+        Rebuild every bitboard from self.board.
+        """
+        self.pieces = [0] * 12
+        self.occupancy = [0, 0]
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "__":
+                    bit = 1 << (row * 8 + col)
+                    self.pieces[PIECE_INDEX[piece]] |= bit
+                    self.occupancy[piece[0] == "b"] |= bit
+        self.occupied = self.occupancy[WHITE] | self.occupancy[BLACK]
+
+    def set_square(self, row, col, piece):
+        """
+        Write a piece onto the board and flip the matching bits
+        (plus the hash keys and evaluation totals, like GameState.set_square).
+        """
+        sq = row * 8 + col
+        bit = 1 << sq
+        old = self.board[row][col]
+        self.hash ^= PIECE_KEYS[old][sq] ^ PIECE_KEYS[piece][sq]
+        self.mg_score += MG_TABLE[piece][sq] - MG_TABLE[old][sq]
+        self.eg_score += EG_TABLE[piece][sq] - EG_TABLE[old][sq]
+        self.phase += PHASE[piece] - PHASE[old]
+        if old != "__":
+            self.pieces[PIECE_INDEX[old]] ^= bit
+            self.occupancy[old[0] == "b"] ^= bit
+            self.occupied ^= bit
+        if piece != "__":
+            self.pieces[PIECE_INDEX[piece]] |= bit
+            self.occupancy[piece[0] == "b"] |= bit
+            self.occupied |= bit
+        self.board[row][col] = piece
+
+    def count_pieces(self):
+        return bin(self.occupied).count("1")
+
+    def attackers_to(self, sq, color, occupied=None):
+        """
+        Set of pieces of the given color that attack sq.
+        Works backwards from the square: a knight on sq attacks the same
+        squares that a knight could attack sq from, and so on.
+        """
+        offset = 6 * color
+        pieces = self.pieces
+        if occupied is None:
+            occupied = self.occupied
+        queens = pieces[offset + 4]
+        return ((PAWN_ATTACKS[1 - color][sq] & pieces[offset]) |
+                (KNIGHT_ATTACKS[sq] & pieces[offset + 1]) |
+                (KING_ATTACKS[sq] & pieces[offset + 5]) |
+                (bishop_attacks(sq, occupied) & (pieces[offset + 2] | queens)) |
+                (rook_attacks(sq, occupied) & (pieces[offset + 3] | queens)))
+
+    def compute_attack_map(self, by_white):
+        """
+        Same contract as GameState.compute_attack_map, from the piece sets.
+        """
+        color = WHITE if by_white else BLACK
+        offset = 6 * color
+        pieces = self.pieces
+        occupied = self.occupied & ~pieces[6 * (1 - color) + 5] #see through the enemy king
+        attacks = 0
+        for piece, table in ((0, PAWN_ATTACKS[color]), (1, KNIGHT_ATTACKS), (5, KING_ATTACKS)):
+            bb = pieces[offset + piece]
+            while bb:
+                attacks |= table[lsb(bb)]
+                bb &= bb - 1
+        for piece, slider in ((2, bishop_attacks), (3, rook_attacks), (4, queen_attacks)):
+            bb = pieces[offset + piece]
+            while bb:
+                attacks |= slider(lsb(bb), occupied)
+                bb &= bb - 1
+        return attacks
+
+    def is_square_attacked(self, row, col, by_white, ignore=None):
+        """
+        Same contract as GameState.is_square_attacked, read off the bitboards.
+        """
+        occupied = self.occupied
+        if ignore is not None:
+            occupied &= ~(1 << (ignore[0] * 8 + ignore[1]))
+        return self.attackers_to(row * 8 + col, WHITE if by_white else BLACK,
+                                 occupied) != 0
+
+    def check_for_pins_and_checks(self):
+        """
+        Same contract as GameState.check_for_pins_and_checks.
+        Checkers are the enemy pieces attacking the king square; pins come
+        from enemy sliders that would see the king through exactly one of
+        our pieces (x-ray), found with the BETWEEN table.
+        """
+        color = WHITE if self.white_turn else BLACK
+        enemy = 1 - color
+        offset = 6 * enemy
+        pieces = self.pieces
+        king = lsb(pieces[6 * color + 5])
+        queens = pieces[offset + 4]
+        enemy_occupied = self.occupancy[enemy]
+
+        pins = set()
+        snipers = ((rook_attacks(king, enemy_occupied) & (pieces[offset + 3] | queens)) |
+                   (bishop_attacks(king, enemy_occupied) & (pieces[offset + 2] | queens)))
+        own = self.occupancy[color]
+        while snipers:
+            sniper = lsb(snipers)
+            snipers &= snipers - 1
+            blockers = BETWEEN[king][sniper] & self.occupied
+            if blockers and blockers & (blockers - 1) == 0 and blockers & own:
+                pins.add(divmod(lsb(blockers), 8))
+
+        checkers = self.attackers_to(king, enemy)
+        if not checkers:
+            return pins, None, False
+        if checkers & (checkers - 1):
+            return pins, None, True
+        block = checkers | BETWEEN[king][lsb(checkers)]
+        check_squares = set()
+        while block:
+            check_squares.add(divmod(lsb(block), 8))
+            block &= block - 1
+        return pins, check_squares, False
+
+    def get_split_moves(self, captures):
+        """
+        Same contract as GameState.get_split_moves: the targets are masked
+        with the enemy pieces (captures), the empty squares (the rest) or
+        both (None).
+        """
+        moves = []
+        color = WHITE if self.white_turn else BLACK
+        offset = 6 * color
+        pieces = self.pieces
+        occupied = self.occupied
+        board = self.board
+        targets_mask = 0
+        if captures is not False:
+            targets_mask |= self.occupancy[1 - color]
+        if not captures:
+            targets_mask |= ~occupied & 0xFFFFFFFFFFFFFFFF
+
+        self.get_pawn_bitboard_moves(color, captures, moves)
+        for piece, attacks in ((1, None), (2, bishop_attacks),
+                               (3, rook_attacks), (4, queen_attacks), (5, None)):
+            bb = pieces[offset + piece]
+            while bb:
+                start = lsb(bb)
+                bb &= bb - 1
+                if piece == 1:
+                    targets = KNIGHT_ATTACKS[start] & targets_mask
+                elif piece == 5:
+                    targets = KING_ATTACKS[start] & targets_mask
+                else:
+                    targets = attacks(start, occupied) & targets_mask
+                start_square = divmod(start, 8)
+                while targets:
+                    end = lsb(targets)
+                    targets &= targets - 1
+                    moves.append(Move(start_square, divmod(end, 8), board))
+        return moves
+
+    def get_pawn_bitboard_moves(self, color, captures, moves):
+        """
+        Pawn part of get_split_moves: captures, en passant and pushes to the
+        last row (captures=True), the other pushes (False) or all (None).
+        """
+        pawns = self.pieces[6 * color]
+        empty = ~self.occupied & 0xFFFFFFFFFFFFFFFF
+        board = self.board
+        if color == WHITE:
+            single = (pawns >> 8) & empty
+            double = ((single & ROW_MASKS[5]) >> 8) & empty
+            step = 8
+            last_row = ROW_MASKS[0]
+        else:
+            single = (pawns << 8) & empty
+            double = ((single & ROW_MASKS[2]) << 8) & empty
+            step = -8
+            last_row = ROW_MASKS[7]
+        if not captures:
+            pushes = single & ~last_row
+            while pushes:
+                end = lsb(pushes)
+                pushes &= pushes - 1
+                moves.append(Move(divmod(end + step, 8), divmod(end, 8), board))
+            while double:
+                end = lsb(double)
+                double &= double - 1
+                moves.append(Move(divmod(end + 2 * step, 8), divmod(end, 8), board))
+            if captures is False:
+                return
+
+        promotions = single & last_row
+        while promotions:
+            end = lsb(promotions)
+            promotions &= promotions - 1
+            append_pawn_move(moves, divmod(end + step, 8), divmod(end, 8), board)
+        enemy = self.occupancy[1 - color]
+        en_passant = 0
+        if self.en_passant_coords:
+            en_passant = 1 << (self.en_passant_coords[0] * 8 + self.en_passant_coords[1])
+        while pawns:
+            start = lsb(pawns)
+            pawns &= pawns - 1
+            attacks = PAWN_ATTACKS[color][start]
+            targets = attacks & enemy
+            start_square = divmod(start, 8)
+            while targets:
+                end = lsb(targets)
+                targets &= targets - 1
+                append_pawn_move(moves, start_square, divmod(end, 8), board)
+            if attacks & en_passant:
+                moves.append(Move(start_square, self.en_passant_coords, board,
+                                  is_en_passant_valid=True))
+
+def moves_per_second(game_state, seconds=1.0):
+    """
+    Generate every pseudo-legal move, then make and undo each of them,
+    over and over until the time runs out. Returns moves/second.
+    """
+    count = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while time.perf_counter() < end:
+        for move in game_state.get_all_possible_moves():
+            game_state.make_move(move)
+            game_state.undo_last_move()
+            count += 1
+    return count / (time.perf_counter() - start)
+
+def play_line(game_state, line):
+    """
+    Play a list of moves in chess notation ("e2e4") on game_state.
+    """
+    for notation in line:
+        for move in game_state.get_all_possible_moves():
+            if move.get_chess_notations() == notation:
+                game_state.make_move(move)
+                break
+        else:
+            raise ValueError("Move not possible: " + notation)
+    return game_state
+
+BENCHMARK_LINES = {
+    "start": [],
+    "italian": ["e2e4", "e7e5", "g1f3", "b8c6", "f1c4", "f8c5", "c2c3", "g8f6"],
+}
+
+def compare_backends(seconds=1.0):
+    """
+    Moves/second for both backends on the same positions.
+    """
+    from engine import create_game_state
+    results = {}
+    for name, line in BENCHMARK_LINES.items():
+        for backend in ("array", "bitboard"):
+            game_state = play_line(create_game_state(backend), line)
+            results[(name, backend)] = moves_per_second(game_state, seconds)
+    return results
+
+if __name__ == "__main__":
+    for (name, backend), speed in compare_backends().items():
+        print(f"{name:10} {backend:10} {speed:12,.0f} moves/s")
@@ -0,0 +1,212 @@
+# Opening book: Polyglot style .bin files, memory-mapped and binary searched
+from engine import create_game_state
+from pgn import read_pgn, replay_game, get_start_fen
+from polyglot import polyglot_key
+import argparse
+import mmap
+import os
+import random
+import struct
+
+# NOTE's
+"""
+A book file is a list of 16 byte entries, sorted by position key:
+    key (8 bytes) | move (2 bytes) | weight (2 bytes) | learn (4 bytes)
+all big-endian, the same layout as Polyglot .bin books. The file is
+memory-mapped and binary searched for the key, so a book of any size opens
+instantly and only the pages that get looked at are read from disk.
+Moves use the Polyglot encoding:
+    bits 0-2 to file, 3-5 to rank, 6-8 from file, 9-11 from rank,
+    12-14 promotion (0 none, 1 knight, 2 bishop, 3 rook, 4 queen)
+with rank 0 = rank 1 and castling written as king takes own rook (e1h1).
+Keys are the standard Polyglot keys (polyglot.py), so third-party Polyglot
+books work as they are and books made with build_book work in other programs.
+Between several book moves one is picked at random, weighted by its weight,
+so the engine doesn't play the same opening every game.
+"""
+
+ENTRY = struct.Struct(">QHHI")
+ENTRY_SIZE = ENTRY.size # 16
+KEY = struct.Struct(">Q")
+PROMOTION_CODES = {"N": 1, "B": 2, "R": 3, "Q": 4}
+MAX_WEIGHT = 0xFFFF
+
+def encode_move(move):
+    """
+    Move -> 16 bit Polyglot move.
+    """
+    end_col = move.end_col
+    if move.is_castling_valid:
+        end_col = 7 if move.end_col > move.start_col else 0 #King takes own rook
+    code = (end_col | (7 - move.end_row) << 3 |
+            move.start_col << 6 | (7 - move.start_row) << 9)
+    if move.is_pawn_promotion:
+        code |= PROMOTION_CODES[move.promotion_piece] << 12
+    return code
+
+def decode_move(code, moves):
+    """
+    16 bit Polyglot move -> the matching Move of moves (legal moves), or None.
+    """
+    for move in moves:
+        if encode_move(move) == code:
+            return move
+    return None
+
+class OpeningBook():
+    def __init__(self, path):
+        """
+        Opens and memory-maps a book file (read only).
+        """
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.path.getsize(path)
+        self.length = size // ENTRY_SIZE
+        #mmap can't map an empty file
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self):
+        return self.length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def key_at(self, index):
+        return KEY.unpack_from(self.data, index * ENTRY_SIZE)[0]
+
+    def find_first(self, key):
+        """
+        Index of the first entry with this key (binary search), or -1.
+        """
+        low, high = 0, self.length
+        while low < high:
+            middle = (low + high) // 2
+            if self.key_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.length and self.key_at(low) == key:
+            return low
+        return -1
+
+    def get_entries(self, key):
+        """
+        [(move code, weight)] of every entry for this key.
+        """
+        entries = []
+        index = self.find_first(key)
+        if index < 0:
+            return entries
+        while index < self.length:
+            entry_key, code, weight, _ = ENTRY.unpack_from(self.data, index * ENTRY_SIZE)
+            if entry_key != key:
+                break
+            entries.append((code, weight))
+            index += 1
+        return entries
+
+    def get_moves(self, game_state, moves=None):
+        """
+        [(Move, weight)] of the book moves for game_state that are legal.
+        """
+        entries = self.get_entries(polyglot_key(game_state))
+        if not entries:
+            return []
+        if moves is None:
+            moves = game_state.get_valid_moves()
+        book_moves = []
+        for code, weight in entries:
+            move = decode_move(code, moves)
+            if move is not None and weight > 0:
+                book_moves.append((move, weight))
+        return book_moves
+
+    def choose_move(self, game_state, moves=None, rng=random):
+        """
+        A book move picked at random by weight, or None if out of book.
+        """
+        book_moves = self.get_moves(game_state, moves)
+        if not book_moves:
+            return None
+        return rng.choices([move for move, _ in book_moves],
+                           weights=[weight for _, weight in book_moves])[0]
+
+def result_points(result, white_turn):
+    """
+    Weight a move gets from the game result: win 2, draw 1, loss 0
+    (unknown results count like a draw).
+    """
+    if result == "1-0":
+        return 2 if white_turn else 0
+    if result == "0-1":
+        return 0 if white_turn else 2
+    return 1
+
+def build_book(pgn_path, output_path, max_ply=20, min_games=1, backend="array"):
+    """
+    Build a book from the first max_ply plies of every game in a PGN file.
+    A move is kept if it was played in at least min_games games and scored
+    something. Returns the number of entries written.
+    """
+    counts = {} # (key, move code) -> [games, points]
+    for headers, san_moves in read_pgn(pgn_path):
+        try:
+            game_state = create_game_state(backend, get_start_fen(headers))
+        except ValueError:
+            continue
+        result = headers.get("Result", "*")
+        key = polyglot_key(game_state)
+        white_turn = game_state.white_turn
+        for ply, move in replay_game(game_state, san_moves[:max_ply]):
+            count = counts.setdefault((key, encode_move(move)), [0, 0])
+            count[0] += 1
+            count[1] += result_points(result, white_turn)
+            key = polyglot_key(game_state)
+            white_turn = game_state.white_turn
+
+    entries = [(key, code, points) for (key, code), (games, points) in counts.items()
+               if games >= min_games and points > 0]
+    highest = max((points for _, _, points in entries), default=0)
+    scale = MAX_WEIGHT / highest if highest > MAX_WEIGHT else 1
+    entries.sort(key=lambda entry: (entry[0], -entry[2]))
+    with open(output_path, "wb") as file:
+        for key, code, points in entries:
+            file.write(ENTRY.pack(key, code, max(1, int(points * scale)), 0))
+    return len(entries)
+
+def main():
+    from fen import START_FEN
+    parser = argparse.ArgumentParser(description="Build or probe an opening book")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+    build = subparsers.add_parser("build", help="build a book from a PGN file")
+    build.add_argument("pgn")
+    build.add_argument("book")
+    build.add_argument("--max-ply", type=int, default=20, help="plies of every game to use")
+    build.add_argument("--min-games", type=int, default=1, help="drop rarer moves")
+    probe = subparsers.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book")
+    probe.add_argument("--fen", default=START_FEN)
+    args = parser.parse_args()
+
+    if args.mode == "build":
+        entries = build_book(args.pgn, args.book, args.max_ply, args.min_games)
+        print(f"{entries} entries written to {args.book}")
+        return
+    with OpeningBook(args.book) as book:
+        book_moves = book.get_moves(create_game_state(fen=args.fen))
+        total = sum(weight for _, weight in book_moves)
+        for move, weight in sorted(book_moves, key=lambda book_move: -book_move[1]):
+            print(f"{move.get_chess_notations()}  weight {weight}  {100 * weight / total:.1f}%")
+        if not book_moves:
+            print("Not in book")
+
+if __name__ == "__main__":
+    main()
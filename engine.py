@@ -1,17 +1,41 @@
 import numpy as np 
 import copy
+import logging
+from array import array
+from zobrist import PIECE_KEYS, SIDE_KEY, state_key, castling_index, compute_hash
+from evaluation import MG_TABLE, EG_TABLE, PHASE, PIECES, PIECE_CODES, compute_scores
 
 # NOTE's
 """
 # TODO: use numpy, iterable, and comprehension for better speed
 
-# NOTE: There is a bug in which checkmate is detected. The engine thinks that
-        the spaces around the king are also consider check, but also not really
-        as you can still move another piece as long as the king itself is in check.
-        The engine is making a weird decision in what it considers to be a check.
-        It may have something to do with king_move, in_check, or square_under_attack.
+Undo stack: make_move pushes what it can't work out backwards again onto two
+preallocated arrays of 64 bit ints, one slot per ply (self.ply = slots used):
+    undo_hashes[ply] = the hash before the move
+    undo_states[ply] = castling rights (4 bits, see zobrist.castling_index)
+                     | en passant square + 1 (0 = none) << 4
+                     | halfmove clock << 11
+                     | captured piece (PIECE_CODES) << 27
+undo_last_move reads them back and restores the castling rights in the one
+CastlingRights object the game state has, so make/unmake builds no log
+entries, copies or tuples (SQUARE_COORDS holds the coordinate tuples).
+The arrays double in size if a game outgrows them. move_log stays the list
+of moves played (the GUI, fen.py and the search's PV read it).
 """
 
+logger = logging.getLogger(__name__)
+
+KNIGHT_OFFSETS = ((2,1), (2,-1), (1,2), (1,-2), (-1,2), (-1,-2), (-2,1), (-2,-1))
+KING_OFFSETS = ((-1,-1), (-1,0), (-1,1), (0,-1), (0,1), (1,-1), (1,0), (1,1))
+ROOK_DIRECTIONS = ((-1,0), (1,0), (0,-1), (0,1))
+BISHOP_DIRECTIONS = ((-1,-1), (-1,1), (1,-1), (1,1))
+SLIDER_DIRECTIONS = {"R": ROOK_DIRECTIONS, "B": BISHOP_DIRECTIONS, 
+                     "Q": ROOK_DIRECTIONS + BISHOP_DIRECTIONS}
+SQUARE_COORDS = tuple((sq // 8, sq % 8) for sq in range(64)) # square -> (row, col)
+EN_PASSANT_COORDS = ((),) + SQUARE_COORDS # undo stack en passant field -> coords
+PIECES_BY_CODE = ("__",) + PIECES # PIECE_CODES -> piece
+UNDO_STACK_SIZE = 1024 # plies, grows if needed
+
 class GameState():
     def __init__(self):
         """
@@ -50,36 +74,65 @@ class GameState():
         self.black_king_loc = (0,4)
         self.check_mate = False
         self.stale_mate = False
+        self.draw = False # draw by rule (fifty-move, repetition, material), see update_draw_state
+        self.draw_reason = None
         self.get_castling_rights = CastlingRights(True, True, True, True)
-        self.castling_rights_log = [CastlingRights(self.get_castling_rights.wK_side, 
-                                                   self.get_castling_rights.wQ_side,
-                                                   self.get_castling_rights.bK_side,
-                                                   self.get_castling_rights.bQ_side)]
         self.en_passant_coords = () # coords for squares where en passant is valid
+        self.start_halfmove_clock = 0 # move clocks of the position the game started from
+        self.start_fullmove_number = 1
+        self.halfmove_clock = 0 # plies since the last capture or pawn move
+        self.hash = compute_hash(self) # Zobrist key, kept up to date by make/undo
+        #Undo stack, one slot per move in move_log (see the NOTE's)
+        self.undo_hashes = array("Q", bytes(8 * UNDO_STACK_SIZE))
+        self.undo_states = array("Q", bytes(8 * UNDO_STACK_SIZE))
+        self.ply = 0
+        #Squares attacked by [white, black], each tagged with the hash it was built for
+        self.attack_maps = [0, 0]
+        self.attack_map_keys = [None, None]
+        self.check_hash = False # True = recompute the key after every move to catch drift
+        #Running evaluation totals (see evaluation.py), kept up to date by set_square
+        self.mg_score, self.eg_score, self.phase = compute_scores(self.board)
         
     def make_move(self, move):
         """
         Takes the "Move" class (move) as a parameter and executes it.
         """
-        self.board[move.start_row][move.start_col] = "__"
-        self.board[move.end_row][move.end_col] = move.piece_moved
+        ply = self.ply
+        if ply == len(self.undo_hashes):
+            self.grow_undo_stack()
+        rights = self.get_castling_rights
+        ep = self.en_passant_coords
+        self.undo_hashes[ply] = self.hash
+        self.undo_states[ply] = (castling_index(rights) 
+                                 | (ep[0]*8 + ep[1] + 1 if ep else 0) << 4
+                                 | self.halfmove_clock << 11
+                                 | PIECE_CODES[move.piece_captured] << 27)
+        self.ply = ply + 1
+        if move.piece_moved[1] == "P" or move.piece_captured != "__":
+            self.halfmove_clock = 0 #Irreversible, no earlier position can come back
+        else:
+            self.halfmove_clock += 1
+        #Castling/en passant part of the hash is XOR'ed out here and back in at the end
+        self.hash ^= state_key(rights, ep) ^ SIDE_KEY
+        self.set_square(move.start_row, move.start_col, "__")
+        self.set_square(move.end_row, move.end_col, move.piece_moved)
         self.move_log.append(move) 
         self.white_turn = not self.white_turn
         if move.piece_moved == "wK":
-            self.white_king_loc = (move.end_row, move.end_col)
+            self.white_king_loc = SQUARE_COORDS[move.end_row*8 + move.end_col]
         elif move.piece_moved == "bK":
-            self.black_king_loc = (move.end_row, move.end_col)
+            self.black_king_loc = SQUARE_COORDS[move.end_row*8 + move.end_col]
 
         if move.is_pawn_promotion:
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + "Q"
+            self.set_square(move.end_row, move.end_col, move.piece_moved[0] + move.promotion_piece)
 
         #En passant move
         if move.is_en_passant_valid:
-            self.board[move.start_row][move.end_col] = "__" #Pawn captured
+            self.set_square(move.start_row, move.end_col, "__") #Pawn captured
         
         #Update en_passant_coords variable, only on 2 square pawn advances
         if move.piece_moved[1] == "P" and abs(move.start_row - move.end_row) == 2:
-            self.en_passant_coords = ((move.start_row + move.end_row)//2, move.start_col)
+            self.en_passant_coords = SQUARE_COORDS[(move.start_row + move.end_row)//2*8 + move.start_col]
         else:
             self.en_passant_coords = ()
 
@@ -87,57 +140,164 @@ class GameState():
         if move.is_castling_valid:
             if move.end_col - move.start_col == 2: #king side castle
                 #moves the rook (copy)
-                self.board[move.end_row][move.end_col-1] = self.board[move.end_row][move.end_col+1]
-                self.board[move.end_row][move.end_col+1] = "__" #Remove old rook
+                self.set_square(move.end_row, move.end_col-1, self.board[move.end_row][move.end_col+1])
+                self.set_square(move.end_row, move.end_col+1, "__") #Remove old rook
             else: #Queen side castle
-                self.board[move.end_row][move.end_col+1] = self.board[move.end_row][move.end_col-2]
-                self.board[move.end_row][move.end_col-2] = "__" #Remove old rook
+                self.set_square(move.end_row, move.end_col+1, self.board[move.end_row][move.end_col-2])
+                self.set_square(move.end_row, move.end_col-2, "__") #Remove old rook
 
         #Updating CastlingRights if rook or king moves, or something prevents it
         self.update_castling_rights(move)
-        self.castling_rights_log.append(CastlingRights(self.get_castling_rights.wK_side, 
-                                                   self.get_castling_rights.wQ_side,
-                                                   self.get_castling_rights.bK_side,
-                                                   self.get_castling_rights.bQ_side))
+        self.hash ^= state_key(rights, self.en_passant_coords)
+        if self.check_hash:
+            self.verify_hash()
 
     def undo_last_move(self):
         """
         Undo the last move made. 
         To do this, 
-            get the length of the move_log and pop off the most recent element.
+            pop the most recent move off the move_log and read the state
+            from before it back from the undo stack (see the NOTE's).
         """
-        if len(self.move_log) != 0:
+        if self.ply != 0:
             move = self.move_log.pop()
-            self.board[move.start_row][move.start_col] = move.piece_moved
-            self.board[move.end_row][move.end_col] = move.piece_captured
+            self.ply -= 1
+            state = self.undo_states[self.ply]
+            self.set_square(move.start_row, move.start_col, move.piece_moved)
+            captured = PIECES_BY_CODE[state >> 27]
             self.white_turn = not self.white_turn
             if move.piece_moved == "wK":
-                self.white_king_loc = (move.start_row, move.start_col)
+                self.white_king_loc = SQUARE_COORDS[move.start_row*8 + move.start_col]
             elif move.piece_moved == "bK":
-                self.black_king_loc = (move.start_row, move.start_col)
+                self.black_king_loc = SQUARE_COORDS[move.start_row*8 + move.start_col]
 
             if move.is_en_passant_valid:
-                self.board[move.end_row][move.end_col] = "__" #leave landing sq blank
-                self.board[move.start_row][move.end_col] = move.piece_captured
-                #Allow to redo en passant after undoing
-                self.en_passant_coords = (move.end_row, move.end_col)
-            #Undo a two sq pawn push
-            if move.piece_moved[1] == "P" and abs(move.start_row - move.end_row) == 2:
-                self.en_passant_coords = ()
-
-            #Undoing CastlingRights
-            #Get rid of the new castle rights from the move we are undoing
-            self.castling_rights_log.pop()
-            #Set the current castle rights to the last one in the list
-            self.get_castling_rights = self.castling_rights_log[-1]
+                self.set_square(move.end_row, move.end_col, "__") #leave landing sq blank
+                self.set_square(move.start_row, move.end_col, captured)
+            else:
+                self.set_square(move.end_row, move.end_col, captured)
+            self.en_passant_coords = EN_PASSANT_COORDS[state >> 4 & 127]
+            self.halfmove_clock = state >> 11 & 0xFFFF
+
+            #Undoing CastlingRights, in place: update_castling_rights changes this object
+            rights = self.get_castling_rights
+            rights.wK_side = state & 1 != 0
+            rights.wQ_side = state & 2 != 0
+            rights.bK_side = state & 4 != 0
+            rights.bQ_side = state & 8 != 0
             #Undo Castle move
             if move.is_castling_valid:
                 if move.end_col - move.start_col == 2: #king side
-                    self.board[move.end_row][move.end_col+1] = self.board[move.end_row][move.end_col-1]
-                    self.board[move.end_row][move.end_col-1] = "__"
+                    self.set_square(move.end_row, move.end_col+1, self.board[move.end_row][move.end_col-1])
+                    self.set_square(move.end_row, move.end_col-1, "__")
                 else: #queen side
-                    self.board[move.end_row][move.end_col-2] = self.board[move.end_row][move.end_col+1]
-                    self.board[move.end_row][move.end_col+1] = "__"
+                    self.set_square(move.end_row, move.end_col-2, self.board[move.end_row][move.end_col+1])
+                    self.set_square(move.end_row, move.end_col+1, "__")
+            #set_square kept the piece part in step, the stack has the whole key
+            self.hash = self.undo_hashes[self.ply]
+            if self.check_hash:
+                self.verify_hash()
+
+    def grow_undo_stack(self):
+        """
+        Double the undo stack, for games longer than UNDO_STACK_SIZE plies.
+        """
+        self.undo_hashes.extend(array("Q", bytes(8 * len(self.undo_hashes))))
+        self.undo_states.extend(array("Q", bytes(8 * len(self.undo_states))))
+
+    def load_position(self, board, white_turn, castling_rights, en_passant_coords=(), 
+                      halfmove_clock=0, fullmove_number=1):
+        """
+        Replace the whole position, e.g. one read from a FEN string (see fen.py).
+        board = 8 rows of 8 piece strings, same notation as self.board.
+        The game starts over from this position, so the move history is cleared.
+        """
+        for row in range(8):
+            for col in range(8):
+                piece = board[row][col]
+                self.set_square(row, col, piece)
+                if piece == "wK":
+                    self.white_king_loc = (row, col)
+                elif piece == "bK":
+                    self.black_king_loc = (row, col)
+        self.white_turn = white_turn
+        self.move_log = []
+        self.check_mate = False
+        self.stale_mate = False
+        self.draw = False
+        self.draw_reason = None
+        self.get_castling_rights = CastlingRights(castling_rights.wK_side, castling_rights.wQ_side,
+                                                  castling_rights.bK_side, castling_rights.bQ_side)
+        self.en_passant_coords = en_passant_coords
+        self.start_halfmove_clock = halfmove_clock
+        self.start_fullmove_number = fullmove_number
+        self.halfmove_clock = halfmove_clock
+        self.hash = compute_hash(self)
+        self.ply = 0
+        self.mg_score, self.eg_score, self.phase = compute_scores(self.board)
+
+    def set_square(self, row, col, piece):
+        """
+        Write a piece ("__" for an empty square) onto the board.
+        All board changes in make_move/undo_last_move go through here, so
+        other backends (see bitboard.py) can keep their own view in sync.
+        The piece part of the Zobrist hash and the evaluation totals are
+        updated here as well.
+        """
+        old = self.board[row][col]
+        sq = row*8 + col
+        self.hash ^= PIECE_KEYS[old][sq] ^ PIECE_KEYS[piece][sq]
+        self.mg_score += MG_TABLE[piece][sq] - MG_TABLE[old][sq]
+        self.eg_score += EG_TABLE[piece][sq] - EG_TABLE[old][sq]
+        self.phase += PHASE[piece] - PHASE[old]
+        self.board[row][col] = piece
+
+    def is_repetition(self, count=1):
+        """
+        True if the current position already came up count times before.
+        Only positions with the same side to move since the last capture or
+        pawn move (halfmove_clock plies back) are compared, since nothing
+        older can come back. The hash covers castling rights and the
+        en passant square too, so only truly equal positions match.
+        """
+        undo_hashes = self.undo_hashes
+        oldest = max(self.ply - self.halfmove_clock, 0)
+        seen = 0
+        for i in range(self.ply - 2, oldest - 1, -2):
+            if undo_hashes[i] == self.hash:
+                seen += 1
+                if seen >= count:
+                    return True
+        return False
+
+    def update_draw_state(self):
+        """
+        Set self.draw and self.draw_reason for the draws by rule:
+        fifty-move rule, threefold repetition and insufficient material
+        (stalemate stays in stale_mate). Call it after get_valid_moves,
+        the game loop does this after every move. It's not part of
+        get_valid_moves, so the search doesn't pay for it at every node.
+        Returns self.draw.
+        """
+        self.draw_reason = None
+        if self.halfmove_clock >= 100 and not self.check_mate:
+            self.draw_reason = "fifty-move rule"
+        elif self.is_repetition(2):
+            self.draw_reason = "threefold repetition"
+        elif self.count_pieces() == 2 or (self.count_pieces() == 3 and self.phase == 1):
+            self.draw_reason = "insufficient material" #Bare kings, or one knight/bishop
+        self.draw = self.draw_reason is not None
+        return self.draw
+
+    def verify_hash(self):
+        """
+        Compare the incrementally updated hash to one computed from scratch.
+        Used when check_hash is True (slow, for debugging only).
+        """
+        expected = compute_hash(self)
+        if self.hash != expected:
+            raise RuntimeError(f"Zobrist hash drift after {len(self.move_log)} moves: "
+                               f"{self.hash:016x} != {expected:016x}")
 
     def update_castling_rights(self, move):
         """
@@ -162,79 +322,384 @@ class GameState():
                 elif move.start_col == 7:
                     self.get_castling_rights.bK_side = False
 
+        #A rook captured on its starting square can't castle anymore either
+        if move.piece_captured == "wR":
+            if move.end_row == 7:
+                if move.end_col == 0:
+                    self.get_castling_rights.wQ_side = False
+                elif move.end_col == 7:
+                    self.get_castling_rights.wK_side = False
+        elif move.piece_captured == "bR":
+            if move.end_row == 0:
+                if move.end_col == 0:
+                    self.get_castling_rights.bQ_side = False
+                elif move.end_col == 7:
+                    self.get_castling_rights.bK_side = False
+
     def get_valid_moves(self):
         """
         Get only the valid moves of that game_state instance:
         Checks, pins, double attacks, discovered attacks, etc.
-        NOTE, yes- a bit inefficient, but easy to implement and understand.
-        """
-        temp_en_passant_valid = self.en_passant_coords
-        temp_castling_rights = CastlingRights(self.get_castling_rights.wK_side, 
-                                                   self.get_castling_rights.wQ_side,
-                                                   self.get_castling_rights.bK_side,
-                                                   self.get_castling_rights.bQ_side)
-        moves = self.get_all_possible_moves()
-        if self.white_turn:
-            self.get_castle_moves(self.white_king_loc[0], self.white_king_loc[1], moves)
-            print("test")
-        else:
-            self.get_castle_moves(self.black_king_loc[0], self.black_king_loc[1], moves)
+        Works from the king outward: checkers and pinned pieces are found
+        once per position (check_for_pins_and_checks), then every
+        pseudo-legal move is kept or dropped without making it on the board.
+        """
+        pins, check_squares, double_check = self.check_for_pins_and_checks()
+        moves = self.filter_legal_moves(self.get_all_possible_moves(), 
+                                        pins, check_squares, double_check)
+
+        if check_squares is None:
+            if self.white_turn:
+                self.get_castle_moves(self.white_king_loc[0], self.white_king_loc[1], moves)
+            else:
+                self.get_castle_moves(self.black_king_loc[0], self.black_king_loc[1], moves)
 
-        for i in range(len(moves)-1, -1, -1):
-            self.make_move(moves[i])
-            if self.in_check():
-                moves.remove(moves[i])
-            self.undo_last_move()
         if len(moves) == 0:
-            if self.in_check():
-                print("Checkmate")
+            if check_squares is not None:
+                logger.debug("Checkmate")
                 self.check_mate = True
             else:
-                print("Stalemate")
+                logger.debug("Stalemate")
                 self.stale_mate = True
         else:
             self.stale_mate = False
             self.check_mate = False
-        
-        self.en_passant_coords = temp_en_passant_valid
-        self.get_castling_rights = temp_castling_rights
         return moves
+
+    def get_valid_piece_moves(self, row, col, pins_and_checks=None):
+        """
+        Valid moves of the single piece on (row, col), castling left out.
+        Lets the search check a hash move without generating every move.
+        pins_and_checks = check_for_pins_and_checks() if the caller has it.
+        """
+        piece = self.board[row][col]
+        if piece == "__" or (piece[0] == "w") != self.white_turn:
+            return []
+        moves = []
+        self.move_functions[piece[1]](row, col, moves)
+        if pins_and_checks is None:
+            pins_and_checks = self.check_for_pins_and_checks()
+        return self.filter_legal_moves(moves, *pins_and_checks)
+
+    def get_valid_captures(self, pins_and_checks=None):
+        """
+        Valid captures and promotions only (the moves movepick.is_quiet
+        says aren't quiet). Check/mate flags are left alone.
+        """
+        if pins_and_checks is None:
+            pins_and_checks = self.check_for_pins_and_checks()
+        return self.filter_legal_moves(self.get_split_moves(True), *pins_and_checks)
+
+    def get_valid_quiets(self, pins_and_checks=None):
+        """
+        Valid quiet moves only, castling included.
+        get_valid_captures + get_valid_quiets = get_valid_moves.
+        """
+        if pins_and_checks is None:
+            pins_and_checks = self.check_for_pins_and_checks()
+        pins, check_squares, double_check = pins_and_checks
+        moves = self.filter_legal_moves(self.get_split_moves(False), 
+                                        pins, check_squares, double_check)
+        if check_squares is None:
+            if self.white_turn:
+                self.get_castle_moves(self.white_king_loc[0], self.white_king_loc[1], moves)
+            else:
+                self.get_castle_moves(self.black_king_loc[0], self.black_king_loc[1], moves)
+        return moves
+
+    def filter_legal_moves(self, moves, pins, check_squares, double_check):
+        """
+        Drop the pseudo-legal moves that leave the king in check, using the
+        pins and checks of check_for_pins_and_checks.
+        Legal moves are packed to the front of the list in place, so no
+        second list is built per call.
+        """
+        if self.white_turn:
+            king_row, king_col = self.white_king_loc
+        else:
+            king_row, king_col = self.black_king_loc
+        enemy_white = not self.white_turn
+        enemy_attacks = None
+        legal_count = 0
+        for move in moves:
+            if move.piece_moved[1] == "K":
+                #The attack map sees through the king, so it can't hide behind itself
+                if enemy_attacks is None:
+                    enemy_attacks = self.get_attack_map(enemy_white)
+                if enemy_attacks >> (move.end_row*8 + move.end_col) & 1:
+                    continue
+            elif double_check:
+                continue #Only the king can move out of a double check
+            elif move.is_en_passant_valid:
+                #Two pawns leave the same row, rare enough to just try it
+                self.make_move(move)
+                legal = not self.is_square_attacked(king_row, king_col, enemy_white)
+                self.undo_last_move()
+                if not legal:
+                    continue
+            else:
+                if (check_squares is not None and 
+                    (move.end_row, move.end_col) not in check_squares):
+                    continue #Must capture the checker or block the check
+                if (pins and (move.start_row, move.start_col) in pins and 
+                    (move.end_row - king_row) * (move.start_col - king_col) != 
+                    (move.end_col - king_col) * (move.start_row - king_row)):
+                    continue #Pinned pieces can only move along the pin ray
+            moves[legal_count] = move
+            legal_count += 1
+        del moves[legal_count:]
+        return moves
+
+    def check_for_pins_and_checks(self):
+        """
+        Look outward from the side to move's king along the 8 rays and the
+        knight jumps. Returns (pins, check_squares, double_check):
+            pins = set of (row, col) of own pieces pinned to the king
+            check_squares = None if not in check, else the set of squares
+                that capture the checker or block its ray
+            double_check = True if two pieces give check
+        """
+        if self.white_turn:
+            ally, enemy = "w", "b"
+            king_row, king_col = self.white_king_loc
+        else:
+            ally, enemy = "b", "w"
+            king_row, king_col = self.black_king_loc
+        board = self.board
+        pins = set()
+        check_squares = None
+        checks = 0
+        directions = ((-1,0), (1,0), (0,-1), (0,1), #rook rays first
+                      (-1,-1), (-1,1), (1,-1), (1,1))
+        pawn_row = -1 if self.white_turn else 1 #where enemy pawns attack from
+        for j in range(8):
+            d = directions[j]
+            possible_pin = None
+            for i in range(1,8):
+                end_row = king_row + d[0] * i
+                end_col = king_col + d[1] * i
+                if not (0 <= end_row < 8 and 0 <= end_col < 8):
+                    break
+                end_piece = board[end_row][end_col]
+                if end_piece[0] == ally:
+                    if possible_pin is not None:
+                        break #Two own pieces, neither is pinned
+                    possible_pin = (end_row, end_col)
+                elif end_piece[0] == enemy:
+                    piece_type = end_piece[1]
+                    if ((j < 4 and (piece_type == "R" or piece_type == "Q")) or 
+                        (j >= 4 and (piece_type == "B" or piece_type == "Q")) or 
+                        (i == 1 and piece_type == "P" and d[0] == pawn_row and j >= 4)):
+                        if possible_pin is None:
+                            checks += 1
+                            check_squares = {(king_row + d[0] * k, king_col + d[1] * k) 
+                                             for k in range(1, i+1)}
+                        else:
+                            pins.add(possible_pin)
+                    break
+        knight_moves = ((2,1), (2,-1), (1,2), (1,-2), 
+                        (-1,2), (-1,-2), (-2,1), (-2,-1))
+        for d in knight_moves:
+            end_row = king_row + d[0]
+            end_col = king_col + d[1]
+            if 0 <= end_row < 8 and 0 <= end_col < 8:
+                if board[end_row][end_col] == enemy + "N":
+                    checks += 1
+                    check_squares = {(end_row, end_col)}
+        return pins, check_squares, checks > 1
     
+    def count_pieces(self):
+        """
+        Number of pieces on the board (both colors, kings included).
+        """
+        return int(np.count_nonzero(self.board != "__"))
+
     def in_check(self):
         """
-        Checks if the King's location is under attack (in check).
+        Checks if the King of the side to move is under attack (in check).
         """
-        if not self.white_turn:
-            return self.square_under_attacK(self.white_king_loc[0], 
-                                            self.white_king_loc[1])
+        if self.white_turn:
+            row, col = self.white_king_loc
         else:
-            return self.square_under_attacK(self.black_king_loc[0], 
-                                            self.black_king_loc[1])
+            row, col = self.black_king_loc
+        return self.get_attack_map(not self.white_turn) >> (row*8 + col) & 1 == 1
         
     def square_under_attacK(self, row, col):
         """
-        Get all of the possible moves that the opponent can make.
-        If those moves cross over the square in question 
-            (location of row and col), return True, else, False.
-        """
-        opponent_moves = self.get_all_possible_moves()
-        for move in opponent_moves:
-            if move.end_row == row and move.end_col == col:
+        Checks if the opponent of the side to move attacks the square.
+        """
+        return self.get_attack_map(not self.white_turn) >> (row*8 + col) & 1 == 1
+
+    def get_attack_map(self, by_white):
+        """
+        Every square the given side attacks as a 64 bit mask (bit row*8 + col).
+        The other side's king doesn't block the rays, so the squares behind it
+        count too: exactly what the king needs to know before stepping there.
+        Built at most once per position: the cache is tagged with the hash,
+        so make_move/undo_last_move invalidate it just by changing the hash.
+        """
+        side = 0 if by_white else 1
+        if self.attack_map_keys[side] != self.hash:
+            self.attack_maps[side] = self.compute_attack_map(by_white)
+            self.attack_map_keys[side] = self.hash
+        return self.attack_maps[side]
+
+    def compute_attack_map(self, by_white):
+        """
+        get_attack_map without the cache, from the board.
+        """
+        board = self.board
+        color = "w" if by_white else "b"
+        see_through = "bK" if by_white else "wK"
+        pawn_row = -1 if by_white else 1
+        attacks = 0
+        for row in range(8):
+            for col in range(8):
+                piece = board[row][col]
+                if piece[0] != color:
+                    continue
+                kind = piece[1]
+                if kind == "P":
+                    end_row = row + pawn_row
+                    if 0 <= end_row < 8:
+                        if col > 0:
+                            attacks |= 1 << (end_row*8 + col-1)
+                        if col < 7:
+                            attacks |= 1 << (end_row*8 + col+1)
+                elif kind == "N" or kind == "K":
+                    for d in (KNIGHT_OFFSETS if kind == "N" else KING_OFFSETS):
+                        end_row = row + d[0]
+                        end_col = col + d[1]
+                        if 0 <= end_row < 8 and 0 <= end_col < 8:
+                            attacks |= 1 << (end_row*8 + end_col)
+                else:
+                    for d in SLIDER_DIRECTIONS[kind]:
+                        end_row = row + d[0]
+                        end_col = col + d[1]
+                        while 0 <= end_row < 8 and 0 <= end_col < 8:
+                            attacks |= 1 << (end_row*8 + end_col)
+                            end_piece = board[end_row][end_col]
+                            if end_piece != "__" and end_piece != see_through:
+                                break
+                            end_row += d[0]
+                            end_col += d[1]
+        return attacks
+
+    def is_square_attacked(self, row, col, by_white, ignore=None):
+        """
+        Scan outward from the square itself (knight jumps, pawn and king 
+        squares, then the 8 rays) instead of generating the attacker's moves.
+        ignore = (row, col) of a square to treat as empty, such as the
+        king's own square when checking where the king can move to.
+        """
+        board = self.board
+        if by_white:
+            enemy, pawn, knight, bishop, rook, queen, king = "w", "wP", "wN", "wB", "wR", "wQ", "wK"
+            pawn_row = row + 1
+        else:
+            enemy, pawn, knight, bishop, rook, queen, king = "b", "bP", "bN", "bB", "bR", "bQ", "bK"
+            pawn_row = row - 1
+        ignore_row, ignore_col = ignore if ignore is not None else (-1, -1)
+
+        if 0 <= pawn_row < 8:
+            if col-1 >= 0 and board[pawn_row][col-1] == pawn:
+                return True
+            if col+1 <= 7 and board[pawn_row][col+1] == pawn:
+                return True
+        for d in ((2,1), (2,-1), (1,2), (1,-2), (-1,2), (-1,-2), (-2,1), (-2,-1)):
+            end_row = row + d[0]
+            end_col = col + d[1]
+            if 0 <= end_row < 8 and 0 <= end_col < 8 and board[end_row][end_col] == knight:
                 return True
+        for j, d in enumerate(((-1,0), (1,0), (0,-1), (0,1), 
+                               (-1,-1), (-1,1), (1,-1), (1,1))):
+            slider = rook if j < 4 else bishop
+            for i in range(1,8):
+                end_row = row + d[0] * i
+                end_col = col + d[1] * i
+                if not (0 <= end_row < 8 and 0 <= end_col < 8):
+                    break
+                if end_row == ignore_row and end_col == ignore_col:
+                    continue
+                end_piece = board[end_row][end_col]
+                if end_piece == "__":
+                    continue
+                if (end_piece == slider or end_piece == queen or 
+                    (i == 1 and end_piece == king)):
+                    return True
+                break
         return False
 
     def get_all_possible_moves(self):
         """
         Get both black and white's moves possible moves
+        (get_split_moves with both halves at once).
+        """
+        return self.get_split_moves(None)
+
+    def get_split_moves(self, captures):
         """
+        Pseudo-legal moves of the side to move, castling left out:
+            captures=True: captures (en passant too) and promotions
+            captures=False: the rest (quiet moves)
+            captures=None: both, in one pass over the board
+        Only the Move objects of the asked for half get built, so the move
+        picker can try the captures before it pays for the quiet moves.
+        """
+        board = self.board
+        if self.white_turn:
+            ally, enemy, forward, start_row, last_row = "w", "b", -1, 6, 0
+        else:
+            ally, enemy, forward, start_row, last_row = "b", "w", 1, 1, 7
+        with_captures = captures is not False
+        with_quiets = not captures
+        #First letter of the end square's piece that makes a move of the asked for kind
+        end_colors = (enemy if with_captures else "") + ("_" if with_quiets else "")
         moves = []
-        for row in range(len(self.board)): 
-            for col in range(len(self.board[row])): 
-                turn = self.board[row][col][0]
-                if ((turn == "w" and self.white_turn) or 
-                    (turn == "b" and not self.white_turn)):
-                    piece = self.board[row][col][1]
-                    self.move_functions[piece](row, col, moves)
+        for row in range(8):
+            for col in range(8):
+                piece = board[row][col]
+                if piece[0] != ally:
+                    continue
+                kind = piece[1]
+                if kind == "P":
+                    end_row = row + forward
+                    if with_captures:
+                        if end_row == last_row and board[end_row][col] == "__":
+                            append_pawn_move(moves, (row,col), (end_row,col), board)
+                        for end_col in (col-1, col+1):
+                            if 0 <= end_col < 8:
+                                if board[end_row][end_col][0] == enemy:
+                                    append_pawn_move(moves, (row,col), (end_row,end_col), board)
+                                elif (end_row,end_col) == self.en_passant_coords:
+                                    moves.append(Move((row,col), (end_row,end_col), board, 
+                                                      is_en_passant_valid=True))
+                    if with_quiets and end_row != last_row and board[end_row][col] == "__":
+                        moves.append(Move((row,col), (end_row,col), board))
+                        if row == start_row and board[end_row+forward][col] == "__":
+                            moves.append(Move((row,col), (end_row+forward,col), board))
+                elif kind == "N" or kind == "K":
+                    for d_row, d_col in (KNIGHT_OFFSETS if kind == "N" else KING_OFFSETS):
+                        end_row = row + d_row
+                        end_col = col + d_col
+                        if 0 <= end_row < 8 and 0 <= end_col < 8:
+                            end_color = board[end_row][end_col][0]
+                            if end_color in end_colors:
+                                moves.append(Move((row,col), (end_row,end_col), board))
+                else:
+                    for d_row, d_col in SLIDER_DIRECTIONS[kind]:
+                        end_row = row + d_row
+                        end_col = col + d_col
+                        while 0 <= end_row < 8 and 0 <= end_col < 8:
+                            end_piece = board[end_row][end_col]
+                            if end_piece != "__":
+                                if with_captures and end_piece[0] == enemy:
+                                    moves.append(Move((row,col), (end_row,end_col), board))
+                                break
+                            if with_quiets:
+                                moves.append(Move((row,col), (end_row,end_col), board))
+                            end_row += d_row
+                            end_col += d_col
         return moves
 
     def get_pawn_moves(self, row, col, moves):
@@ -248,35 +713,35 @@ class GameState():
         """
         if self.white_turn:
             if self.board[row-1][col] == "__":
-                moves.append(Move((row,col), (row-1,col), self.board))
+                append_pawn_move(moves, (row,col), (row-1,col), self.board)
                 if row == 6 and self.board[row-2][col] == "__":
                     moves.append(Move((row,col), (row-2,col), self.board))
             if col-1 >= 0: 
                 if self.board[row-1][col-1][0] == "b":
-                    moves.append(Move((row,col), (row-1,col-1), self.board))
+                    append_pawn_move(moves, (row,col), (row-1,col-1), self.board)
                 elif (row-1,col-1) == self.en_passant_coords:
                     moves.append(Move((row,col), (row-1,col-1), self.board, 
                                       is_en_passant_valid=True))
             if col+1 <= 7: 
                 if self.board[row-1][col+1][0] == "b":
-                    moves.append(Move((row,col), (row-1,col+1), self.board))
+                    append_pawn_move(moves, (row,col), (row-1,col+1), self.board)
                 elif (row-1,col+1) == self.en_passant_coords:
                     moves.append(Move((row,col), (row-1,col+1), self.board, 
                                       is_en_passant_valid=True))
         else: 
             if self.board[row+1][col] == "__":
-                moves.append(Move((row, col), (row+1, col), self.board))
+                append_pawn_move(moves, (row, col), (row+1, col), self.board)
                 if row == 1 and self.board[row+2][col] == "__":
                     moves.append(Move((row,col), (row+2,col), self.board))
             if col-1 >= 0: 
                 if self.board[row+1][col-1][0] == "w":
-                    moves.append(Move((row,col), (row+1,col-1), self.board))
+                    append_pawn_move(moves, (row,col), (row+1,col-1), self.board)
                 elif (row+1,col-1) == self.en_passant_coords:
                     moves.append(Move((row,col), (row+1,col-1), self.board, 
                                       is_en_passant_valid=True))
             if col+1 <= 7: 
                 if self.board[row+1][col+1][0] == "w":
-                    moves.append(Move((row,col), (row+1,col+1), self.board))
+                    append_pawn_move(moves, (row,col), (row+1,col+1), self.board)
                 elif (row+1,col+1) == self.en_passant_coords:
                     moves.append(Move((row,col), (row+1,col+1), self.board, 
                                       is_en_passant_valid=True))
@@ -382,8 +847,8 @@ class GameState():
         if self.board[row][col+1] == "__" and self.board[row][col+2] == "__":
             if (not self.square_under_attacK(row, col+1) and 
                 not self.square_under_attacK(row, col+2)):
-                moves.append(Move((row, col)), (row, col+2), 
-                             self.board, is_castling_valid=True)
+                moves.append(Move((row, col), (row, col+2), 
+                                  self.board, is_castling_valid=True))
 
     def get_queen_side_castle_moves(self, row, col, moves):
         if (self.board[row][col-1] == "__" and 
@@ -391,8 +856,39 @@ class GameState():
             self.board[row][col-3] == "__"):
             if (not self.square_under_attacK(row, col-1) and 
                 not self.square_under_attacK(row, col-2)):
-                moves.append(Move((row, col)), (row, col-2), 
-                             self.board, is_castling_valid=True)
+                moves.append(Move((row, col), (row, col-2), 
+                                  self.board, is_castling_valid=True))
+
+def append_pawn_move(moves, start_square, end_square, board):
+    """
+    Append a pawn move, or one move per promotion piece (queen first)
+    if it reaches the last row.
+    """
+    if end_square[0] == 0 or end_square[0] == 7:
+        for piece in ("Q", "R", "B", "N"):
+            moves.append(Move(start_square, end_square, board, promotion_piece=piece))
+    else:
+        moves.append(Move(start_square, end_square, board))
+
+def create_game_state(backend="array", fen=None):
+    """
+    Build a GameState with the chosen board backend:
+        "array" = 8x8 np array of strings (GameState)
+        "bitboard" = 64 bit piece sets (bitboard.BitboardGameState)
+    Both share the same API, so main.py can use either one.
+    If a FEN string is given the game starts from that position.
+    """
+    if backend == "bitboard":
+        from bitboard import BitboardGameState
+        game_state = BitboardGameState()
+    elif backend == "array":
+        game_state = GameState()
+    else:
+        raise ValueError("Unknown backend: " + str(backend))
+    if fen is not None:
+        from fen import set_fen
+        set_fen(game_state, fen)
+    return game_state
 
 class CastlingRights():
     def __init__(self, wK_side, wQ_side, bK_side, bQ_side) -> bool:
@@ -401,7 +897,23 @@ class CastlingRights():
         self.bK_side = bK_side
         self.bQ_side = bQ_side
 
+#Move.move_id layout (16 bits), square = row * 8 + col:
+#   bits 0-5 start square, bits 6-11 end square,
+#   bits 12-13 promotion piece (index in PROMOTION_PIECES), bit 14 promotion,
+#   bit 15 special move: en passant for a pawn, castling for a king
+PROMOTION_PIECES = ("N", "B", "R", "Q")
+PROMOTION_BIT = 1 << 14
+SPECIAL_BIT = 1 << 15
+
 class Move():
+    """
+    __slots__ keeps every move small (no per-instance __dict__), which matters
+    since the generators create one for every pseudo-legal move.
+    """
+    __slots__ = ("start_row", "start_col", "end_row", "end_col", 
+                 "piece_moved", "piece_captured", "is_en_passant_valid", 
+                 "is_castling_valid", "is_pawn_promotion", "promotion_piece", "move_id")
+
     ranks_to_row = {"1":7, "2":6, "3":5, "4":4, "5":3, "6":2, "7":1, "8":0}
     rows_to_ranks = {chess_notation: python_notation for python_notation, 
                      chess_notation in ranks_to_row.items()}
@@ -411,7 +923,7 @@ class Move():
                      chess_notation in files_to_col.items()}
 
     def __init__(self, start_square, end_square, board, 
-                 is_en_passant_valid=False, is_castling_valid=False):
+                 is_en_passant_valid=False, is_castling_valid=False, promotion_piece="Q"):
         self.start_row = start_square[0]
         self.start_col = start_square[1]
         self.end_row = end_square[0]
@@ -431,29 +943,54 @@ class Move():
         #promotions
         self.is_pawn_promotion = ((self.piece_moved == "wP" and self.end_row == 0) or 
                                   (self.piece_moved == "bP" and self.end_row == 7))
-            
+        self.promotion_piece = promotion_piece if self.is_pawn_promotion else None
 
-        self.move_id = (self.start_row * 256 + 
-                        self.start_col * 64 + 
-                        self.end_row * 8 + self.end_col)
+        self.move_id = ((self.start_row * 8 + self.start_col) | 
+                        (self.end_row * 8 + self.end_col) << 6)
+        if self.is_pawn_promotion:
+            self.move_id |= PROMOTION_PIECES.index(promotion_piece) << 12 | PROMOTION_BIT
+        elif is_en_passant_valid or is_castling_valid:
+            self.move_id |= SPECIAL_BIT
 
     def __eq__(self, other: object) -> bool:
         """
-        
+        Same squares and promotion piece. The special bit is left out since the
+        position decides it (a move built from two clicks in main.py doesn't know).
         """
         if isinstance(other, Move):
-            return self.move_id == other.move_id
+            return (self.move_id ^ other.move_id) & 0x7FFF == 0
         return False
 
+    def __hash__(self):
+        return self.move_id & 0x7FFF
+
     def get_chess_notations(self):
         """
-        
+        Long algebraic notation as used by UCI: "e2e4", promotions add the
+        piece in lower case: "e7e8q".
         """
-        return (self.get_rank_file(self.start_row, self.start_col) + 
-                self.get_rank_file(self.end_row, self.end_col))
+        notation = (self.get_rank_file(self.start_row, self.start_col) + 
+                    self.get_rank_file(self.end_row, self.end_col))
+        if self.is_pawn_promotion:
+            notation += self.promotion_piece.lower()
+        return notation
     
     def get_rank_file(self, row, col):
         """
         
         """
-        return self.cols_to_files[col] + self.rows_to_ranks[row]
\ No newline at end of file
+        return self.cols_to_files[col] + self.rows_to_ranks[row]
+
+def unpack_move(move_id, board):
+    """
+    Build the Move for a 16 bit move_id on the given board (the inverse of 
+    Move.move_id), e.g. for moves stored in the transposition table.
+    """
+    start_square = divmod(move_id & 0x3F, 8)
+    end_square = divmod((move_id >> 6) & 0x3F, 8)
+    special = move_id & SPECIAL_BIT != 0
+    is_king = board[start_square[0]][start_square[1]][1] == "K"
+    return Move(start_square, end_square, board, 
+                is_en_passant_valid=special and not is_king, 
+                is_castling_valid=special and is_king, 
+                promotion_piece=PROMOTION_PIECES[(move_id >> 12) & 3])
@@ -0,0 +1,221 @@
+# Evaluation: material + piece-square tables, tapered between midgame and endgame
+import numpy as np
+
+# NOTE's
+"""
+Every piece is worth its material value plus a bonus (or penalty) for the
+square it stands on (piece-square table, PST). There are two sets of values,
+one for the midgame and one for the endgame, and the final score blends
+them by the game phase: 24 with all minor/major pieces on the board
+(knight/bishop = 1, rook = 2, queen = 4), going down to 0 as they get traded.
+
+Because the score is a sum over the pieces, GameState keeps the running
+totals (mg_score, eg_score, phase) in set_square, so a move only changes the
+squares it touches and evaluate() never has to look at the 64 squares.
+Scores are from white's point of view (white pieces +, black pieces -),
+evaluate() flips it for the side to move.
+
+Tables are written from white's side with rank 8 (row 0) on top, the same
+way the board is; black pieces read them upside down.
+"""
+
+PIECES = ("wP", "wN", "wB", "wR", "wQ", "wK",
+          "bP", "bN", "bB", "bR", "bQ", "bK")
+#Integer piece codes for NumPy boards: 0 = empty, then PIECES in order
+PIECE_CODES = {"__": 0}
+PIECE_CODES.update({piece: i+1 for i, piece in enumerate(PIECES)})
+
+MAX_PHASE = 24
+PHASE_WEIGHTS = {"P": 0, "N": 1, "B": 1, "R": 2, "Q": 4, "K": 0}
+MG_VALUES = {"P": 82, "N": 337, "B": 365, "R": 477, "Q": 1025, "K": 0}
+EG_VALUES = {"P": 94, "N": 281, "B": 297, "R": 512, "Q": 936, "K": 0}
+
+PAWN_MG = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     10,  10,  20,  30,  30,  20,  10,  10,
+      5,   5,  10,  25,  25,  10,   5,   5,
+      0,   0,   0,  20,  20,   0,   0,   0,
+      5,  -5, -10,   0,   0, -10,  -5,   5,
+      5,  10,  10, -20, -20,  10,  10,   5,
+      0,   0,   0,   0,   0,   0,   0,   0)
+PAWN_EG = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+     80,  80,  80,  80,  80,  80,  80,  80,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     30,  30,  30,  30,  30,  30,  30,  30,
+     15,  15,  15,  15,  15,  15,  15,  15,
+      5,   5,   5,   5,   5,   5,   5,   5,
+      0,   0,   0,   0,   0,   0,   0,   0,
+      0,   0,   0,   0,   0,   0,   0,   0)
+KNIGHT = (
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20,   0,   0,   0,   0, -20, -40,
+    -30,   0,  10,  15,  15,  10,   0, -30,
+    -30,   5,  15,  20,  20,  15,   5, -30,
+    -30,   0,  15,  20,  20,  15,   0, -30,
+    -30,   5,  10,  15,  15,  10,   5, -30,
+    -40, -20,   0,   5,   5,   0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50)
+BISHOP = (
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,  10,  10,   5,   0, -10,
+    -10,   5,   5,  10,  10,   5,   5, -10,
+    -10,   0,  10,  10,  10,  10,   0, -10,
+    -10,  10,  10,  10,  10,  10,  10, -10,
+    -10,   5,   0,   0,   0,   0,   5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20)
+ROOK = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+      5,  10,  10,  10,  10,  10,  10,   5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+      0,   0,   0,   5,   5,   0,   0,   0)
+QUEEN = (
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,   5,   5,   5,   0, -10,
+     -5,   0,   5,   5,   5,   5,   0,  -5,
+      0,   0,   5,   5,   5,   5,   0,  -5,
+    -10,   5,   5,   5,   5,   5,   0, -10,
+    -10,   0,   5,   0,   0,   0,   0, -10,
+    -20, -10, -10,  -5,  -5, -10, -10, -20)
+KING_MG = (
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+     20,  20,   0,   0,   0,   0,  20,  20,
+     20,  30,  10,   0,   0,  10,  30,  20)
+KING_EG = (
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10,   0,   0, -10, -20, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -30,   0,   0,   0,   0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50)
+
+MG_PST = {"P": PAWN_MG, "N": KNIGHT, "B": BISHOP, "R": ROOK, "Q": QUEEN, "K": KING_MG}
+EG_PST = {"P": PAWN_EG, "N": KNIGHT, "B": BISHOP, "R": ROOK, "Q": QUEEN, "K": KING_EG}
+
+def _signed_tables(values, pst):
+    """
+    {piece: 64 scores} with material added, black mirrored and negated.
+    "__" is all zeros so set_square can look up empty squares too.
+    """
+    tables = {"__": (0,) * 64}
+    for piece in PIECES:
+        table = pst[piece[1]]
+        if piece[0] == "w":
+            tables[piece] = tuple(values[piece[1]] + table[sq] for sq in range(64))
+        else:
+            tables[piece] = tuple(-(values[piece[1]] + table[(7 - sq // 8) * 8 + sq % 8])
+                                  for sq in range(64))
+    return tables
+
+#MG_TABLE[piece][row * 8 + col], what the piece adds to the white-minus-black total
+MG_TABLE = _signed_tables(MG_VALUES, MG_PST)
+EG_TABLE = _signed_tables(EG_VALUES, EG_PST)
+PHASE = {"__": 0}
+PHASE.update({piece: PHASE_WEIGHTS[piece[1]] for piece in PIECES})
+
+def compute_scores(board):
+    """
+    (mg_score, eg_score, phase) of a board from scratch.
+    """
+    mg_score = eg_score = phase = 0
+    for row in range(8):
+        for col in range(8):
+            piece = board[row][col]
+            mg_score += MG_TABLE[piece][row * 8 + col]
+            eg_score += EG_TABLE[piece][row * 8 + col]
+            phase += PHASE[piece]
+    return mg_score, eg_score, phase
+
+def taper(mg_score, eg_score, phase):
+    """
+    Blend the midgame and endgame scores by the phase (more pieces = more midgame).
+    """
+    if phase > MAX_PHASE:
+        phase = MAX_PHASE #Early promotions can push it past the start
+    return (mg_score * phase + eg_score * (MAX_PHASE - phase)) // MAX_PHASE
+
+def evaluate(game_state):
+    """
+    Score from the side to move's point of view, read from the running totals.
+    """
+    score = taper(game_state.mg_score, game_state.eg_score, game_state.phase)
+    return score if game_state.white_turn else -score
+
+KING_ZONE_PENALTY = 6 # midgame score lost per attacked square around the king
+#KING_ZONES[sq]: the king's square and the squares next to it, as a 64 bit mask
+KING_ZONES = tuple(sum(1 << (row * 8 + col)
+                       for row in range(max(sq // 8 - 1, 0), min(sq // 8 + 2, 8))
+                       for col in range(max(sq % 8 - 1, 0), min(sq % 8 + 2, 8)))
+                   for sq in range(64))
+
+def king_safety(game_state):
+    """
+    Midgame king safety from white's point of view: every square of a
+    king's zone the other side attacks costs KING_ZONE_PENALTY. The attacks
+    come from the GameState attack-map cache (get_attack_map), so they're
+    shared with the check and castling tests of the same position.
+    """
+    white_king = game_state.white_king_loc[0] * 8 + game_state.white_king_loc[1]
+    black_king = game_state.black_king_loc[0] * 8 + game_state.black_king_loc[1]
+    white_danger = bin(game_state.get_attack_map(False) & KING_ZONES[white_king]).count("1")
+    black_danger = bin(game_state.get_attack_map(True) & KING_ZONES[black_king]).count("1")
+    return (black_danger - white_danger) * KING_ZONE_PENALTY
+
+def evaluate_with_king_safety(game_state):
+    """
+    evaluate() plus the king_safety term (slower: it needs both attack maps).
+    Pass it as Searcher(evaluate=evaluate_with_king_safety).
+    """
+    score = taper(game_state.mg_score + king_safety(game_state), game_state.eg_score,
+                  game_state.phase)
+    return score if game_state.white_turn else -score
+
+#Same tables as NumPy arrays indexed by [piece code, square] for the batch path
+MG_ARRAY = np.array([MG_TABLE[piece] for piece in ("__",) + PIECES], dtype=np.int32)
+EG_ARRAY = np.array([EG_TABLE[piece] for piece in ("__",) + PIECES], dtype=np.int32)
+PHASE_ARRAY = np.array([PHASE[piece] for piece in ("__",) + PIECES], dtype=np.int32)
+
+def encode_board(board):
+    """
+    8x8 board of piece strings -> (8, 8) int8 array of PIECE_CODES.
+    """
+    return np.array([[PIECE_CODES[piece] for piece in row] for row in board], dtype=np.int8)
+
+def encode_boards(game_states):
+    """
+    Many positions -> (N, 8, 8) int8 array, ready for evaluate_batch.
+    """
+    boards = np.zeros((len(game_states), 8, 8), dtype=np.int8)
+    for i, game_state in enumerate(game_states):
+        boards[i] = encode_board(game_state.board)
+    return boards
+
+def evaluate_batch(boards, white_turn=None):
+    """
+    Full recompute for many boards at once: (N, 8, 8) piece codes -> (N,) scores.
+    Scores are from white's point of view, unless white_turn (N,) bools is
+    given, then they are from the side to move's point of view like evaluate().
+    """
+    codes = np.asarray(boards).reshape(-1, 64).astype(np.intp)
+    squares = np.arange(64)
+    mg_scores = MG_ARRAY[codes, squares].sum(axis=1)
+    eg_scores = EG_ARRAY[codes, squares].sum(axis=1)
+    phases = np.minimum(PHASE_ARRAY[codes].sum(axis=1), MAX_PHASE)
+    scores = (mg_scores * phases + eg_scores * (MAX_PHASE - phases)) // MAX_PHASE
+    if white_turn is not None:
+        scores = np.where(np.asarray(white_turn), scores, -scores)
+    return scores
@@ -0,0 +1,219 @@
+# FEN/EPD import and export for GameState
+from engine import CastlingRights
+
+# NOTE's
+"""
+FEN = Forsyth-Edwards Notation, one line that describes a whole position:
+    rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1
+    1. pieces from rank 8 (row 0) to rank 1 (row 7), digits = empty squares,
+       upper case = white, lower case = black
+    2. side to move ("w" or "b")
+    3. castling rights ("KQkq", "-" for none)
+    4. en passant square ("e3", "-" for none)
+    5. halfmove clock (plies since the last capture or pawn move)
+    6. fullmove number (starts at 1, goes up after every black move)
+EPD = Extended Position Description, the first four FEN fields followed by
+    operations like: bm e4; id "test 1";
+    EPD files are read one line at a time, so files with hundreds of
+    thousands of positions never have to fit in memory.
+"""
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+def parse_square(square):
+    """
+    "e3" -> (row, col), same coords as the board.
+    """
+    if (len(square) != 2 or square[0] not in "abcdefgh" or
+        square[1] not in "12345678"):
+        raise ValueError("Invalid square: " + square)
+    return 8 - int(square[1]), ord(square[0]) - ord("a")
+
+def square_name(row, col):
+    """
+    (row, col) -> "e3"
+    """
+    return "abcdefgh"[col] + str(8 - row)
+
+def parse_placement(placement):
+    """
+    First FEN field -> 8 rows of 8 piece strings ("wK", "bP", "__", ...).
+    """
+    ranks = placement.split("/")
+    if len(ranks) != 8:
+        raise ValueError("Invalid FEN placement: " + placement)
+    board = []
+    for rank in ranks:
+        row = []
+        for char in rank:
+            if char.isdigit():
+                row.extend(["__"] * int(char))
+            elif char.upper() in "PNBRQK":
+                row.append(("w" if char.isupper() else "b") + char.upper())
+            else:
+                raise ValueError("Invalid FEN piece: " + char)
+        if len(row) != 8:
+            raise ValueError("Invalid FEN rank: " + rank)
+        board.append(row)
+    return board
+
+def parse_fen(fen):
+    """
+    FEN string -> (board, white_turn, castling_rights, en_passant_coords,
+                   halfmove_clock, fullmove_number)
+    Missing clocks (4 field FEN/EPD positions) default to 0 and 1.
+    """
+    fields = fen.split()
+    if not 4 <= len(fields) <= 6:
+        raise ValueError("Invalid FEN: " + fen)
+    board = parse_placement(fields[0])
+    if fields[1] not in ("w", "b"):
+        raise ValueError("Invalid FEN side to move: " + fields[1])
+    castling = fields[2]
+    if castling != "-" and (not castling or any(c not in "KQkq" for c in castling)):
+        raise ValueError("Invalid FEN castling rights: " + castling)
+    castling_rights = CastlingRights("K" in castling, "Q" in castling,
+                                     "k" in castling, "q" in castling)
+    en_passant_coords = () if fields[3] == "-" else parse_square(fields[3])
+    try:
+        halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+    except ValueError:
+        raise ValueError("Invalid FEN move clocks: " + fen) from None
+    return (board, fields[1] == "w", castling_rights, en_passant_coords,
+            halfmove_clock, fullmove_number)
+
+def set_fen(game_state, fen):
+    """
+    Load a FEN position into game_state (either backend).
+    """
+    game_state.load_position(*parse_fen(fen))
+    return game_state
+
+def get_halfmove_clock(game_state):
+    """
+    Plies since the last capture or pawn move (kept by make_move).
+    """
+    return game_state.halfmove_clock
+
+def get_fullmove_number(game_state):
+    """
+    Fullmove number of the current position, counted from the starting one.
+    """
+    plies = len(game_state.move_log)
+    #If black moved first, the first move already completes a fullmove
+    black_started = game_state.white_turn == (plies % 2 == 1)
+    return game_state.start_fullmove_number + (plies + black_started) // 2
+
+def get_placement(board):
+    """
+    8 rows of piece strings -> first FEN field.
+    """
+    ranks = []
+    for row in board:
+        rank = ""
+        empty = 0
+        for piece in row:
+            if piece == "__":
+                empty += 1
+                continue
+            if empty:
+                rank += str(empty)
+                empty = 0
+            rank += piece[1] if piece[0] == "w" else piece[1].lower()
+        if empty:
+            rank += str(empty)
+        ranks.append(rank)
+    return "/".join(ranks)
+
+def get_epd_fields(game_state):
+    """
+    The four position fields shared by FEN and EPD.
+    """
+    rights = game_state.get_castling_rights
+    castling = (("K" if rights.wK_side else "") + ("Q" if rights.wQ_side else "") +
+                ("k" if rights.bK_side else "") + ("q" if rights.bQ_side else ""))
+    en_passant = "-"
+    if game_state.en_passant_coords:
+        en_passant = square_name(*game_state.en_passant_coords)
+    return " ".join((get_placement(game_state.board),
+                     "w" if game_state.white_turn else "b",
+                     castling or "-", en_passant))
+
+def get_fen(game_state):
+    """
+    game_state -> FEN string.
+    """
+    return (get_epd_fields(game_state) + " " + str(get_halfmove_clock(game_state)) +
+            " " + str(get_fullmove_number(game_state)))
+
+def parse_epd(line):
+    """
+    One EPD line -> (fen, operations), operations = {"bm": "e4", "id": "test 1"}.
+    hmvc/fmvn operations become the FEN move clocks. Lines that are full
+    FEN strings (clocks after the four fields) are accepted as well.
+    """
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("Invalid EPD: " + line)
+    rest = fields[4] if len(fields) > 4 else ""
+    clocks = rest.split(None, 2)
+    halfmove, fullmove = "0", "1"
+    if len(clocks) >= 2 and clocks[0].isdigit() and clocks[1].isdigit():
+        halfmove, fullmove = clocks[0], clocks[1]
+        rest = clocks[2] if len(clocks) > 2 else ""
+
+    operations = {}
+    for operation in split_operations(rest):
+        parts = operation.split(None, 1)
+        operand = parts[1].strip() if len(parts) > 1 else ""
+        if len(operand) >= 2 and operand[0] == operand[-1] == '"':
+            operand = operand[1:-1]
+        operations[parts[0]] = operand
+    halfmove = operations.get("hmvc", halfmove)
+    fullmove = operations.get("fmvn", fullmove)
+    fen = " ".join(fields[:4]) + " " + halfmove + " " + fullmove
+    return fen, operations
+
+def split_operations(text):
+    """
+    Split EPD operations on ";", except inside quoted strings.
+    """
+    operations = []
+    current = ""
+    quoted = False
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        if char == ";" and not quoted:
+            if current.strip():
+                operations.append(current.strip())
+            current = ""
+        else:
+            current += char
+    if current.strip():
+        operations.append(current.strip())
+    return operations
+
+def get_epd(game_state, operations=None):
+    """
+    game_state -> EPD line, with optional {opcode: operand} operations.
+    """
+    line = get_epd_fields(game_state)
+    for opcode, operand in (operations or {}).items():
+        operand = str(operand)
+        if " " in operand or ";" in operand:
+            operand = '"' + operand + '"'
+        line += " " + opcode + (" " + operand if operand else "") + ";"
+    return line
+
+def read_epd(path):
+    """
+    Stream (fen, operations) from an EPD file one line at a time.
+    Blank lines and lines starting with "#" are skipped.
+    """
+    with open(path) as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield parse_epd(line)
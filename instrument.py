@@ -0,0 +1,157 @@
+# Instrumentation: count and time the GameState hot paths during a search
+import cProfile
+import json
+import pstats
+import time
+
+# NOTE's
+"""
+Instrumentation.attach(game_state, searcher) swaps the methods listed in
+PHASES for wrappers on that one GameState instance (instance attributes
+shadow the class methods), plus the searcher's evaluate function. Each
+wrapper counts its calls and adds up its time with time.perf_counter.
+detach() deletes the wrappers again, so when nothing is attached the
+engine runs the plain methods: no flag is checked anywhere on the hot path,
+which is why it costs nothing when it's off.
+Times are inclusive: get_valid_moves contains get_all_possible_moves,
+filter_legal_moves, ..., and the search's staged move picker calls
+get_valid_piece_moves / get_valid_captures / get_valid_quiets, which
+contain get_split_moves (so does get_all_possible_moves), so the phases
+don't add up to the search time.
+
+For a full call graph use cProfile (profile_search(..., cprofile_path=...)
+or python search.py --cprofile out.prof, then python -m pstats out.prof or
+snakeviz out.prof). py-spy needs no code at all, it samples a running
+process from outside:
+    py-spy record -o search.svg -- python search.py --time 10
+    py-spy top --pid <pid of uci.py>
+Both see the wrapper frames as "timed" while this layer is attached, so
+profile with it detached unless the counters are wanted as well.
+"""
+
+PHASES = ("get_valid_moves", "get_valid_piece_moves", "get_valid_captures", "get_valid_quiets",
+          "get_all_possible_moves", "get_split_moves", "filter_legal_moves",
+          "check_for_pins_and_checks", "in_check", "get_attack_map",
+          "make_move", "undo_last_move")
+
+class Instrumentation():
+    def __init__(self, phases=PHASES):
+        """
+        Counters and timers per phase, see the NOTE's.
+        """
+        self.phases = phases
+        self.calls = {}
+        self.seconds = {}
+        self.game_state = None
+        self.searcher = None
+        self.original_evaluate = None
+        self.saved = {}
+        self.reset()
+
+    def reset(self):
+        self.calls = {phase: 0 for phase in self.phases + ("evaluate",)}
+        self.seconds = {phase: 0.0 for phase in self.phases + ("evaluate",)}
+
+    def timed(self, phase, function):
+        """
+        Wrap function so every call is counted and timed under phase.
+        """
+        calls = self.calls
+        seconds = self.seconds
+        perf_counter = time.perf_counter
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds[phase] += perf_counter() - start
+                calls[phase] += 1
+        return timed
+
+    def attach(self, game_state, searcher=None):
+        """
+        Start counting on game_state (and searcher.evaluate, if given).
+        """
+        self.detach()
+        self.game_state = game_state
+        #Other layers (nnue.NNUEvaluator) may have wrapped these already
+        self.saved = {phase: game_state.__dict__.get(phase) for phase in self.phases}
+        for phase in self.phases:
+            setattr(game_state, phase, self.timed(phase, getattr(game_state, phase)))
+        if searcher is not None:
+            self.searcher = searcher
+            self.original_evaluate = searcher.evaluate
+            searcher.evaluate = self.timed("evaluate", searcher.evaluate)
+        return self
+
+    def detach(self):
+        """
+        Put the plain methods back.
+        """
+        if self.game_state is not None:
+            for phase, method in self.saved.items():
+                if method is None:
+                    self.game_state.__dict__.pop(phase, None)
+                else:
+                    setattr(self.game_state, phase, method)
+            self.game_state = None
+        if self.searcher is not None:
+            self.searcher.evaluate = self.original_evaluate
+            self.searcher = None
+
+    def get_report(self, total_seconds=None):
+        """
+        {phase: {"calls", "seconds", "us_per_call", "share"}}, share being the
+        fraction of total_seconds (the search time) spent in the phase.
+        """
+        report = {}
+        for phase in self.calls:
+            calls = self.calls[phase]
+            seconds = self.seconds[phase]
+            report[phase] = {"calls": calls, "seconds": round(seconds, 6),
+                             "us_per_call": round(seconds / calls * 1e6, 2) if calls else 0.0,
+                             "share": round(seconds / total_seconds, 4) if total_seconds else None}
+        return report
+
+    def format_report(self, total_seconds=None):
+        lines = [f"{'phase':26} {'calls':>10} {'seconds':>9} {'us/call':>9} {'share':>7}"]
+        for phase, row in self.get_report(total_seconds).items():
+            share = f"{row['share']:7.1%}" if row["share"] is not None else "       "
+            lines.append(f"{phase:26} {row['calls']:>10} {row['seconds']:9.3f} "
+                         f"{row['us_per_call']:9.2f} {share}")
+        return "\n".join(lines)
+
+    def write_report(self, path, total_seconds=None):
+        """
+        Export the report as JSON.
+        """
+        with open(path, "w") as file:
+            json.dump(self.get_report(total_seconds), file, indent=2)
+
+def profile_search(game_state, searcher, max_depth=None, time_limit=None,
+                   cprofile_path=None, on_info=None):
+    """
+    Run one search with the instrumentation attached (and cProfile, if
+    cprofile_path is given). Returns (SearchResult, Instrumentation).
+    """
+    instrumentation = Instrumentation().attach(game_state, searcher)
+    profiler = cProfile.Profile() if cprofile_path else None
+    kwargs = {"time_limit": time_limit, "on_info": on_info}
+    if max_depth is not None:
+        kwargs["max_depth"] = max_depth
+    try:
+        if profiler is not None:
+            profiler.enable()
+        result = searcher.search(game_state, **kwargs)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(cprofile_path)
+        instrumentation.detach()
+    return result, instrumentation
+
+def print_cprofile(path, limit=25):
+    """
+    The top functions of a cProfile dump by cumulative time.
+    """
+    pstats.Stats(path).sort_stats("cumulative").print_stats(limit)
@@ -1,7 +1,12 @@
 # Handle game state, user input, and displaying said game state
 from engine import *
+from search import Searcher, find_best_move
+from tt import TranspositionTable
+from book import OpeningBook
+from tablebase import Tablebase
 import pygame as p
 import numpy as np 
+import logging
 
 # TODO 
 # Put things in comprehension forms for better optimization...
@@ -13,7 +18,17 @@ WIDTH = HEIGHT = 512 # Maybe less for better efficiency?
 DIMENSIONS = 8 # chessboard dimensions
 SQUARE_SIZE = HEIGHT // DIMENSIONS
 MAX_FPS = 10 # Lower probably, like 10-20
+BACKEND = "array" # "array" or "bitboard", see engine.create_game_state
+WHITE_HUMAN = True # False = the engine plays that color
+BLACK_HUMAN = True
+ENGINE_TIME = 2.0 # seconds the engine gets per move
+HASH_MB = 16 # transposition table size
+BOOK_FILE = None # opening book .bin for the engine (see book.py), None = no book
+TABLEBASE_DIR = None # directory of endgame tables (see tablebase.py), None = none
 IMAGES = {}
+LOG_LEVEL = logging.INFO # logging.DEBUG also shows engine internals (checkmate/stalemate found, ...)
+
+logger = logging.getLogger(__name__)
 
 def load_images():
     """
@@ -26,10 +41,14 @@ def load_images():
                                           (SQUARE_SIZE, SQUARE_SIZE))
 
 def main():
+    logging.basicConfig(level=LOG_LEVEL, format="%(message)s")
     screen = p.display.set_mode((WIDTH, HEIGHT))
     clock = p.time.Clock()
     screen.fill(p.Color("white")) # I don't think I need this...
-    game_state = GameState()
+    game_state = create_game_state(BACKEND)
+    book = OpeningBook(BOOK_FILE) if BOOK_FILE else None
+    tablebase = Tablebase(TABLEBASE_DIR) if TABLEBASE_DIR else None
+    searcher = Searcher(tt=TranspositionTable(HASH_MB), book=book, tablebase=tablebase)
     valid_moves = game_state.get_valid_moves()
     move_made = False # flag var for when move is made
     load_images()
@@ -37,10 +56,12 @@ def main():
     square_selected = () # tuple: row,col --> keeps track of last click
     player_clicks = [] # keep track of player clicks [tuple:(row, col)]
     while running:
+        human_turn = ((game_state.white_turn and WHITE_HUMAN) or 
+                      (not game_state.white_turn and BLACK_HUMAN))
         for e in p.event.get():
             if e.type == p.QUIT:
                 running = False
-            elif e.type == p.MOUSEBUTTONDOWN:
+            elif e.type == p.MOUSEBUTTONDOWN and human_turn:
                 loc = p.mouse.get_pos() # x,y
                 col = loc[0]//SQUARE_SIZE
                 row = loc[1]//SQUARE_SIZE
@@ -54,7 +75,7 @@ def main():
                     move = Move(player_clicks[0], player_clicks[1], game_state.board)
                     for i in range(len(valid_moves)):
                         if move == valid_moves[i]:
-                            print(move.get_chess_notations())
+                            logger.info(move.get_chess_notations())
                             game_state.make_move(valid_moves[i])
                             move_made = True
                             square_selected = ()
@@ -66,8 +87,18 @@ def main():
                     game_state.undo_last_move()
                     move_made = True
 
+        game_over = game_state.check_mate or game_state.stale_mate or game_state.draw
+        if not human_turn and not move_made and not game_over:
+            engine_move = find_best_move(game_state, ENGINE_TIME, searcher=searcher)
+            if engine_move is not None:
+                logger.info("Engine: " + engine_move.get_chess_notations())
+                game_state.make_move(engine_move)
+                move_made = True
+
         if move_made:
             valid_moves = game_state.get_valid_moves()
+            if game_state.update_draw_state():
+                logger.info("Draw by " + game_state.draw_reason)
             move_made = False
 
         draw_game_state(screen, game_state)
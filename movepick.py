@@ -0,0 +1,138 @@
+# Staged move picker: hand the search its moves one at a time, best guesses first
+from evaluation import PIECE_CODES
+
+# NOTE's
+"""
+Alpha-beta usually cuts off after the first move or two, so most of the
+work of generating and sorting every move at a node is wasted. pick_moves is
+a generator that only does the work of a stage once the search asks for a
+move from it:
+    1. hash move: the best move the transposition table remembers for this
+       position. Only the moves of that one piece are generated to check it
+       is legal (get_valid_piece_moves), so a hash move cutoff never
+       generates the rest.
+    2. captures (and promotions), most valuable victim / least valuable
+       attacker (MVV-LVA) first. Each one is picked from the remaining
+       captures when it's needed instead of sorting them all up front.
+    3. killer moves: quiet moves that caused a cutoff at the same ply in a
+       sibling position, they often refute this one too.
+    4. the other quiet moves, by their history score: how much cutting off
+       they did anywhere in the tree so far (MoveHistory).
+Pins and checks are worked out once per node (check_for_pins_and_checks)
+and shared by every stage. Captures and quiet moves are generated
+separately (get_valid_captures, get_valid_quiets), so a cutoff in stage 1
+or 2 never builds the quiet moves at all.
+"""
+
+PIECE_VALUES = {"P": 100, "N": 320, "B": 330, "R": 500, "Q": 900, "K": 0}
+KILLERS_PER_PLY = 2
+MAX_PLY = 128
+HISTORY_LIMIT = 1 << 20 # scores are halved once one gets this big
+
+def mvv_lva(move):
+    """
+    Capture score: victim value first, the cheaper attacker breaks ties.
+    """
+    score = PIECE_VALUES[move.piece_captured[1]] * 10 if move.piece_captured != "__" else 0
+    if move.is_pawn_promotion:
+        score += PIECE_VALUES[move.promotion_piece] * 10
+    return score - PIECE_VALUES[move.piece_moved[1]] // 10
+
+class MoveHistory():
+    def __init__(self):
+        """
+        Killer moves per ply and the history table of quiet moves,
+        indexed by [piece code * 64 + end square].
+        """
+        self.killers = [[0] * KILLERS_PER_PLY for _ in range(MAX_PLY)]
+        self.history = [0] * (len(PIECE_CODES) * 64)
+
+    def new_search(self):
+        """
+        Killers are position specific, so they go; history is halved so the
+        last search still counts but the next one can overrule it.
+        """
+        for killers in self.killers:
+            for i in range(KILLERS_PER_PLY):
+                killers[i] = 0
+        self.history = [score // 2 for score in self.history]
+
+    def get_killers(self, ply):
+        return self.killers[ply] if ply < MAX_PLY else ()
+
+    def get_history(self, move):
+        return self.history[PIECE_CODES[move.piece_moved] * 64 + move.end_row * 8 + move.end_col]
+
+    def update(self, move, depth, ply):
+        """
+        A quiet move caused a beta cutoff: make it a killer of this ply and
+        raise its history score (deeper cutoffs count more).
+        """
+        if ply < MAX_PLY:
+            killers = self.killers[ply]
+            if killers[0] != move.move_id:
+                killers[1:] = killers[:-1]
+                killers[0] = move.move_id
+        index = PIECE_CODES[move.piece_moved] * 64 + move.end_row * 8 + move.end_col
+        self.history[index] += depth * depth
+        if self.history[index] >= HISTORY_LIMIT:
+            self.history = [score // 2 for score in self.history]
+
+def is_quiet(move):
+    return move.piece_captured == "__" and not move.is_pawn_promotion
+
+def pick_moves(game_state, hash_move=0, move_history=None, ply=0):
+    """
+    Yield the legal moves of game_state stage by stage (see the NOTE's).
+    hash_move = move_id from the transposition table (0 = none).
+    If nothing is yielded the side to move has no moves, and
+    game_state.check_mate / stale_mate tell which.
+    """
+    pins_and_checks = game_state.check_for_pins_and_checks()
+    yielded = 0
+    hash_key = hash_move & 0x7FFF
+    if hash_move:
+        start = hash_move & 63
+        for move in game_state.get_valid_piece_moves(start // 8, start % 8, pins_and_checks):
+            if move.move_id & 0x7FFF == hash_key:
+                yielded += 1
+                yield move
+                break
+        else:
+            hash_key = 0 #Not legal here (hash collision), nothing to skip
+
+    captures = [move for move in game_state.get_valid_captures(pins_and_checks)
+                if move.move_id & 0x7FFF != hash_key]
+    scores = [mvv_lva(move) for move in captures]
+    while captures:
+        best = max(range(len(captures)), key=scores.__getitem__)
+        move = captures[best]
+        #Swap-remove, the order of the rest doesn't matter
+        captures[best] = captures[-1]
+        scores[best] = scores[-1]
+        captures.pop()
+        scores.pop()
+        yielded += 1
+        yield move
+
+    quiets = [move for move in game_state.get_valid_quiets(pins_and_checks)
+              if move.move_id & 0x7FFF != hash_key]
+    yielded += len(quiets)
+    #Same flags get_valid_moves would leave, set before the last moves go out
+    in_check = pins_and_checks[1] is not None or pins_and_checks[2]
+    game_state.check_mate = yielded == 0 and in_check
+    game_state.stale_mate = yielded == 0 and not in_check
+    if move_history is None:
+        yield from quiets
+        return
+    for killer in tuple(move_history.get_killers(ply)):
+        if killer and killer & 0x7FFF != hash_key:
+            for i, move in enumerate(quiets):
+                if move.move_id == killer:
+                    quiets[i] = quiets[-1]
+                    quiets.pop()
+                    yield move
+                    break
+
+    quiets.sort(key=move_history.get_history, reverse=True)
+    yield from quiets
@@ -0,0 +1,416 @@
+# Neural network evaluation (NNUE style): a small model from a NumPy weights file, run on the CPU
+from evaluation import PIECES, PIECE_CODES, MG_TABLE, evaluate, encode_board, encode_boards
+from collections import OrderedDict
+import argparse
+import time
+import numpy as np
+
+# NOTE's
+"""
+Input features are (piece, square) pairs, 12 * 64 = 768 of them, seen from
+both sides: from white's side as they are, from black's side with the
+colors swapped and the board flipped, so one set of first layer weights
+serves both. The first layer output (the accumulator) is just the sum of the
+weight rows of the pieces on the board, so a move only has to add and
+subtract the rows of the squares it changes instead of running the layer
+again:
+    accumulator[perspective] = b1 + sum of w1[feature] for every piece
+    x = clip(accumulator[side to move] ++ accumulator[other side], 0, 1)
+    x = clip(x @ w2 + b2, 0, 1) ... the last layer has 1 output, * scale
+The score is from the side to move's point of view, like evaluate().
+
+Weights file (.npz, np.savez): w1 (768, H), b1 (H,), then w2, b2, w3, b3,
+... with the last one giving 1 output, and optionally scale (centipawns per
+unit of output, default 1). w1 rows are feature = (code - 1) * 64 + square,
+codes from evaluation.PIECE_CODES and square = row * 8 + col.
+
+NNUEvaluator(model) is an evaluate function for Searcher. The first time it
+sees a GameState it attaches itself like instrument.py does: make_move,
+undo_last_move, set_square and load_position get wrappers on that instance,
+and the accumulators of that position are built once (attach before the
+search so that is the root). The stack has one slot per ply (top =
+game_state.ply): make_move copies the accumulators onto the next slot and
+set_square adds/subtracts the rows of the changed squares there;
+undo_last_move just steps back a slot, so nothing is ever subtracted back
+and the float sums can't drift. Only undoing past the slot the stack was
+last built from (base) needs a rebuild with accumulate(), done on the next
+make_move or evaluation at that ply, so it happens at most once per ply
+above where the evaluator was attached. check_incremental counts them and
+compares the incremental accumulators with accumulate() during a search. Scores are also kept in an LRU cache keyed
+by the Zobrist hash (transpositions and re-searches hit it).
+Batches (evaluate_boards / evaluate_many) build the accumulators of N
+positions as one-hot feature rows times w1 and run every layer as one
+matrix product, BATCH_SIZE positions at a time. An
+alpha-beta search needs each leaf score before it can go on, so the search
+uses the incremental path and the batch path is for scoring many positions
+at once (datasets, benchmarks).
+
+No trained model ships with the engine: pst_model() builds one that
+reproduces the midgame material + piece-square score of evaluation.py, for
+testing and to have something to play with until a real one is trained.
+"""
+
+FEATURES = len(PIECES) * 64
+ACCUMULATOR_STACK_SIZE = 256 # plies, grows if needed
+DEFAULT_CACHE_SIZE = 1 << 16 # positions
+BATCH_SIZE = 4096 # positions per matrix product in evaluate_boards
+ACCUMULATOR_TOLERANCE = 1e-3 # float32 rounding allowed between incremental and accumulate()
+
+def _feature_tables():
+    """
+    FEATURE_INDEX[perspective, piece code, sq] -> row of the padded w1,
+    FEATURES (a zero row) for empty squares.
+    """
+    table = np.full((2, 13, 64), FEATURES, dtype=np.intp)
+    for code in range(1, 13):
+        swapped = code + 6 if code <= 6 else code - 6
+        for sq in range(64):
+            table[0, code, sq] = (code - 1) * 64 + sq
+            table[1, code, sq] = (swapped - 1) * 64 + (sq ^ 56)
+    return table
+
+FEATURE_INDEX = _feature_tables()
+
+class NNUEModel():
+    def __init__(self, weights):
+        """
+        weights = {"w1", "b1", "w2", "b2", ..., "scale"}, see the NOTE's.
+        """
+        w1 = np.asarray(weights["w1"], dtype=np.float32)
+        if w1.shape[0] != FEATURES:
+            raise ValueError(f"w1 must have {FEATURES} rows, got {w1.shape[0]}")
+        self.hidden = w1.shape[1]
+        #One zero row at the end for empty squares
+        self.w1 = np.vstack((w1, np.zeros((1, self.hidden), dtype=np.float32)))
+        self.b1 = np.asarray(weights["b1"], dtype=np.float32)
+        self.layers = []
+        i = 2
+        while f"w{i}" in weights:
+            self.layers.append((np.asarray(weights[f"w{i}"], dtype=np.float32),
+                                np.asarray(weights[f"b{i}"], dtype=np.float32)))
+            i += 1
+        if not self.layers or self.layers[0][0].shape[0] != 2 * self.hidden:
+            raise ValueError("w2 must have 2 * H rows (both accumulators)")
+        if self.layers[-1][0].shape[1] != 1:
+            raise ValueError("The last layer must have 1 output")
+        self.scale = float(weights["scale"]) if "scale" in weights else 1.0
+        #Both perspectives' rows of every (piece code, square): [code, sq, perspective, H]
+        self.deltas = np.ascontiguousarray(self.w1[FEATURE_INDEX].transpose(1, 2, 0, 3))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as weights:
+            return cls({name: weights[name] for name in weights.files})
+
+    def accumulate(self, codes):
+        """
+        (N, 64) piece codes -> (N, 2, H) accumulators, from scratch: the
+        features as one-hot rows times w1, one matrix product per perspective.
+        """
+        codes = np.asarray(codes, dtype=np.intp).reshape(-1, 64)
+        rows = np.arange(len(codes))[:, None]
+        accumulators = np.empty((len(codes), 2, self.hidden), dtype=np.float32)
+        for perspective in range(2):
+            features = np.zeros((len(codes), FEATURES + 1), dtype=np.float32)
+            features[rows, FEATURE_INDEX[perspective, codes, np.arange(64)]] = 1.0
+            accumulators[:, perspective] = features @ self.w1 + self.b1
+        return accumulators
+
+    def forward(self, accumulators, white_turn):
+        """
+        (N, 2, H) accumulators, (N,) side to move -> (N,) integer scores.
+        """
+        white_turn = np.asarray(white_turn, dtype=bool).reshape(-1, 1)
+        us = np.where(white_turn, accumulators[:, 0], accumulators[:, 1])
+        them = np.where(white_turn, accumulators[:, 1], accumulators[:, 0])
+        x = np.clip(np.concatenate((us, them), axis=1), 0.0, 1.0)
+        for i, (weights, bias) in enumerate(self.layers):
+            x = x @ weights + bias
+            if i < len(self.layers) - 1:
+                x = np.clip(x, 0.0, 1.0)
+        return np.rint(x[:, 0] * self.scale).astype(np.int32)
+
+    def forward_one(self, accumulator, white_turn):
+        """
+        forward() for a single (2, H) accumulator, without the batch overhead.
+        """
+        x = accumulator.ravel() if white_turn else accumulator[::-1].ravel()
+        x = np.clip(x, 0.0, 1.0)
+        for weights, bias in self.layers[:-1]:
+            x = np.clip(x @ weights + bias, 0.0, 1.0)
+        weights, bias = self.layers[-1]
+        return int(round(float(x @ weights[:, 0] + bias[0]) * self.scale))
+
+class NNUEvaluator():
+    def __init__(self, model, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        evaluate(game_state) replacement, see the NOTE's.
+        model = NNUEModel or the path of a weights file.
+        """
+        self.model = NNUEModel.load(model) if isinstance(model, str) else model
+        self.cache_size = cache_size
+        self.cache = OrderedDict() # hash -> score, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.stack = np.zeros((ACCUMULATOR_STACK_SIZE, 2, self.model.hidden), dtype=np.float32)
+        self.top = 0 # = game_state.ply, stack[top] is the current position's slot
+        self.base = 0 # lowest ply whose slot is still valid
+        self.stale = True # stack[top] doesn't match the board (rebuilt before it's used)
+        self.refreshes = 0 # full rebuilds with accumulate()
+        self.tracking = True # False while undo_last_move/load_position rewrite the board
+        self.game_state = None
+        self.saved = {} # game_state's own instance attributes from before attach
+
+    def __call__(self, game_state):
+        key = game_state.hash
+        score = self.cache.get(key)
+        if score is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return score
+        self.misses += 1
+        if game_state is not self.game_state:
+            self.attach(game_state)
+        elif self.stale:
+            self.refresh()
+        score = self.model.forward_one(self.stack[self.top], game_state.white_turn)
+        self.cache[key] = score
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return score
+
+    def attach(self, game_state):
+        """
+        Follow the moves made on game_state from now on.
+        """
+        self.detach()
+        self.game_state = game_state
+        self.saved = {name: game_state.__dict__.get(name)
+                      for name in ("make_move", "undo_last_move", "set_square", "load_position")}
+        make_move = game_state.make_move
+        undo_last_move = game_state.undo_last_move
+        set_square = game_state.set_square
+        load_position = game_state.load_position
+        deltas = self.model.deltas
+
+        def tracked_make_move(move):
+            if self.stale:
+                #Rebuild the parent, not the child: its siblings then come incrementally too
+                self.refresh()
+            top = self.top + 1
+            if top == len(self.stack):
+                self.stack = np.concatenate((self.stack, np.zeros_like(self.stack)))
+            self.stack[top] = self.stack[top-1]
+            self.top = top
+            make_move(move)
+
+        def tracked_undo_last_move():
+            if game_state.ply == 0:
+                return undo_last_move()
+            self.tracking = False
+            try:
+                undo_last_move()
+            finally:
+                self.tracking = True
+            self.top -= 1
+            if self.top < self.base:
+                self.stale = True #Went back past the position the stack was built from
+
+        def tracked_set_square(row, col, piece):
+            if self.tracking and not self.stale:
+                sq = row*8 + col
+                accumulator = self.stack[self.top]
+                accumulator += deltas[PIECE_CODES[piece], sq]
+                accumulator -= deltas[PIECE_CODES[game_state.board[row][col]], sq]
+            set_square(row, col, piece)
+
+        def tracked_load_position(*args, **kwargs):
+            self.tracking = False
+            try:
+                load_position(*args, **kwargs)
+            finally:
+                self.tracking = True
+            self.top = game_state.ply
+            self.stale = True
+
+        game_state.make_move = tracked_make_move
+        game_state.undo_last_move = tracked_undo_last_move
+        game_state.set_square = tracked_set_square
+        game_state.load_position = tracked_load_position
+        self.top = game_state.ply
+        self.refresh()
+        return self
+
+    def detach(self):
+        """
+        Put game_state's methods back the way attach found them.
+        """
+        if self.game_state is not None:
+            for name, method in self.saved.items():
+                if method is None:
+                    self.game_state.__dict__.pop(name, None)
+                else:
+                    setattr(self.game_state, name, method)
+            self.game_state = None
+        self.stale = True
+
+    def refresh(self):
+        """
+        Rebuild the accumulators of the attached position from scratch, in
+        its own slot of the stack, which becomes the new base.
+        """
+        while self.top >= len(self.stack):
+            self.stack = np.concatenate((self.stack, np.zeros_like(self.stack)))
+        self.stack[self.top] = self.model.accumulate(encode_board(self.game_state.board))[0]
+        self.base = self.top
+        self.stale = False
+        self.refreshes += 1
+
+    def clear_cache(self):
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def evaluate_boards(self, boards, white_turn):
+        """
+        (N, 8, 8) piece codes (evaluation.encode_boards), (N,) side to move
+        -> (N,) scores, all in one batch. The cache isn't used.
+        """
+        codes = np.asarray(boards).reshape(-1, 64)
+        white_turn = np.broadcast_to(np.asarray(white_turn, dtype=bool), (len(codes),))
+        scores = np.empty(len(codes), dtype=np.int32)
+        for start in range(0, len(codes), BATCH_SIZE):
+            end = start + BATCH_SIZE
+            scores[start:end] = self.model.forward(self.model.accumulate(codes[start:end]),
+                                                   white_turn[start:end])
+        return scores
+
+    def evaluate_many(self, game_states):
+        """
+        Scores of many GameStates in one batch.
+        """
+        return self.evaluate_boards(encode_boards(game_states),
+                                    [game_state.white_turn for game_state in game_states])
+
+def pst_model(hidden=256, seed=0, value_scale=20000.0):
+    """
+    Weights of a model that scores the midgame material + piece-square
+    total of evaluation.py (see the NOTE's). Hidden unit 0 holds that total
+    / value_scale around 0.5, so it never gets clipped. The other hidden
+    units get random weights but nothing reads them, they are only there so
+    a benchmark pays for a realistic layer size.
+    """
+    generator = np.random.default_rng(seed)
+    w1 = generator.normal(0, 0.05, (FEATURES, hidden)).astype(np.float32)
+    b1 = np.full(hidden, 0.5, dtype=np.float32)
+    for code, piece in enumerate(PIECES, start=1):
+        w1[(code - 1) * 64:code * 64, 0] = np.array(MG_TABLE[piece]) / value_scale
+    w2 = np.zeros((2 * hidden, 1), dtype=np.float32)
+    #(us - them) is twice the total of the side to move
+    w2[0, 0] = value_scale / 2
+    w2[hidden, 0] = -value_scale / 2
+    return {"w1": w1, "b1": b1, "w2": w2, "b2": np.zeros(1, dtype=np.float32),
+            "scale": np.float32(1.0)}
+
+def save_model(path, weights):
+    np.savez(path, **weights)
+
+def check_incremental(evaluator, positions=5, depth=3, seed=0):
+    """
+    Search random positions with evaluator, comparing the incremental
+    accumulator of every evaluated position with accumulate() from scratch.
+    Returns (evaluations, refreshes, largest difference).
+    """
+    from search import Searcher
+    from vectorized import random_game_states
+    evaluations = refreshes = 0
+    worst = 0.0
+
+    def checked_evaluate(game_state):
+        nonlocal evaluations, worst
+        evaluator.cache.clear() #Every call has to go through the accumulators
+        score = evaluator(game_state)
+        expected = evaluator.model.accumulate(encode_board(game_state.board))[0]
+        worst = max(worst, float(np.abs(evaluator.stack[evaluator.top] - expected).max()))
+        evaluations += 1
+        return score
+
+    for game_state in random_game_states(positions, seed=seed):
+        evaluator.detach()
+        evaluator.clear_cache()
+        evaluator.attach(game_state)
+        Searcher(evaluate=checked_evaluate).search(game_state, max_depth=depth)
+        refreshes += evaluator.refreshes
+    evaluator.detach()
+    return evaluations, refreshes, worst
+
+def benchmark(evaluator, positions=2000, depth=3, seed=0):
+    """
+    Throughput of the handcrafted evaluate() against the network: one
+    position per call, one batch of all of them, and inside a search.
+    """
+    from engine import create_game_state
+    from search import Searcher
+    from vectorized import random_game_states
+    game_states = random_game_states(positions, seed=seed)
+    timings = []
+    start = time.perf_counter()
+    for game_state in game_states:
+        evaluate(game_state)
+    timings.append(("handcrafted evaluate", positions / (time.perf_counter() - start)))
+    evaluator.clear_cache()
+    start = time.perf_counter()
+    for game_state in game_states:
+        evaluator.detach()
+        evaluator(game_state)
+    timings.append(("nnue, full refresh", positions / (time.perf_counter() - start)))
+    evaluator.detach()
+    start = time.perf_counter()
+    evaluator.evaluate_many(game_states)
+    timings.append(("nnue, one batch", positions / (time.perf_counter() - start)))
+    for name in timings:
+        print(f"{name[0]:28} {name[1]:12,.0f} positions/s")
+
+    for name, evaluate_function in (("handcrafted", evaluate), ("nnue", evaluator)):
+        if evaluate_function is evaluator:
+            evaluator.clear_cache()
+        game_state = create_game_state()
+        result = Searcher(evaluate=evaluate_function).search(game_state, max_depth=depth)
+        print(f"search depth {depth}, {name:11} {result.nps:12,} nodes/s  "
+              f"({result.nodes} nodes, bestmove {result.best_move.get_chess_notations()})")
+    print(f"nnue cache: {evaluator.hits} hits, {evaluator.misses} misses")
+
+def main():
+    parser = argparse.ArgumentParser(description="NNUE style evaluator tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    create = subparsers.add_parser("pst-model", help="write the piece-square table model")
+    create.add_argument("output", help=".npz file")
+    create.add_argument("--hidden", type=int, default=256)
+    bench = subparsers.add_parser("bench", help="compare throughput with the handcrafted evaluation")
+    bench.add_argument("--model", default=None, help=".npz weights (default: the pst model)")
+    bench.add_argument("--hidden", type=int, default=256, help="pst model size")
+    bench.add_argument("--positions", type=int, default=2000)
+    bench.add_argument("--depth", type=int, default=3)
+    check = subparsers.add_parser("check", help="check the incremental accumulators in a search")
+    check.add_argument("--model", default=None, help=".npz weights (default: the pst model)")
+    check.add_argument("--hidden", type=int, default=256, help="pst model size")
+    check.add_argument("--positions", type=int, default=5)
+    check.add_argument("--depth", type=int, default=3)
+    args = parser.parse_args()
+    if args.command == "pst-model":
+        save_model(args.output, pst_model(args.hidden))
+        return
+    model = NNUEModel.load(args.model) if args.model else NNUEModel(pst_model(args.hidden))
+    if args.command == "bench":
+        benchmark(NNUEvaluator(model), args.positions, args.depth)
+        return
+    evaluations, refreshes, worst = check_incremental(NNUEvaluator(model), args.positions,
+                                                      args.depth)
+    print(f"{evaluations} evaluations, {refreshes} full refreshes, "
+          f"largest accumulator difference {worst:.2e}")
+    if worst > ACCUMULATOR_TOLERANCE:
+        raise SystemExit("Incremental accumulators don't match accumulate()")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+# Multi-core perft and search: split the root moves over a pool of processes
+from concurrent.futures import ProcessPoolExecutor
+from engine import create_game_state
+from fen import get_fen, START_FEN
+from perft import perft
+from search import Searcher, SearchResult, SearchTimeout, MATE_SCORE, MAX_DEPTH
+from tt import TranspositionTable, find_move
+import argparse
+import os
+import time
+
+# NOTE's
+"""
+Python threads can't run move generation at the same time (GIL), so the
+work is split over processes instead. Every root move is one task:
+    perft: a worker counts perft(depth-1) below its root move (divide)
+    search: a worker searches the position after its root move depth-1
+            deep, and the main process keeps the best score (root splitting),
+            one depth at a time (iterative deepening) until the deadline.
+A task only carries the FEN of the root position, the move_id of the root
+move and a few numbers, never a pickled GameState with its whole move_log.
+Each worker process keeps its own GameState backend and transposition table
+between tasks (set up once by _init_worker), so later depths reuse what it
+found in earlier ones.
+"""
+
+_worker = {} # per process: backend, searcher
+
+def _init_worker(backend, hash_mb):
+    _worker["backend"] = backend
+    _worker["searcher"] = Searcher(tt=TranspositionTable(hash_mb) if hash_mb > 0 else None)
+
+def _play_root_move(fen, move_id):
+    """
+    Worker side: rebuild the root position and make the root move on it.
+    """
+    game_state = create_game_state(_worker["backend"], fen)
+    move = find_move(game_state.get_valid_moves(), move_id)
+    game_state.make_move(move)
+    return game_state, move
+
+def _perft_task(fen, move_id, depth):
+    game_state, move = _play_root_move(fen, move_id)
+    return move.get_chess_notations(), perft(game_state, depth-1)
+
+def _search_task(fen, move_id, depth, deadline, search_id):
+    """
+    Search the position after the root move depth-1 plies deep with a full
+    window. Returns (move_id, score for the root side, pv notations, nodes),
+    or None if the (wall clock) deadline was hit first.
+    search_id names the root search: the worker's TT is aged once per root
+    search, not once per task, so sibling root moves don't age each other out.
+    """
+    game_state, move = _play_root_move(fen, move_id)
+    searcher = _worker["searcher"]
+    searcher.nodes = 0
+    searcher.node_limit = None
+    searcher.deadline = None
+    if deadline is not None:
+        searcher.deadline = time.perf_counter() + (deadline - time.time())
+    if searcher.tt is not None and _worker.get("search_id") != search_id:
+        searcher.tt.new_search()
+        _worker["search_id"] = search_id
+    try:
+        score, pv = searcher.negamax(game_state, depth-1, -MATE_SCORE - 1, MATE_SCORE + 1, 1)
+    except SearchTimeout:
+        return None
+    return move_id, -score, [move.get_chess_notations()] + [m.get_chess_notations() for m in pv], searcher.nodes
+
+def default_processes():
+    return os.cpu_count() or 1
+
+def parallel_divide(game_state, depth, processes=None, backend="array"):
+    """
+    Same as perft.divide, with the root moves spread over processes.
+    """
+    fen = get_fen(game_state)
+    moves = game_state.get_valid_moves()
+    with ProcessPoolExecutor(processes or default_processes(), initializer=_init_worker,
+                             initargs=(backend, 0)) as pool:
+        futures = [pool.submit(_perft_task, fen, move.move_id, depth) for move in moves]
+        return dict(future.result() for future in futures)
+
+def parallel_perft(game_state, depth, processes=None, backend="array"):
+    if depth <= 1:
+        return perft(game_state, depth)
+    return sum(parallel_divide(game_state, depth, processes, backend).values())
+
+class ParallelResult(SearchResult):
+    """
+    SearchResult with the pv kept as notations (Moves don't cross processes).
+    """
+    def get_pv_notations(self):
+        return self.pv
+
+def parallel_search(game_state, time_limit=None, max_depth=MAX_DEPTH, processes=None,
+                    backend="array", hash_mb=16, on_info=None):
+    """
+    Root-splitting iterative deepening over a process pool.
+    Every depth searches all root moves in parallel (best move of the last
+    depth first, so it tends to finish early); a depth that doesn't finish
+    before the deadline is thrown away, like in Searcher.search.
+    Returns a ParallelResult for the last finished depth.
+    """
+    start = time.time()
+    deadline = start + time_limit if time_limit is not None else None
+    fen = get_fen(game_state)
+    moves = game_state.get_valid_moves()
+    result = ParallelResult(moves[0] if moves else None, 0, 0, 0, 0.0, [])
+    if len(moves) <= 1:
+        return result
+    order = [move.move_id for move in moves]
+    nodes = 0
+    with ProcessPoolExecutor(processes or default_processes(), initializer=_init_worker,
+                             initargs=(backend, hash_mb)) as pool:
+        for depth in range(1, max_depth+1):
+            futures = [pool.submit(_search_task, fen, move_id, depth, deadline, start) for move_id in order]
+            answers = [future.result() for future in futures]
+            nodes += sum(answer[3] for answer in answers if answer is not None)
+            if any(answer is None for answer in answers):
+                break #Deadline hit during this depth
+            answers.sort(key=lambda answer: -answer[1])
+            move_id, score, pv, _ = answers[0]
+            order = [answer[0] for answer in answers]
+            result = ParallelResult(find_move(moves, move_id), score, depth, nodes,
+                                    time.time() - start, pv)
+            if on_info is not None:
+                on_info(result)
+            if abs(score) >= MATE_SCORE - MAX_DEPTH:
+                break
+            if deadline is not None and time.time() >= deadline:
+                break
+    result.nodes = nodes
+    result.seconds = time.time() - start
+    return result
+
+def perft_scaling(fen=START_FEN, depth=4, process_counts=None, backend="array"):
+    """
+    Time parallel_perft for every process count and print the speedup over 1.
+    Returns {processes: seconds}.
+    """
+    if process_counts is None:
+        process_counts = sorted({1, 2, 4, default_processes()})
+    times = {}
+    for processes in process_counts:
+        game_state = create_game_state(backend, fen)
+        start = time.perf_counter()
+        nodes = parallel_perft(game_state, depth, processes, backend)
+        times[processes] = time.perf_counter() - start
+        print(f"{processes:3} processes  {nodes} nodes  {times[processes]:7.2f}s  "
+              f"{nodes / times[processes]:12,.0f} nodes/s  "
+              f"speedup {times[process_counts[0]] / times[processes]:.2f}x")
+    return times
+
+def main():
+    from search import print_info
+    parser = argparse.ArgumentParser(description="Multi-core perft and search")
+    parser.add_argument("mode", choices=("perft", "divide", "search", "scaling"))
+    parser.add_argument("--depth", type=int, default=None,
+                        help="perft depth (default 4) or max search depth")
+    parser.add_argument("--time", type=float, default=5.0, help="seconds for search")
+    parser.add_argument("--fen", default=START_FEN)
+    parser.add_argument("--backend", default="array", choices=("array", "bitboard"))
+    parser.add_argument("--processes", default=None,
+                        help="number of processes, or a comma separated list for scaling")
+    args = parser.parse_args()
+
+    if args.mode == "scaling":
+        counts = None
+        if args.processes:
+            counts = [int(count) for count in args.processes.split(",")]
+        perft_scaling(args.fen, args.depth or 4, counts, args.backend)
+        return
+    processes = int(args.processes) if args.processes else None
+    game_state = create_game_state(args.backend, args.fen)
+    start = time.perf_counter()
+    if args.mode == "search":
+        result = parallel_search(game_state, args.time, args.depth or MAX_DEPTH,
+                                 processes, args.backend, on_info=print_info)
+        print("bestmove", result.best_move.get_chess_notations() if result.best_move else "(none)")
+        return
+    if args.mode == "divide":
+        results = parallel_divide(game_state, args.depth or 4, processes, args.backend)
+        for notation in sorted(results):
+            print(f"{notation}: {results[notation]}")
+        nodes = sum(results.values())
+    else:
+        nodes = parallel_perft(game_state, args.depth or 4, processes, args.backend)
+    seconds = time.perf_counter() - start
+    print(f"Nodes: {nodes}  Time: {seconds:.2f}s  NPS: {nodes / seconds:,.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# Perft: count the leaf nodes of the legal move tree to test (and time) move generation
+from engine import create_game_state
+from fen import START_FEN, read_epd
+import argparse
+import time
+
+# NOTE's
+"""
+perft(n) is the number of move sequences of length n from a position.
+The known counts below come from the usual perft test positions, so any
+difference points at a move generation (or make/undo) bug, and the nodes/s
+shows whether a change made things faster or slower.
+"divide" prints the count under every root move, which is how a wrong
+total is narrowed down to the move (and then the position) that is off.
+"""
+
+# (name, fen, [perft(1), perft(2), ...])
+PERFT_SUITE = [
+    ("startpos", START_FEN,
+     [20, 400, 8902, 197281]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624]),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487]),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+]
+
+def perft(game_state, depth):
+    """
+    Number of leaf nodes depth plies below game_state.
+    The last ply is counted from the length of the move list (bulk counting).
+    """
+    moves = game_state.get_valid_moves()
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    nodes = 0
+    for move in moves:
+        game_state.make_move(move)
+        nodes += perft(game_state, depth-1)
+        game_state.undo_last_move()
+    return nodes
+
+def divide(game_state, depth):
+    """
+    perft split by root move: {"e2e4": nodes, ...}
+    """
+    results = {}
+    for move in game_state.get_valid_moves():
+        game_state.make_move(move)
+        results[move.get_chess_notations()] = perft(game_state, depth-1)
+        game_state.undo_last_move()
+    return results
+
+def timed_perft(game_state, depth, show_divide=False):
+    """
+    Run perft (or divide) and return (nodes, seconds, nodes/second).
+    """
+    start = time.perf_counter()
+    if show_divide:
+        results = divide(game_state, depth)
+        for notation in sorted(results):
+            print(f"{notation}: {results[notation]}")
+        nodes = sum(results.values())
+    else:
+        nodes = perft(game_state, depth)
+    seconds = time.perf_counter() - start
+    return nodes, seconds, nodes / seconds if seconds > 0 else 0.0
+
+def run_suite(backend="array", max_depth=3, max_nodes=100000):
+    """
+    Run every PERFT_SUITE position up to max_depth, skipping counts above
+    max_nodes. Prints one line per depth and returns the number of failures.
+    """
+    failures = 0
+    for name, fen, counts in PERFT_SUITE:
+        for depth, expected in enumerate(counts[:max_depth], start=1):
+            if expected > max_nodes:
+                break
+            game_state = create_game_state(backend, fen)
+            nodes, seconds, nps = timed_perft(game_state, depth)
+            status = "ok" if nodes == expected else "FAIL"
+            if nodes != expected:
+                failures += 1
+            print(f"{name:10} depth {depth}  {nodes:>9} / {expected:<9} "
+                  f"{seconds:7.2f}s {nps:10,.0f} nodes/s  {status}")
+    return failures
+
+def run_epd(path, backend="array", max_depth=3):
+    """
+    Same as run_suite for a perft EPD file, streamed one line at a time:
+        <position> ;D1 20 ;D2 400 ;D3 8902
+    Returns the number of failures.
+    """
+    failures = 0
+    for number, (fen, operations) in enumerate(read_epd(path), start=1):
+        for depth in range(1, max_depth+1):
+            if "D" + str(depth) not in operations:
+                break
+            expected = int(operations["D" + str(depth)])
+            nodes, seconds, nps = timed_perft(create_game_state(backend, fen), depth)
+            if nodes != expected:
+                failures += 1
+                print(f"position {number} depth {depth}: {nodes} != {expected}  {fen}")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Perft node counts for the engine")
+    parser.add_argument("depth", type=int, nargs="?", default=3)
+    parser.add_argument("--fen", default=START_FEN)
+    parser.add_argument("--backend", default="array", choices=("array", "bitboard"))
+    parser.add_argument("--divide", action="store_true", help="print nodes per root move")
+    parser.add_argument("--suite", action="store_true", help="run the known positions")
+    parser.add_argument("--epd", help="run the D1, D2, ... counts of a perft EPD file")
+    parser.add_argument("--max-nodes", type=int, default=100000)
+    args = parser.parse_args()
+
+    if args.suite:
+        failures = run_suite(args.backend, args.depth, args.max_nodes)
+        print("All counts match" if failures == 0 else f"{failures} count(s) wrong")
+        return failures
+    if args.epd:
+        failures = run_epd(args.epd, args.backend, args.depth)
+        print("All counts match" if failures == 0 else f"{failures} count(s) wrong")
+        return failures
+    game_state = create_game_state(args.backend, args.fen)
+    nodes, seconds, nps = timed_perft(game_state, args.depth, args.divide)
+    print(f"Nodes: {nodes}  Time: {seconds:.2f}s  NPS: {nps:,.0f}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,208 @@
+# PGN reading: stream games from a file and turn SAN moves into Move objects
+from fen import START_FEN
+
+# NOTE's
+"""
+PGN = Portable Game Notation, a text file of games:
+    [Event "..."]            <- headers, one per line
+    [FEN "..."]              <- optional starting position
+    1. e4 e5 2. Nf3 {a comment} Nc6 (2... d6 a variation) 1-0
+Moves are in SAN (Standard Algebraic Notation): piece letter (none for
+pawns), "x" for captures, the end square, "=Q" for promotions, and only as
+much of the start square as is needed to tell two moves apart (Nbd2, R1e2).
+Files are read one line at a time, so collections of any size can be used.
+"""
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+def read_pgn(path):
+    """
+    Stream (headers, san_moves) for every game in a PGN file.
+    """
+    with open(path, encoding="utf-8", errors="replace") as file:
+        headers = {}
+        movetext = []
+        for line in file:
+            line = line.strip()
+            if line.startswith("[") and line.endswith("]"):
+                if movetext:
+                    yield headers, split_movetext(" ".join(movetext))
+                    headers, movetext = {}, []
+                key, _, value = line[1:-1].partition(" ")
+                headers[key] = value.strip().strip('"')
+            elif line and not line.startswith("%"):
+                movetext.append(line)
+        if movetext or headers:
+            yield headers, split_movetext(" ".join(movetext))
+
+def split_movetext(text):
+    """
+    Movetext -> list of SAN moves, without move numbers, comments,
+    variations, NAGs ($1) and the result.
+    """
+    moves = []
+    depth = 0 # variation nesting
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == "{":
+            end = text.find("}", i)
+            i = len(text) if end == -1 else end + 1
+            continue
+        if char == ";":
+            end = text.find("\n", i)
+            i = len(text) if end == -1 else end + 1
+            continue
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif not char.isspace():
+            end = i
+            while end < len(text) and not text[end].isspace() and text[end] not in "{}();":
+                end += 1
+            token = text[i:end]
+            i = end
+            if depth == 0:
+                token = token.split(".")[-1] #"12.e4" / "12...e4" -> "e4"
+                if token and token not in RESULTS and not token.startswith("$"):
+                    moves.append(token)
+            continue
+        i += 1
+    return moves
+
+def parse_san(game_state, san, moves=None):
+    """
+    Find the legal move on game_state that san describes.
+    Raises ValueError if there is no such move (or more than one).
+    """
+    if moves is None:
+        moves = game_state.get_valid_moves()
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        queen_side = len(text) == 5
+        for move in moves:
+            if move.is_castling_valid and (move.end_col < move.start_col) == queen_side:
+                return move
+        raise ValueError("Illegal move: " + san)
+
+    promotion = None
+    if "=" in text:
+        text, promotion = text.split("=")
+        promotion = promotion[:1].upper()
+    elif len(text) > 2 and text[-1].upper() in "NBRQ" and text[-2] in "18":
+        text, promotion = text[:-1], text[-1].upper() #"e8Q"
+    piece = "P"
+    if text and text[0] in "NBRQK":
+        piece, text = text[0], text[1:]
+    text = text.replace("x", "").replace("-", "")
+    if len(text) < 2:
+        raise ValueError("Invalid SAN: " + san)
+    end_col = ord(text[-2]) - ord("a")
+    end_row = 8 - int(text[-1]) if text[-1].isdigit() else -1
+    hint = text[:-2] # disambiguation: file, rank or both
+
+    matches = []
+    for move in moves:
+        if (move.piece_moved[1] != piece or move.end_row != end_row or
+            move.end_col != end_col or move.is_castling_valid):
+            continue
+        if promotion is not None and move.promotion_piece != promotion:
+            continue
+        if promotion is None and move.is_pawn_promotion and move.promotion_piece != "Q":
+            continue #"e8" alone means the queen
+        square = move.get_rank_file(move.start_row, move.start_col)
+        if all(char in square for char in hint):
+            matches.append(move)
+    if len(matches) != 1:
+        raise ValueError(("Ambiguous" if matches else "Illegal") + " move: " + san)
+    return matches[0]
+
+def replay_game(game_state, san_moves):
+    """
+    Play the moves of a game on game_state, yielding (ply, move) after each.
+    Stops quietly at the first move that isn't legal (broken games happen).
+    """
+    for ply, san in enumerate(san_moves, start=1):
+        try:
+            move = parse_san(game_state, san)
+        except ValueError:
+            return
+        game_state.make_move(move)
+        yield ply, move
+
+def get_san(game_state, move, moves=None):
+    """
+    SAN of a legal move, written before it is made on game_state
+    (moves = the legal moves of game_state, if already generated).
+    """
+    if moves is None:
+        moves = game_state.get_valid_moves()
+    if move.is_castling_valid:
+        san = "O-O" if move.end_col > move.start_col else "O-O-O"
+    else:
+        piece = move.piece_moved[1]
+        end = move.get_rank_file(move.end_row, move.end_col)
+        capture = move.piece_captured != "__"
+        start = move.get_rank_file(move.start_row, move.start_col)
+        if piece == "P":
+            san = (start[0] + "x" if capture else "") + end
+            if move.is_pawn_promotion:
+                san += "=" + move.promotion_piece
+        else:
+            #Only as much of the start square as needed to tell it from the others
+            others = [other for other in moves if other.piece_moved == move.piece_moved and
+                      other.end_row == move.end_row and other.end_col == move.end_col and
+                      other.start_row * 8 + other.start_col != move.start_row * 8 + move.start_col]
+            hint = ""
+            if others:
+                if all(other.start_col != move.start_col for other in others):
+                    hint = start[0]
+                elif all(other.start_row != move.start_row for other in others):
+                    hint = start[1]
+                else:
+                    hint = start
+            san = piece + hint + ("x" if capture else "") + end
+    game_state.make_move(move)
+    if game_state.in_check():
+        san += "#" if not game_state.get_valid_moves() else "+"
+    game_state.undo_last_move()
+    return san
+
+def format_pgn(headers, san_moves, result, comment=None, start_white=True, start_number=1):
+    """
+    One game as PGN text (headers, movetext wrapped at 80 columns, result).
+    comment = text put in braces before the result.
+    """
+    lines = [f'[{key} "{value}"]' for key, value in headers.items()]
+    lines.append("")
+    tokens = []
+    white = start_white
+    number = start_number
+    for i, san in enumerate(san_moves):
+        if white:
+            tokens.append(f"{number}.")
+        elif i == 0:
+            tokens.append(f"{number}...")
+        tokens.append(san)
+        if not white:
+            number += 1
+        white = not white
+    if comment:
+        tokens.append("{" + comment + "}")
+    tokens.append(result)
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 80:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n\n"
+
+def get_start_fen(headers):
+    """
+    Starting position of a game: the FEN header, or the normal start.
+    """
+    return headers.get("FEN", START_FEN)
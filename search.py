@@ -0,0 +1,337 @@
+# Search: pick a move for the side to move with alpha-beta
+import time
+from tt import EXACT, LOWER, UPPER
+from evaluation import evaluate
+from movepick import MoveHistory, pick_moves, is_quiet, mvv_lva
+
+# NOTE's
+"""
+Negamax: a score is always from the point of view of the side to move, so
+    the score of a position is the best of -score(child) over every move,
+    and the same code works for both colors.
+Alpha-beta: (alpha, beta) is the window of scores that can still change the
+    result higher up the tree. Once a move scores >= beta, the opponent would
+    never allow this position, so the remaining moves don't need a search.
+Iterative deepening: search depth 1, then 2, then 3, ... until the time is
+    up. Each finished depth gives a move to play, and the best move of the
+    last depth is searched first in the next one, which makes alpha-beta
+    cut off much more. Running out of time throws away the unfinished depth.
+Quiescence: at depth 0, keep searching captures (only) so the evaluation
+    isn't done in the middle of an exchange.
+Draws: a position that repeats one already on the game/search path, or
+    that hits the fifty-move rule, scores 0 without being searched.
+Transposition table (tt.py): every searched node stores its score, depth and
+    best move under the position's hash. A later visit with the same or less
+    depth left can reuse the score, and otherwise tries that move first.
+Move ordering (movepick.py): inner nodes take their moves from a staged
+    generator: hash move, captures by MVV-LVA, killer moves, then the quiet
+    moves by history score, each stage only worked out when it's reached.
+Opening book (book.py): if the root position is in the book, a book move is
+    played right away (depth 0 result) and nothing is searched.
+Tablebases (tablebase.py): below the root, a position with few enough
+    pieces is scored exactly (win/draw/loss and distance to mate) from the
+    tables instead of being searched.
+"""
+
+MATE_SCORE = 100000 # score of being mated now, minus the plies to get there
+MAX_DEPTH = 64
+TABLEBASE_PHASE = 8 # no tablebase probes above this phase (KQvKQ = 8, see evaluation.py)
+CHECK_INTERVAL = 64 # nodes between clock checks (power of 2): ~10ms even at a few thousand nodes/s
+
+def order_moves(moves, first_move=None):
+    """
+    Best guesses first: the move from the last iteration (first_move),
+    then captures, most valuable victim by least valuable attacker (MVV-LVA).
+    Used where every move is searched anyway (root, quiescence); inner
+    nodes get theirs from movepick.pick_moves.
+    """
+    def key(move):
+        if move is first_move:
+            return -1000000
+        if move.piece_captured != "__":
+            return -mvv_lva(move)
+        return 0
+    moves.sort(key=key)
+    return moves
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search when the deadline (or node limit) is reached.
+    """
+
+class SearchResult():
+    def __init__(self, best_move, score, depth, nodes, seconds, pv):
+        self.best_move = best_move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.seconds = seconds
+        self.pv = pv # principal variation: list of Move, best line for both sides
+
+    @property
+    def nps(self):
+        return int(self.nodes / self.seconds) if self.seconds > 0 else 0
+
+    def get_pv_notations(self):
+        return [move.get_chess_notations() for move in self.pv]
+
+class Searcher():
+    def __init__(self, evaluate=evaluate, tt=None, book=None, tablebase=None):
+        """
+        evaluate(game_state) -> score for the side to move.
+        tt = TranspositionTable shared by every search of this Searcher (optional).
+        book = OpeningBook asked before searching (optional).
+        tablebase = Tablebase probed at nodes with few pieces left (optional).
+        """
+        self.evaluate = evaluate
+        self.tt = tt
+        self.book = book
+        self.tablebase = tablebase
+        self.move_history = MoveHistory() # killers and history for move ordering
+        self.nodes = 0
+        self.deadline = None
+        self.node_limit = None
+        self.stop_event = None
+
+    def search(self, game_state, max_depth=MAX_DEPTH, time_limit=None,
+               node_limit=None, on_info=None, stop_event=None):
+        """
+        Iterative deepening up to max_depth, stopping hard after time_limit
+        seconds or node_limit nodes, or once stop_event (threading.Event) is set.
+        on_info(result) is called after every finished depth (for printing
+        depth/score/nodes/nps/pv).
+        Returns the SearchResult of the last finished depth.
+        """
+        start = time.perf_counter()
+        self.deadline = start + time_limit if time_limit is not None else None
+        self.node_limit = node_limit
+        self.stop_event = stop_event
+        self.nodes = 0
+        if self.tt is not None:
+            self.tt.new_search()
+        self.move_history.new_search()
+        root_moves = game_state.get_valid_moves()
+        root_log_length = len(game_state.move_log)
+        result = SearchResult(root_moves[0] if root_moves else None, 0, 0, 0, 0.0, [])
+        if len(root_moves) <= 1:
+            return result #Nothing to choose from
+        if self.book is not None:
+            book_move = self.book.choose_move(game_state, root_moves)
+            if book_move is not None:
+                return SearchResult(book_move, 0, 0, 0, time.perf_counter() - start, [book_move])
+
+        for depth in range(1, max_depth+1):
+            try:
+                score, pv = self.search_root(game_state, root_moves, depth, result.best_move)
+            except SearchTimeout:
+                #Unwind whatever was left on the board when time ran out
+                while len(game_state.move_log) > root_log_length:
+                    game_state.undo_last_move()
+                break
+            result = SearchResult(pv[0], score, depth, self.nodes,
+                                  time.perf_counter() - start, pv)
+            if on_info is not None:
+                on_info(result)
+            if abs(score) >= MATE_SCORE - MAX_DEPTH:
+                break #Found a forced mate, deeper won't change it
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter() - start
+        game_state.get_valid_moves() #Leave check_mate/stale_mate set for the root
+        return result
+
+    def search_root(self, game_state, moves, depth, first_move):
+        alpha, beta = -MATE_SCORE - 1, MATE_SCORE + 1
+        best_pv = []
+        for move in order_moves(moves, first_move):
+            game_state.make_move(move)
+            score, pv = self.negamax(game_state, depth-1, -beta, -alpha, 1)
+            score = -score
+            game_state.undo_last_move()
+            if score > alpha:
+                alpha = score
+                best_pv = [move] + pv
+        if self.tt is not None:
+            self.tt.store(game_state.hash, best_pv[0].move_id, depth, EXACT, alpha)
+        return alpha, best_pv
+
+    def negamax(self, game_state, depth, alpha, beta, ply):
+        """
+        Returns (score, pv) of game_state searched depth plies deep.
+        """
+        self.count_node()
+        if ply > 0 and game_state.is_repetition():
+            return 0, [] #Draw: a repetition inside the tree is as good as a threefold one
+        if ply > 0 and game_state.halfmove_clock >= 100:
+            #Fifty-move draw, unless the move that got there was mate
+            _, check_squares, double_check = game_state.check_for_pins_and_checks()
+            if (check_squares is not None or double_check) and not game_state.get_valid_moves():
+                return -MATE_SCORE + ply, []
+            return 0, []
+        if self.tablebase is not None and ply > 0:
+            score = self.probe_tablebase(game_state, ply)
+            if score is not None:
+                return score, []
+        if depth <= 0:
+            return self.quiescence(game_state, alpha, beta, ply), []
+        tt_move = 0
+        if self.tt is not None:
+            entry = self.tt.probe(game_state.hash, ply)
+            if entry is not None:
+                tt_move, tt_depth, flag, score = entry
+                if tt_depth >= depth and (flag == EXACT or 
+                                          (flag == LOWER and score >= beta) or 
+                                          (flag == UPPER and score <= alpha)):
+                    return score, []
+        best_pv = []
+        best_move = 0
+        original_alpha = alpha
+        legal_moves = 0
+        for move in pick_moves(game_state, tt_move, self.move_history, ply):
+            legal_moves += 1
+            game_state.make_move(move)
+            score, pv = self.negamax(game_state, depth-1, -beta, -alpha, ply+1)
+            score = -score
+            game_state.undo_last_move()
+            if score >= beta:
+                if is_quiet(move):
+                    self.move_history.update(move, depth, ply)
+                if self.tt is not None:
+                    self.tt.store(game_state.hash, move.move_id, depth, LOWER, beta, ply)
+                return beta, []
+            if score > alpha:
+                alpha = score
+                best_pv = [move] + pv
+                best_move = move.move_id
+        if legal_moves == 0:
+            if game_state.check_mate:
+                return -MATE_SCORE + ply, []
+            return 0, []
+        if self.tt is not None:
+            self.tt.store(game_state.hash, best_move, depth,
+                          EXACT if alpha > original_alpha else UPPER, alpha, ply)
+        return alpha, best_pv
+
+    def probe_tablebase(self, game_state, ply):
+        """
+        Exact score from the tablebase (mate scores count from the root),
+        or None if the position has too many pieces or no table.
+        """
+        if game_state.phase > TABLEBASE_PHASE:
+            return None #Cheap test first, most positions stop here
+        if game_state.count_pieces() > self.tablebase.max_pieces:
+            return None
+        value = self.tablebase.probe(game_state)
+        if value is None:
+            return None
+        result, plies = value
+        if result == 0:
+            return 0
+        return result * (MATE_SCORE - ply - plies)
+
+    def quiescence(self, game_state, alpha, beta, ply):
+        """
+        Search only captures (and promotions) until the position is quiet.
+        "Stand pat": the side to move can usually decline to capture, so
+        the static evaluation is a lower bound.
+        """
+        stand_pat = self.evaluate(game_state)
+        if stand_pat >= beta:
+            return beta
+        if stand_pat > alpha:
+            alpha = stand_pat
+        #Quiet underpromotions are left to the main search
+        captures = [move for move in game_state.get_valid_captures()
+                    if move.piece_captured != "__" or move.promotion_piece == "Q"]
+        for move in order_moves(captures):
+            self.count_node()
+            game_state.make_move(move)
+            score = -self.quiescence(game_state, -beta, -alpha, ply+1)
+            game_state.undo_last_move()
+            if score >= beta:
+                return beta
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def count_node(self):
+        """
+        Count a node and check the clock/stop event every CHECK_INTERVAL nodes.
+        """
+        self.nodes += 1
+        if self.nodes & (CHECK_INTERVAL - 1) == 0:
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                raise SearchTimeout()
+            if self.stop_event is not None and self.stop_event.is_set():
+                raise SearchTimeout()
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchTimeout()
+
+def find_best_move(game_state, time_limit=1.0, max_depth=MAX_DEPTH, on_info=None, searcher=None):
+    """
+    Shortcut for Searcher().search(...).best_move
+    Pass the same searcher every move to keep its transposition table.
+    """
+    if searcher is None:
+        searcher = Searcher()
+    return searcher.search(game_state, max_depth, time_limit, on_info=on_info).best_move
+
+def print_info(result):
+    """
+    on_info callback that prints one line per finished depth.
+    """
+    print(f"depth {result.depth} score {result.score} nodes {result.nodes} "
+          f"nps {result.nps} time {result.seconds:.2f}s pv {' '.join(result.get_pv_notations())}")
+
+if __name__ == "__main__":
+    import argparse
+    from engine import create_game_state
+    from fen import START_FEN
+    parser = argparse.ArgumentParser(description="Search a position")
+    parser.add_argument("--fen", default=START_FEN)
+    parser.add_argument("--time", type=float, default=5.0, help="seconds for the move")
+    parser.add_argument("--depth", type=int, default=MAX_DEPTH)
+    parser.add_argument("--backend", default="array", choices=("array", "bitboard"))
+    parser.add_argument("--hash", type=int, default=16, help="transposition table MB, 0 = off")
+    parser.add_argument("--book", default=None, help="opening book .bin file")
+    parser.add_argument("--tablebases", default=None, help="directory of .tb files")
+    parser.add_argument("--nnue", default=None, help="evaluate with this .npz network (see nnue.py)")
+    parser.add_argument("--profile", action="store_true",
+                        help="count and time move generation, make/undo and evaluation")
+    parser.add_argument("--profile-json", default=None, help="also write that report as JSON")
+    parser.add_argument("--cprofile", default=None, help="write a cProfile dump to this file")
+    parser.add_argument("--log-level", default="WARNING", help="DEBUG shows engine internals")
+    args = parser.parse_args()
+    import logging
+    logging.basicConfig(level=args.log_level.upper(), format="%(levelname)s %(name)s: %(message)s")
+    from tt import TranspositionTable
+    book = None
+    if args.book:
+        from book import OpeningBook
+        book = OpeningBook(args.book)
+    tablebase = None
+    if args.tablebases:
+        from tablebase import Tablebase
+        tablebase = Tablebase(args.tablebases)
+    evaluate_function = evaluate
+    if args.nnue:
+        from nnue import NNUEvaluator
+        evaluate_function = NNUEvaluator(args.nnue)
+    searcher = Searcher(evaluate_function, tt=TranspositionTable(args.hash) if args.hash > 0 else None,
+                        book=book, tablebase=tablebase)
+    game_state = create_game_state(args.backend, args.fen)
+    if args.nnue:
+        evaluate_function.attach(game_state) #Before the profiler's wrappers, so they time it
+    if args.profile or args.profile_json or args.cprofile:
+        from instrument import profile_search, print_cprofile
+        result, instrumentation = profile_search(game_state, searcher, args.depth, args.time,
+                                                 args.cprofile, on_info=print_info)
+        print(instrumentation.format_report(result.seconds))
+        if args.profile_json:
+            instrumentation.write_report(args.profile_json, result.seconds)
+        if args.cprofile:
+            print_cprofile(args.cprofile)
+    else:
+        result = searcher.search(game_state, args.depth, args.time, on_info=print_info)
+    print("bestmove", result.best_move.get_chess_notations() if result.best_move else "(none)")
+    if searcher.tt is not None:
+        print("tt", searcher.tt.get_stats())
@@ -0,0 +1,374 @@
+# Self-play matches: two engine configurations over a process pool, with Elo and SPRT
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from engine import create_game_state
+from fen import START_FEN, read_epd
+from pgn import get_san, format_pgn
+from search import Searcher, MAX_DEPTH
+from uci import time_for_move
+import argparse
+import datetime
+import math
+import os
+import random
+import time
+
+# NOTE's
+"""
+A match plays engine A against engine B from a set of openings (EPD), every
+opening twice with the colors swapped, so neither side profits from a
+lopsided opening. The openings are shuffled with a seed, so a rerun plays
+the same games. Games run on a process pool (one game per task, every
+worker builds both engines once); the main process writes each finished
+game to the PGN file as soon as it comes back and prints the running score,
+Elo and SPRT numbers.
+
+Engine configurations are "key=value,key=value" strings:
+    name=new,eval=handcrafted|king_safety|nnue:model.npz,backend=array,
+    hash=16,depth=6,nodes=20000,book=book.bin,tablebases=tb
+A game ends by the rules (checkmate, stalemate, fifty moves, threefold
+repetition, insufficient material, see GameState.update_draw_state), on
+time, or by adjudication:
+    draw:   from move draw_move on, both engines scored within draw_score
+            centipawns for draw_plies plies in a row
+    resign: both engines agreed one side is ahead by resign_score or more
+            for resign_plies plies in a row
+    max plies: a draw once the game gets that long
+Elo = -400 * log10(1 / score - 1) with a 95% interval from the variance of
+the game results. SPRT tests H0: elo = elo0 against H1: elo = elo1 with the
+usual normal approximation of the log likelihood ratio (LLR); the match
+stops as soon as LLR leaves [log(beta / (1 - alpha)), log((1 - beta) / alpha)]:
+above = H1 accepted (A is better), below = H0 accepted (it isn't).
+"""
+
+DEFAULT_ENGINE = {"name": "engine", "eval": "handcrafted", "backend": "array", "hash": 16,
+                  "depth": None, "nodes": None, "book": None, "tablebases": None}
+ADJUDICATION = {"draw_move": 34, "draw_score": 10, "draw_plies": 8,
+                "resign_score": 600, "resign_plies": 6, "max_plies": 300}
+CLOCK_SHARE = 0.1 # never plan more than this share of the clock for one move
+CLOCK_OVERHEAD = 0.03 # seconds kept back: clock checks, move bookkeeping, busy CPUs
+
+def parse_engine(text, default_name):
+    """
+    "name=new,eval=king_safety,depth=4" -> config dict (see the NOTE's).
+    """
+    config = dict(DEFAULT_ENGINE, name=default_name)
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        key, _, value = item.partition("=")
+        if key not in config:
+            raise ValueError(f"Unknown engine option: {key}")
+        config[key] = int(value) if key in ("hash", "depth", "nodes") else value
+    return config
+
+def parse_time_control(text):
+    """
+    "10+0.1" -> (10.0, 0.1): seconds per game + increment per move.
+    None / "" = no clock (the engines need depth or nodes then).
+    """
+    if not text:
+        return None
+    base, _, increment = text.partition("+")
+    return float(base), float(increment or 0)
+
+def build_searcher(config):
+    """
+    Searcher for an engine configuration.
+    """
+    from tt import TranspositionTable
+    from evaluation import evaluate, evaluate_with_king_safety
+    evaluation = config["eval"]
+    if evaluation == "handcrafted":
+        evaluate_function = evaluate
+    elif evaluation == "king_safety":
+        evaluate_function = evaluate_with_king_safety
+    elif evaluation.startswith("nnue:"):
+        from nnue import NNUEvaluator
+        evaluate_function = NNUEvaluator(evaluation[5:])
+    else:
+        raise ValueError(f"Unknown eval: {evaluation}")
+    book = tablebase = None
+    if config["book"]:
+        from book import OpeningBook
+        book = OpeningBook(config["book"])
+    if config["tablebases"]:
+        from tablebase import Tablebase
+        tablebase = Tablebase(config["tablebases"])
+    return Searcher(evaluate_function, TranspositionTable(config["hash"]) if config["hash"] > 0 else None,
+                    book, tablebase)
+
+_worker = {} # per process: configs, searchers, time control, adjudication
+
+def _init_worker(configs, time_control, adjudication):
+    _worker["configs"] = configs
+    _worker["searchers"] = {name: build_searcher(config) for name, config in configs.items()}
+    _worker["time_control"] = time_control
+    _worker["adjudication"] = adjudication
+
+def play_game(fen, white, black, time_control, adjudication, configs, searchers):
+    """
+    Play one game. Returns {"result", "reason", "san_moves", "plies"}.
+    white/black = names in configs/searchers.
+    """
+    game_state = create_game_state(configs[white]["backend"], fen)
+    if configs[black]["backend"] != configs[white]["backend"]:
+        raise ValueError("Both engines of a game must use the same backend")
+    for searcher in searchers.values():
+        if searcher.tt is not None:
+            searcher.tt.clear()
+    clocks = [time_control[0], time_control[0]] if time_control else None # [white, black]
+    san_moves = []
+    draw_streak = 0
+    resign_streak = [0, 0] # plies in a row white / black was judged lost
+    while True:
+        moves = game_state.get_valid_moves()
+        white_turn = game_state.white_turn
+        if game_state.check_mate:
+            return _finish("0-1" if white_turn else "1-0", "checkmate", san_moves)
+        if game_state.stale_mate:
+            return _finish("1/2-1/2", "stalemate", san_moves)
+        if game_state.update_draw_state():
+            return _finish("1/2-1/2", game_state.draw_reason, san_moves)
+        if len(san_moves) >= adjudication["max_plies"]:
+            return _finish("1/2-1/2", "adjudication: max plies", san_moves)
+
+        name = white if white_turn else black
+        config = configs[name]
+        time_limit = None
+        if clocks is not None:
+            params = {"wtime": clocks[0] * 1000, "btime": clocks[1] * 1000,
+                      "winc": time_control[1] * 1000, "binc": time_control[1] * 1000}
+            #Searches overrun their budget a little, keep a margin to not lose on time
+            clock = clocks[0 if white_turn else 1]
+            time_limit = max(min(time_for_move(white_turn, params),
+                                 clock * CLOCK_SHARE - CLOCK_OVERHEAD), 0.01)
+        start = time.perf_counter()
+        result = searchers[name].search(game_state, config["depth"] or MAX_DEPTH, time_limit,
+                                        config["nodes"])
+        seconds = time.perf_counter() - start
+        if clocks is not None:
+            side = 0 if white_turn else 1
+            clocks[side] -= seconds
+            if clocks[side] < 0:
+                return _finish("0-1" if white_turn else "1-0", "time forfeit", san_moves)
+            clocks[side] += time_control[1]
+
+        move = result.best_move
+        san_moves.append(get_san(game_state, move, moves))
+        game_state.make_move(move)
+
+        if result.depth > 0: #Book and forced moves come without a score
+            white_score = result.score if white_turn else -result.score
+            ply = len(san_moves)
+            if ply >= adjudication["draw_move"] * 2 and abs(white_score) <= adjudication["draw_score"]:
+                draw_streak += 1
+            else:
+                draw_streak = 0
+            for side, losing in enumerate((white_score <= -adjudication["resign_score"],
+                                           white_score >= adjudication["resign_score"])):
+                resign_streak[side] = resign_streak[side] + 1 if losing else 0
+            if draw_streak >= adjudication["draw_plies"]:
+                return _finish("1/2-1/2", "adjudication: draw", san_moves)
+            if resign_streak[0] >= adjudication["resign_plies"]:
+                return _finish("0-1", "adjudication: white resigns", san_moves)
+            if resign_streak[1] >= adjudication["resign_plies"]:
+                return _finish("1-0", "adjudication: black resigns", san_moves)
+
+def _finish(result, reason, san_moves):
+    return {"result": result, "reason": reason, "san_moves": san_moves, "plies": len(san_moves)}
+
+def _game_task(round_number, fen, white, black):
+    """
+    Worker side of one game.
+    """
+    game = play_game(fen, white, black, _worker["time_control"], _worker["adjudication"],
+                     _worker["configs"], _worker["searchers"])
+    game.update(round=round_number, fen=fen, white=white, black=black)
+    return game
+
+def load_openings(path, seed=None, count=None):
+    """
+    FENs from an EPD file (or just the start position), shuffled with seed.
+    """
+    openings = [fen for fen, _ in read_epd(path)] if path else [START_FEN]
+    random.Random(seed).shuffle(openings)
+    return openings[:count] if count else openings
+
+def elo_from_score(score):
+    if score <= 0 or score >= 1:
+        return math.copysign(math.inf, score - 0.5)
+    return -400 * math.log10(1 / score - 1)
+
+class MatchStats():
+    def __init__(self, elo0=0.0, elo1=5.0, alpha=0.05, beta=0.05):
+        """
+        Results of engine A (wins, draws, losses), with Elo and SPRT.
+        """
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+        self.elo0 = elo0
+        self.elo1 = elo1
+        self.lower_bound = math.log(beta / (1 - alpha))
+        self.upper_bound = math.log((1 - beta) / alpha)
+
+    def add(self, score):
+        """
+        score = 1, 0.5 or 0 for engine A.
+        """
+        if score == 1:
+            self.wins += 1
+        elif score == 0:
+            self.losses += 1
+        else:
+            self.draws += 1
+
+    @property
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def mean_and_variance(self):
+        games = self.games
+        mean = (self.wins + self.draws / 2) / games
+        variance = (self.wins * (1 - mean) ** 2 + self.draws * (0.5 - mean) ** 2
+                    + self.losses * mean ** 2) / games
+        return mean, variance
+
+    def elo(self):
+        """
+        (elo, 95% margin) of A against B.
+        """
+        if self.games == 0:
+            return 0.0, math.inf
+        mean, variance = self.mean_and_variance()
+        if variance == 0:
+            return elo_from_score(mean), math.inf #All results the same, no spread to go by
+        margin = 1.96 * math.sqrt(variance / self.games)
+        elo = elo_from_score(mean)
+        low = elo_from_score(max(mean - margin, 1e-9))
+        high = elo_from_score(min(mean + margin, 1 - 1e-9))
+        return elo, (high - low) / 2
+
+    def llr(self):
+        """
+        Log likelihood ratio of H1 (elo1) against H0 (elo0).
+        """
+        if self.games == 0 or self.wins + self.losses == 0:
+            return 0.0
+        mean, variance = self.mean_and_variance()
+        if variance == 0:
+            return 0.0
+        score0 = 1 / (1 + 10 ** (-self.elo0 / 400))
+        score1 = 1 / (1 + 10 ** (-self.elo1 / 400))
+        return self.games * (score1 - score0) * (2 * mean - score0 - score1) / (2 * variance)
+
+    def sprt_state(self):
+        """
+        "H1" (A is better by elo1), "H0" (it isn't) or None (keep playing).
+        """
+        llr = self.llr()
+        if llr >= self.upper_bound:
+            return "H1"
+        if llr <= self.lower_bound:
+            return "H0"
+        return None
+
+    def format(self):
+        elo, margin = self.elo()
+        mean = (self.wins + self.draws / 2) / self.games if self.games else 0.0
+        return (f"games {self.games}: +{self.wins} ={self.draws} -{self.losses}  "
+                f"score {mean:.3f}  elo {elo:+.1f} +/- {margin:.1f}  "
+                f"LLR {self.llr():.2f} [{self.lower_bound:.2f}, {self.upper_bound:.2f}]")
+
+def run_match(engine_a, engine_b, openings, pgn_path, games=None, processes=None,
+              time_control=None, adjudication=None, sprt=None, event="Self-play match"):
+    """
+    Play engine_a against engine_b (config dicts) from openings, both colors
+    each. games = stop after this many (default: every opening twice),
+    sprt = MatchStats settings {"elo0", "elo1", "alpha", "beta"} to stop early.
+    Returns the MatchStats of engine_a.
+    """
+    if engine_a["name"] == engine_b["name"]:
+        engine_b = dict(engine_b, name=engine_b["name"] + "-2")
+    if time_control is None and not (engine_a["depth"] or engine_a["nodes"]) \
+            and not (engine_b["depth"] or engine_b["nodes"]):
+        raise ValueError("Give a time control or a depth/node limit for the engines")
+    adjudication = dict(ADJUDICATION, **(adjudication or {}))
+    configs = {engine_a["name"]: engine_a, engine_b["name"]: engine_b}
+    tasks = []
+    for fen in openings:
+        tasks.append((len(tasks) + 1, fen, engine_a["name"], engine_b["name"]))
+        tasks.append((len(tasks) + 1, fen, engine_b["name"], engine_a["name"]))
+    if games:
+        tasks = tasks[:games]
+    stats = MatchStats(**(sprt or {}))
+    processes = processes or os.cpu_count() or 1
+    date = datetime.date.today().strftime("%Y.%m.%d")
+    time_control_text = f"{time_control[0]:g}+{time_control[1]:g}" if time_control else "-"
+    pending = set()
+    next_task = 0
+    with ProcessPoolExecutor(processes, initializer=_init_worker,
+                             initargs=(configs, time_control, adjudication)) as pool, \
+            open(pgn_path, "w") as pgn_file:
+        #Keep only a few games queued, so stopping early doesn't wait for the rest
+        while next_task < len(tasks) or pending:
+            while next_task < len(tasks) and len(pending) < processes * 2:
+                pending.add(pool.submit(_game_task, *tasks[next_task]))
+                next_task += 1
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                game = future.result()
+                headers = {"Event": event, "Site": "?", "Date": date,
+                           "Round": game["round"], "White": game["white"], "Black": game["black"],
+                           "Result": game["result"], "TimeControl": time_control_text}
+                if game["fen"] != START_FEN:
+                    headers["SetUp"] = "1"
+                    headers["FEN"] = game["fen"]
+                start_white = game["fen"].split()[1] == "w"
+                start_number = int(game["fen"].split()[5]) if len(game["fen"].split()) > 5 else 1
+                pgn_file.write(format_pgn(headers, game["san_moves"], game["result"],
+                                          game["reason"], start_white, start_number))
+                pgn_file.flush()
+                white_score = {"1-0": 1, "0-1": 0}.get(game["result"], 0.5)
+                stats.add(white_score if game["white"] == engine_a["name"] else 1 - white_score)
+                print(f"round {game['round']}: {game['white']} - {game['black']} "
+                      f"{game['result']} ({game['reason']}, {game['plies']} plies)  {stats.format()}")
+            if sprt is not None and stats.sprt_state() is not None:
+                verdict = "H1 accepted: A is stronger" if stats.sprt_state() == "H1" \
+                    else "H0 accepted: A is not stronger"
+                print(f"SPRT stopped the match, {verdict}")
+                #Queued games are dropped, running ones can't be interrupted
+                running = sum(not future.cancel() for future in pending)
+                if running:
+                    print(f"Waiting for {running} game(s) the workers already started "
+                          "(not counted)")
+                pool.shutdown(wait=True, cancel_futures=True)
+                pending = set()
+                next_task = len(tasks)
+    print("Final: " + stats.format())
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Play two engine configurations against each other")
+    parser.add_argument("--engine-a", default="name=A", help='e.g. "name=new,eval=king_safety"')
+    parser.add_argument("--engine-b", default="name=B", help='e.g. "name=base,eval=handcrafted"')
+    parser.add_argument("--openings", default=None, help="EPD file of starting positions")
+    parser.add_argument("--seed", type=int, default=0, help="shuffles the openings")
+    parser.add_argument("--games", type=int, default=None, help="default: every opening twice")
+    parser.add_argument("--pgn", default="match.pgn", help="games are written here as they finish")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--tc", default=None, help='time control "seconds+increment", e.g. "10+0.1"')
+    parser.add_argument("--sprt", nargs=2, type=float, metavar=("ELO0", "ELO1"), default=None,
+                        help="stop once H0: elo = ELO0 or H1: elo = ELO1 is accepted")
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    for key, value in ADJUDICATION.items():
+        parser.add_argument("--" + key.replace("_", "-"), type=int, default=value)
+    args = parser.parse_args()
+    sprt = None
+    if args.sprt:
+        sprt = {"elo0": args.sprt[0], "elo1": args.sprt[1], "alpha": args.alpha, "beta": args.beta}
+    run_match(parse_engine(args.engine_a, "A"), parse_engine(args.engine_b, "B"),
+              load_openings(args.openings, args.seed), args.pgn, args.games, args.processes,
+              parse_time_control(args.tc), {key: getattr(args, key) for key in ADJUDICATION}, sprt)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# Transposition table: remembers search results by position hash
+from array import array
+
+# NOTE's
+"""
+The same position is reached through different move orders all the time
+(e4 Nf6 d4 = d4 Nf6 e4), so the search stores what it found per position
+and reuses it: a score that is good enough for a cutoff, or at least the
+best move to try first.
+
+Storage is two flat arrays of 64 bit numbers (keys and packed data) sized
+once from a memory budget, so the table never grows however long it runs.
+Every bucket has 2 slots:
+    slot 0 = depth-preferred: only replaced by a deeper (or equal) search,
+             or when the entry is left over from an older search
+    slot 1 = always-replace: takes everything slot 0 turned down
+Packed data (64 bits):
+    bits 0-15  move (Move.move_id, 0 = no move)
+    bits 16-23 depth
+    bits 24-25 bound flag (EXACT, LOWER, UPPER)
+    bits 26-31 age (which search stored it)
+    bits 32-63 score + 2^31
+"""
+
+EXACT, LOWER, UPPER = 1, 2, 3
+ENTRY_BYTES = 16 # 8 for the key, 8 for the data
+MATE_BOUND = 100000 - 64 # scores past this are mate scores (see search.MATE_SCORE)
+
+def find_move(moves, encoded):
+    """
+    The move in moves that matches an encoded move, or None.
+    """
+    if encoded:
+        for move in moves:
+            if move.move_id == encoded:
+                return move
+    return None
+
+class TranspositionTable():
+    def __init__(self, size_mb=16):
+        """
+        size_mb = memory budget in MB, rounded down to a power of two buckets.
+        """
+        buckets = 1
+        while buckets * 4 * ENTRY_BYTES <= size_mb * 1024 * 1024:
+            buckets *= 2
+        self.bucket_count = buckets
+        self.mask = buckets - 1
+        self.keys = array("Q", bytes(8 * 2 * buckets))
+        self.data = array("Q", bytes(8 * 2 * buckets))
+        self.age = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.collisions = 0 # stores that overwrote a different position
+
+    def new_search(self):
+        """
+        Call once per search, so entries from older searches get replaced first.
+        """
+        self.age = (self.age + 1) & 0x3F
+
+    def clear(self):
+        self.keys = array("Q", bytes(8 * len(self.keys)))
+        self.data = array("Q", bytes(8 * len(self.data)))
+        self.age = 0
+        self.reset_stats()
+
+    def probe(self, key, ply=0):
+        """
+        Returns (move, depth, flag, score) for the position, or None.
+        Mate scores are stored relative to the position, ply turns them back
+        into "mate in n from the root".
+        """
+        self.probes += 1
+        index = (key & self.mask) << 1
+        keys = self.keys
+        if keys[index] == key:
+            data = self.data[index]
+        elif keys[index+1] == key:
+            data = self.data[index+1]
+        else:
+            return None
+        if data == 0:
+            return None
+        self.hits += 1
+        score = (data >> 32) - 0x80000000
+        if score > MATE_BOUND:
+            score -= ply
+        elif score < -MATE_BOUND:
+            score += ply
+        return data & 0xFFFF, (data >> 16) & 0xFF, (data >> 24) & 3, score
+
+    def store(self, key, move, depth, flag, score, ply=0):
+        """
+        Save a search result. move is a Move.move_id (0 if none).
+        """
+        self.stores += 1
+        if score > MATE_BOUND:
+            score += ply
+        elif score < -MATE_BOUND:
+            score -= ply
+        index = (key & self.mask) << 1
+        keys = self.keys
+        data = self.data
+        if not move:
+            #Keep the old best move if this result has none
+            if keys[index] == key:
+                move = data[index] & 0xFFFF
+            elif keys[index+1] == key:
+                move = data[index+1] & 0xFFFF
+        old = data[index]
+        if (old == 0 or keys[index] == key or depth >= (old >> 16) & 0xFF or
+            (old >> 26) & 0x3F != self.age):
+            if old != 0 and keys[index] != key:
+                #Demote the old depth-preferred entry instead of losing it
+                if data[index+1] != 0 and keys[index+1] != key:
+                    self.collisions += 1
+                keys[index+1] = keys[index]
+                data[index+1] = old
+        else:
+            index += 1
+            if data[index] != 0 and keys[index] != key:
+                self.collisions += 1
+        keys[index] = key
+        data[index] = (move & 0xFFFF | (depth & 0xFF) << 16 | flag << 24 |
+                       self.age << 26 | (score + 0x80000000) << 32)
+
+    def hashfull(self):
+        """
+        Per mille of the first 1000 slots used by the current search (UCI style).
+        """
+        used = 0
+        count = min(1000, len(self.data))
+        for i in range(count):
+            if self.data[i] != 0 and (self.data[i] >> 26) & 0x3F == self.age:
+                used += 1
+        return used * 1000 // count
+
+    def get_stats(self):
+        return {"probes": self.probes, "hits": self.hits, "stores": self.stores,
+                "collisions": self.collisions,
+                "hit_rate": self.hits / self.probes if self.probes else 0.0,
+                "hashfull": self.hashfull(),
+                "size_mb": len(self.keys) * ENTRY_BYTES / (1024 * 1024)}
@@ -0,0 +1,238 @@
+# UCI (Universal Chess Interface) front end, so GUIs and match runners can use the engine
+from engine import create_game_state
+from fen import START_FEN
+from search import Searcher, MATE_SCORE, MAX_DEPTH
+from tt import TranspositionTable
+from book import OpeningBook
+from tablebase import Tablebase
+import logging
+import sys
+import threading
+
+# NOTE's
+"""
+UCI is a line based text protocol over stdin/stdout. The GUI sends commands:
+    uci, isready, ucinewgame, setoption name Hash value 32,
+    position startpos moves e2e4 e7e5 / position fen <fen> moves ...,
+    go movetime 1000 / go depth 6 / go nodes 50000 / go wtime .. btime .. winc .. binc ..,
+    go infinite, stop, quit
+and the engine answers with "info ..." lines while searching and one
+"bestmove e2e4" line at the end of each search.
+The search runs on a background thread, so "stop" (or "quit") is read and
+handled while it is still thinking. stdout is only used for the protocol:
+anything else that gets printed is sent to stderr instead.
+This module never imports pygame, so it starts fast and runs headless.
+"""
+
+ENGINE_NAME = "Chess-Engine"
+ENGINE_AUTHOR = "Evan Farnping"
+DEFAULT_HASH_MB = 16
+MOVE_OVERHEAD = 0.05 # seconds kept back for communication per move
+
+logger = logging.getLogger(__name__)
+
+def format_score(score):
+    """
+    Search score -> "cp 35" or "mate 3" / "mate -2" (in moves, not plies).
+    """
+    if abs(score) >= MATE_SCORE - MAX_DEPTH:
+        plies = MATE_SCORE - abs(score)
+        moves = (plies + 1) // 2
+        return "mate " + str(moves if score > 0 else -moves)
+    return "cp " + str(score)
+
+def time_for_move(white_turn, params):
+    """
+    Seconds to think from the "go" parameters (None = no time limit).
+    """
+    if "movetime" in params:
+        return max(params["movetime"] / 1000 - MOVE_OVERHEAD, 0.01)
+    time_left = params.get("wtime" if white_turn else "btime")
+    if time_left is None:
+        return None
+    increment = params.get("winc" if white_turn else "binc", 0)
+    moves_to_go = params.get("movestogo", 30)
+    budget = time_left / moves_to_go + increment * 0.8
+    #Never plan to use more than half of what is left
+    budget = min(budget, time_left * 0.5)
+    return max(budget / 1000 - MOVE_OVERHEAD, 0.01)
+
+class UciEngine():
+    def __init__(self, output=None, backend="array"):
+        """
+        output = where protocol lines go (stdout by default).
+        """
+        self.output = output or sys.stdout
+        self.backend = backend
+        self.hash_mb = DEFAULT_HASH_MB
+        self.searcher = Searcher(tt=TranspositionTable(self.hash_mb))
+        self.game_state = create_game_state(backend)
+        self.search_thread = None
+        self.stop_event = threading.Event()
+        self.output_lock = threading.Lock()
+
+    def send(self, line):
+        with self.output_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def handle(self, line):
+        """
+        Handle one command line. Returns False on "quit".
+        """
+        tokens = line.split()
+        if not tokens:
+            return True
+        command = tokens[0]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send(f"option name Hash type spin default {DEFAULT_HASH_MB} min 1 max 1024")
+            self.send("option name Backend type combo default array var array var bitboard")
+            self.send("option name BookFile type string default <empty>")
+            self.send("option name TablebasePath type string default <empty>")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.set_option(tokens[1:])
+        elif command == "ucinewgame":
+            self.stop_search()
+            self.searcher.tt.clear()
+            self.game_state = create_game_state(self.backend)
+        elif command == "position":
+            self.stop_search()
+            self.set_position(tokens[1:])
+        elif command == "go":
+            self.stop_search()
+            self.go(tokens[1:])
+        elif command == "stop":
+            self.stop_search()
+        elif command == "quit":
+            self.stop_search()
+            return False
+        return True
+
+    def set_option(self, tokens):
+        """
+        setoption name <name> value <value>
+        """
+        if "name" not in tokens:
+            return
+        name_index = tokens.index("name") + 1
+        value_index = tokens.index("value") if "value" in tokens else len(tokens)
+        name = " ".join(tokens[name_index:value_index]).lower()
+        value = " ".join(tokens[value_index+1:])
+        self.stop_search()
+        if name == "hash" and value.isdigit():
+            self.hash_mb = max(1, int(value))
+            self.searcher.tt = TranspositionTable(self.hash_mb)
+        elif name == "backend" and value in ("array", "bitboard"):
+            self.backend = value
+            self.game_state = create_game_state(self.backend)
+        elif name == "bookfile":
+            if self.searcher.book is not None:
+                self.searcher.book.close()
+            self.searcher.book = None
+            if value and value != "<empty>":
+                try:
+                    self.searcher.book = OpeningBook(value)
+                except OSError as error:
+                    logger.warning("Can't open book: %s", error)
+        elif name == "tablebasepath":
+            if self.searcher.tablebase is not None:
+                self.searcher.tablebase.close()
+            self.searcher.tablebase = None
+            if value and value != "<empty>":
+                self.searcher.tablebase = Tablebase(value)
+
+    def set_position(self, tokens):
+        """
+        position startpos [moves ...] / position fen <6 fields> [moves ...]
+        """
+        moves_index = tokens.index("moves") if "moves" in tokens else len(tokens)
+        if tokens and tokens[0] == "fen":
+            fen = " ".join(tokens[1:moves_index])
+        else:
+            fen = START_FEN
+        try:
+            game_state = create_game_state(self.backend, fen)
+        except ValueError as error:
+            logger.warning("Bad position: %s", error)
+            return
+        for notation in tokens[moves_index+1:]:
+            for move in game_state.get_valid_moves():
+                if move.get_chess_notations() == notation:
+                    game_state.make_move(move)
+                    break
+            else:
+                logger.warning("Illegal move: %s", notation)
+                break
+        self.game_state = game_state
+
+    def go(self, tokens):
+        """
+        Start searching on a background thread with the given limits.
+        """
+        params = {}
+        i = 0
+        while i < len(tokens):
+            if tokens[i] in ("wtime", "btime", "winc", "binc", "movestogo",
+                             "movetime", "depth", "nodes") and i+1 < len(tokens):
+                try:
+                    params[tokens[i]] = int(tokens[i+1])
+                except ValueError:
+                    pass
+                i += 2
+            else:
+                i += 1
+        infinite = "infinite" in tokens
+        time_limit = None if infinite else time_for_move(self.game_state.white_turn, params)
+        max_depth = params.get("depth", MAX_DEPTH)
+        node_limit = params.get("nodes")
+        self.stop_event = threading.Event()
+        self.search_thread = threading.Thread(
+            target=self.run_search, args=(time_limit, max_depth, node_limit, infinite), daemon=True)
+        self.search_thread.start()
+
+    def run_search(self, time_limit, max_depth, node_limit, infinite):
+        result = self.searcher.search(self.game_state, max_depth, time_limit, node_limit,
+                                      on_info=self.send_info, stop_event=self.stop_event)
+        if result.depth == 0 and result.pv:
+            self.send_info(result) #Book move, search() doesn't report those
+        if infinite:
+            #"go infinite" must not answer before "stop"
+            self.stop_event.wait()
+        best_move = result.best_move.get_chess_notations() if result.best_move else "0000"
+        self.send("bestmove " + best_move)
+
+    def send_info(self, result):
+        if result.depth == 0:
+            self.send("info string book move")
+            return
+        self.send(f"info depth {result.depth} score {format_score(result.score)} "
+                  f"nodes {result.nodes} nps {result.nps} time {int(result.seconds * 1000)} "
+                  f"hashfull {self.searcher.tt.hashfull()} "
+                  f"pv {' '.join(result.get_pv_notations())}")
+
+    def stop_search(self):
+        """
+        Stop a running search and wait for its bestmove.
+        """
+        if self.search_thread is not None:
+            self.stop_event.set()
+            self.search_thread.join()
+            self.search_thread = None
+
+def main():
+    protocol_output = sys.stdout
+    sys.stdout = sys.stderr #Stray prints must not mix with the protocol
+    logging.basicConfig(stream=sys.stderr, level=logging.WARNING, format="%(levelname)s %(message)s")
+    engine = UciEngine(protocol_output)
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    engine.stop_search()
+
+if __name__ == "__main__":
+    main()
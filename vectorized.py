@@ -0,0 +1,417 @@
+# Vectorized batch move generation: attacks, mobility and legal moves for N positions at once
+from bitboard import (PIECES, ROOK_DIRECTIONS, BISHOP_DIRECTIONS, KNIGHT_ATTACKS,
+                      KING_ATTACKS, PAWN_ATTACKS, RAYS, BETWEEN)
+from evaluation import encode_boards
+import argparse
+import random
+import time
+import numpy as np
+
+# NOTE's
+"""
+GameState generates moves for one position at a time in python. Building
+training data (features and legal moves for millions of positions) wants the
+opposite: one NumPy operation that does the same step for every position.
+
+Positions come in either as an (N, 8, 8) array of evaluation.PIECE_CODES
+(evaluation.encode_boards) or as an (N, 12) uint64 array of bitboards in the
+order of bitboard.PIECES, bit n = square n = row * 8 + col, same as
+bitboard.py. Everything else works on (N, 64) uint64 arrays: entry [n, sq]
+is the set of squares the piece on sq of position n attacks (or moves to).
+    leapers (pawn captures, knight, king): table lookups by square
+    sliders: Kogge-Stone fills, the rays of all N * 64 squares are grown
+             along each direction with 3 shifts at once (1, 2 and 4 steps)
+Legal moves use the same idea as engine.py, from the king outward: king
+moves must avoid the enemy attack map (seen through our own king), with
+one checker the other pieces must capture it or block, with two only the
+king moves, and pinned pieces (one of our pieces alone between the king and
+an enemy slider) stay on their line. The few en passant captures are tested
+one by one by removing both pawns, and castling is checked per right.
+
+legal_move_masks returns (N, 64) target sets per start square; move_planes
+unpacks them into (N, 64, 64) bools, the usual from/to policy layout.
+A promotion is one from/to pair there, count_legal_moves counts it as the
+4 moves (Q, R, B, N) GameState makes of it.
+"""
+
+SQUARES = np.arange(64, dtype=np.uint64)
+SQUARE_BITS = np.uint64(1) << SQUARES
+ALL_SQUARES = np.uint64(0xFFFFFFFFFFFFFFFF)
+NOT_A_FILE = np.uint64(sum(1 << sq for sq in range(64) if sq % 8 != 0))
+NOT_H_FILE = np.uint64(sum(1 << sq for sq in range(64) if sq % 8 != 7))
+ROW_2 = np.uint64(0xFF << 48) # white pawns that may move 2 squares
+ROW_7 = np.uint64(0xFF << 8) # black pawns that may move 2 squares
+
+#(shift, mask) per direction, shift > 0 = towards higher squares,
+#mask drops what wrapped around to the other side of the board
+SHIFTS = {(-1,0): (-8, ALL_SQUARES), (1,0): (8, ALL_SQUARES),
+          (0,-1): (-1, NOT_H_FILE), (0,1): (1, NOT_A_FILE),
+          (-1,-1): (-9, NOT_H_FILE), (-1,1): (-7, NOT_A_FILE),
+          (1,-1): (7, NOT_H_FILE), (1,1): (9, NOT_A_FILE)}
+ROOK_SHIFTS = tuple(SHIFTS[d] for d in ROOK_DIRECTIONS)
+BISHOP_SHIFTS = tuple(SHIFTS[d] for d in BISHOP_DIRECTIONS)
+
+#Per piece code (0 = empty, then PIECES in order)
+PIECE_TYPES = np.array([0] + ["PNBRQK".index(piece[1]) + 1 for piece in PIECES])
+IS_WHITE = (PIECE_TYPES > 0) & (np.arange(13) <= 6)
+IS_BLACK = np.arange(13) >= 7
+ROOK_LIKE = np.isin(PIECE_TYPES, (4, 5))
+BISHOP_LIKE = np.isin(PIECE_TYPES, (3, 5))
+PAWN_CODES = (1, 7) # [white, black]
+ROOK_CODES = (4, 10)
+KING_CODES = (6, 12)
+
+def _leaper_table():
+    """
+    LEAPER_ATTACKS[piece code, sq]: attacks of pawns, knights and kings, 0 for the rest.
+    """
+    tables = {"wP": PAWN_ATTACKS[0], "bP": PAWN_ATTACKS[1], "wN": KNIGHT_ATTACKS,
+              "bN": KNIGHT_ATTACKS, "wK": KING_ATTACKS, "bK": KING_ATTACKS}
+    table = np.zeros((13, 64), dtype=np.uint64)
+    for code, piece in enumerate(PIECES, start=1):
+        if piece in tables:
+            table[code] = tables[piece]
+    return table
+
+def _line_tables():
+    """
+    LINE[a, b]: the whole row, column or diagonal through a and b (0 if they
+    don't share one), ORTHOGONAL/DIAGONAL[a, b]: which kind of line it is.
+    """
+    line = np.zeros((64, 64), dtype=np.uint64)
+    orthogonal = np.zeros((64, 64), dtype=bool)
+    diagonal = np.zeros((64, 64), dtype=bool)
+    for sq in range(64):
+        for d in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
+            full = RAYS[d][sq] | RAYS[(-d[0], -d[1])][sq] | 1 << sq
+            ray = RAYS[d][sq]
+            for end in range(64):
+                if ray >> end & 1:
+                    line[sq, end] = full
+                    if d in ROOK_DIRECTIONS:
+                        orthogonal[sq, end] = True
+                    else:
+                        diagonal[sq, end] = True
+    return line, orthogonal, diagonal
+
+LEAPER_ATTACKS = _leaper_table()
+LINE, ORTHOGONAL, DIAGONAL = _line_tables()
+BETWEEN_TABLE = np.array(BETWEEN, dtype=np.uint64)
+
+#Castling per right (wK, wQ, bK, bQ): king from, king to, rook square,
+#squares that must be empty, squares that must not be attacked
+CASTLES = ((60, 62, 63, (61, 62), (61, 62)), (60, 58, 56, (57, 58, 59), (58, 59)),
+           (4, 6, 7, (5, 6), (5, 6)), (4, 2, 0, (1, 2, 3), (2, 3)))
+
+def popcount(bitboards):
+    """
+    Number of set bits of every uint64.
+    """
+    if hasattr(np, "bitwise_count"): #NumPy 2
+        return np.bitwise_count(bitboards).astype(np.int32)
+    as_bytes = np.ascontiguousarray(bitboards, dtype=np.uint64)
+    as_bytes = as_bytes.view(np.uint8).reshape(as_bytes.shape + (8,))
+    return np.unpackbits(as_bytes, axis=-1).sum(axis=-1, dtype=np.int32)
+
+def _shift(bitboards, shift):
+    if shift > 0:
+        return bitboards << np.uint64(shift)
+    return bitboards >> np.uint64(-shift)
+
+def _slide(generators, empty, shift, mask):
+    """
+    Kogge-Stone fill: squares the sliders in generators attack in one
+    direction, up to and including the first occupied square.
+    """
+    empty = empty & mask
+    generators = generators | (empty & _shift(generators, shift))
+    empty = empty & _shift(empty, shift)
+    generators = generators | (empty & _shift(generators, 2 * shift))
+    empty = empty & _shift(empty, 2 * shift)
+    generators = generators | (empty & _shift(generators, 4 * shift))
+    return _shift(generators, shift) & mask
+
+def _slider_attacks(rook_generators, bishop_generators, occupied):
+    empty = ~occupied
+    attacks = np.zeros(np.broadcast(rook_generators, occupied).shape, dtype=np.uint64)
+    for shift, mask in ROOK_SHIFTS:
+        attacks |= _slide(rook_generators, empty, shift, mask)
+    for shift, mask in BISHOP_SHIFTS:
+        attacks |= _slide(bishop_generators, empty, shift, mask)
+    return attacks
+
+def as_bitboards(positions):
+    """
+    (N, 8, 8) piece codes or (N, 12) bitboards -> (N, 12) uint64 bitboards.
+    """
+    positions = np.asarray(positions)
+    if positions.ndim == 2 and positions.shape[1] == 12:
+        return positions.astype(np.uint64, copy=False)
+    if positions.ndim == 3 and positions.shape[1:] == (8, 8):
+        codes = positions.reshape(-1, 1, 64)
+        pieces = codes == np.arange(1, 13).reshape(1, 12, 1)
+        return np.bitwise_or.reduce(np.where(pieces, SQUARE_BITS, np.uint64(0)), axis=2)
+    raise ValueError(f"Expected (N, 8, 8) boards or (N, 12) bitboards, got shape {positions.shape}")
+
+def bitboards_to_codes(bitboards):
+    """
+    (N, 12) bitboards -> (N, 64) piece codes (same codes as evaluation.PIECE_CODES).
+    """
+    bits = ((bitboards[:, :, None] >> SQUARES) & np.uint64(1)).astype(np.int8)
+    return (bits * np.arange(1, 13, dtype=np.int8)[:, None]).sum(axis=1, dtype=np.int8)
+
+def encode_game_states(game_states):
+    """
+    GameStates -> (bitboards (N, 12), white_turn (N,), castling (N, 4) as
+    wK, wQ, bK, bQ, en_passant (N,) square or -1), the arguments of legal_move_masks.
+    """
+    bitboards = as_bitboards(encode_boards(game_states))
+    white_turn = np.array([game_state.white_turn for game_state in game_states], dtype=bool)
+    castling = np.array([(rights.wK_side, rights.wQ_side, rights.bK_side, rights.bQ_side)
+                         for rights in (game_state.get_castling_rights for game_state in game_states)],
+                        dtype=bool).reshape(-1, 4)
+    en_passant = np.array([game_state.en_passant_coords[0] * 8 + game_state.en_passant_coords[1]
+                           if game_state.en_passant_coords else -1
+                           for game_state in game_states], dtype=np.int8)
+    return bitboards, white_turn, castling, en_passant
+
+def _piece_attacks(codes, occupied):
+    """
+    codes (N, 64), occupied broadcastable to (N, 64) -> (N, 64) attack sets.
+    """
+    attacks = LEAPER_ATTACKS[codes, np.arange(64)]
+    rook_generators = np.where(ROOK_LIKE[codes], SQUARE_BITS, np.uint64(0))
+    bishop_generators = np.where(BISHOP_LIKE[codes], SQUARE_BITS, np.uint64(0))
+    return attacks | _slider_attacks(rook_generators, bishop_generators, occupied)
+
+def _occupancy(bitboards):
+    white = np.bitwise_or.reduce(bitboards[:, :6], axis=1)
+    black = np.bitwise_or.reduce(bitboards[:, 6:], axis=1)
+    return white, black
+
+def piece_attacks(positions):
+    """
+    (N, 64) uint64: the squares the piece on each square attacks (0 if empty).
+    """
+    bitboards = as_bitboards(positions)
+    white, black = _occupancy(bitboards)
+    return _piece_attacks(bitboards_to_codes(bitboards).astype(np.intp), (white | black)[:, None])
+
+def attack_maps(positions):
+    """
+    (N, 2) uint64: every square [white, black] attacks, seen through the
+    other side's king like GameState.get_attack_map.
+    """
+    bitboards = as_bitboards(positions)
+    codes = bitboards_to_codes(bitboards).astype(np.intp)
+    white, black = _occupancy(bitboards)
+    is_white = IS_WHITE[codes]
+    enemy_king = np.where(is_white, bitboards[:, 11, None], bitboards[:, 5, None])
+    attacks = _piece_attacks(codes, (white | black)[:, None] & ~enemy_king)
+    return np.stack((np.bitwise_or.reduce(np.where(is_white, attacks, np.uint64(0)), axis=1),
+                     np.bitwise_or.reduce(np.where(IS_BLACK[codes], attacks, np.uint64(0)), axis=1)),
+                    axis=1)
+
+def _pseudo_moves(codes, attacks, white, black):
+    """
+    (N, 64) targets of every piece, ignoring checks, pins, castling and en passant.
+    """
+    occupied = (white | black)[:, None]
+    is_white = IS_WHITE[codes]
+    own = np.where(is_white, white[:, None], black[:, None])
+    enemy = np.where(is_white, black[:, None], white[:, None])
+    targets = attacks & ~own
+    empty = ~occupied
+    white_push = _shift(SQUARE_BITS, -8) & empty
+    white_push |= _shift(white_push & (ROW_2 >> np.uint64(8)), -8) & empty
+    black_push = _shift(SQUARE_BITS, 8) & empty
+    black_push |= _shift(black_push & (ROW_7 << np.uint64(8)), 8) & empty
+    targets = np.where(codes == PAWN_CODES[0], (attacks & enemy) | white_push, targets)
+    return np.where(codes == PAWN_CODES[1], (attacks & enemy) | black_push, targets)
+
+def mobility(positions):
+    """
+    (N, 12) int32: squares the pieces of each type (bitboard.PIECES order)
+    can move to, pawn pushes included, checks and pins ignored.
+    """
+    bitboards = as_bitboards(positions)
+    codes = bitboards_to_codes(bitboards).astype(np.intp)
+    white, black = _occupancy(bitboards)
+    counts = popcount(_pseudo_moves(codes, _piece_attacks(codes, (white | black)[:, None]),
+                                    white, black))
+    return np.stack([np.where(codes == code, counts, 0).sum(axis=1, dtype=np.int32)
+                     for code in range(1, 13)], axis=1)
+
+def legal_move_masks(positions, white_turn, castling=None, en_passant=None):
+    """
+    (N, 64) uint64: the legal target squares of the piece on each start
+    square, for the side to move. castling (N, 4) bools as wK, wQ, bK, bQ
+    and en_passant (N,) squares (-1 = none) default to none.
+    """
+    bitboards = as_bitboards(positions)
+    count = len(bitboards)
+    white_turn = np.broadcast_to(np.asarray(white_turn, dtype=bool), (count,))
+    codes = bitboards_to_codes(bitboards).astype(np.intp)
+    white, black = _occupancy(bitboards)
+    occupied = white | black
+    rows = np.arange(count)
+
+    attacks = _piece_attacks(codes, occupied[:, None])
+    targets = _pseudo_moves(codes, attacks, white, black)
+    is_white = IS_WHITE[codes]
+    us = np.where(white_turn[:, None], is_white, IS_BLACK[codes])
+    enemy = ~us & (codes != 0)
+    own = np.where(white_turn, white, black)
+    targets = np.where(us, targets, np.uint64(0))
+
+    king_code = np.where(white_turn, KING_CODES[0], KING_CODES[1])
+    is_king = codes == king_code[:, None]
+    king_sq = is_king.argmax(axis=1)
+    king_bit = SQUARE_BITS[king_sq]
+    #The enemy attack map as if our king weren't there, so it can't step back along a check
+    enemy_attacks = np.bitwise_or.reduce(
+        np.where(enemy, _piece_attacks(codes, (occupied & ~king_bit)[:, None]), np.uint64(0)), axis=1)
+
+    checkers = enemy & ((attacks & king_bit[:, None]) != 0)
+    checks = checkers.sum(axis=1)
+    checker_sq = checkers.argmax(axis=1)
+    check_mask = np.where(checks == 0, ALL_SQUARES,
+                          np.where(checks == 1, SQUARE_BITS[checker_sq] | BETWEEN_TABLE[king_sq, checker_sq],
+                                   np.uint64(0)))
+    targets = np.where(is_king, targets & ~enemy_attacks[:, None], targets & check_mask[:, None])
+
+    #Pins: an enemy slider on a line with the king and exactly one of our pieces between
+    blockers = BETWEEN_TABLE[king_sq] & occupied[:, None]
+    single = (blockers != 0) & ((blockers & (blockers - np.uint64(1))) == 0)
+    lined_up = ((ROOK_LIKE[codes] & ORTHOGONAL[king_sq]) | (BISHOP_LIKE[codes] & DIAGONAL[king_sq]))
+    pinners = enemy & lined_up & single & ((blockers & own[:, None]) != 0)
+    pin_rows, pinner_sq = np.nonzero(pinners)
+    #One blocker bit, log2 is exact for powers of two
+    pinned_sq = np.log2(blockers[pin_rows, pinner_sq].astype(np.float64)).astype(np.intp)
+    targets[pin_rows, pinned_sq] &= LINE[king_sq[pin_rows], pinner_sq]
+
+    if castling is not None:
+        castling = np.asarray(castling, dtype=bool).reshape(count, 4)
+        for right, (king_from, king_to, rook_sq, empty_squares, safe_squares) in enumerate(CASTLES):
+            color = right // 2
+            empty_mask = np.uint64(sum(1 << sq for sq in empty_squares))
+            safe_mask = np.uint64(sum(1 << sq for sq in safe_squares))
+            allowed = (castling[:, right] & (white_turn == (color == 0)) & (checks == 0)
+                       & (codes[:, king_from] == KING_CODES[color])
+                       & (codes[:, rook_sq] == ROOK_CODES[color])
+                       & ((occupied & empty_mask) == 0) & ((enemy_attacks & safe_mask) == 0))
+            targets[allowed, king_from] |= SQUARE_BITS[king_to]
+
+    if en_passant is not None:
+        _add_en_passant(targets, bitboards, codes, attacks, white_turn, occupied,
+                        np.asarray(en_passant).reshape(count), king_sq, checkers)
+    return targets
+
+def _add_en_passant(targets, bitboards, codes, attacks, white_turn, occupied,
+                    en_passant, king_sq, checkers):
+    """
+    En passant captures, each tested on the board with both pawns moved
+    (the captured pawn can uncover a check along the row).
+    """
+    ep_rows = np.nonzero(en_passant >= 0)[0]
+    if len(ep_rows) == 0:
+        return
+    ep_bits = SQUARE_BITS[en_passant[ep_rows]]
+    pawn_code = np.where(white_turn[ep_rows], PAWN_CODES[0], PAWN_CODES[1])
+    capturers = (codes[ep_rows] == pawn_code[:, None]) & ((attacks[ep_rows] & ep_bits[:, None]) != 0)
+    index, start_sq = np.nonzero(capturers)
+    if len(index) == 0:
+        return
+    rows = ep_rows[index]
+    ep_sq = en_passant[rows].astype(np.intp)
+    captured_sq = np.where(white_turn[rows], ep_sq + 8, ep_sq - 8)
+    captured_bit = SQUARE_BITS[captured_sq]
+    after = (occupied[rows] ^ SQUARE_BITS[start_sq] ^ captured_bit) | SQUARE_BITS[ep_sq]
+    king_bit = SQUARE_BITS[king_sq[rows]]
+    enemy_base = np.where(white_turn[rows], 6, 0)[:, None] + np.arange(6)
+    enemy_pieces = bitboards[rows[:, None], enemy_base] # (M, 6) P N B R Q K
+    rook_like = enemy_pieces[:, 3] | enemy_pieces[:, 4]
+    bishop_like = enemy_pieces[:, 2] | enemy_pieces[:, 4]
+    rook_attacks = _slider_attacks(king_bit, np.zeros_like(king_bit), after)
+    bishop_attacks = _slider_attacks(np.zeros_like(king_bit), king_bit, after)
+    checker_bits = np.bitwise_or.reduce(np.where(checkers[rows], SQUARE_BITS, np.uint64(0)), axis=1)
+    leaper_checks = checker_bits & (enemy_pieces[:, 0] | enemy_pieces[:, 1]) & ~captured_bit
+    legal = (((rook_attacks & rook_like) == 0) & ((bishop_attacks & bishop_like) == 0)
+             & (leaper_checks == 0))
+    targets[rows[legal], start_sq[legal]] |= SQUARE_BITS[ep_sq[legal]]
+
+def move_planes(masks):
+    """
+    (N, 64) target masks -> (N, 64, 64) bools indexed [n, from, to].
+    """
+    return ((np.asarray(masks)[:, :, None] >> SQUARES) & np.uint64(1)).astype(bool)
+
+def count_legal_moves(positions, white_turn, castling=None, en_passant=None, masks=None):
+    """
+    (N,) number of legal moves, promotions counted as 4 like GameState does.
+    """
+    bitboards = as_bitboards(positions)
+    if masks is None:
+        masks = legal_move_masks(bitboards, white_turn, castling, en_passant)
+    white_turn = np.broadcast_to(np.asarray(white_turn, dtype=bool), (len(bitboards),))
+    counts = popcount(masks)
+    pawns = np.where(white_turn, bitboards[:, 0], bitboards[:, 6])
+    promoting = pawns & np.where(white_turn, ROW_7, ROW_2) #one step from the last row
+    return (counts.sum(axis=1) + 3 * np.where((promoting[:, None] & SQUARE_BITS) != 0,
+                                              counts, 0).sum(axis=1)).astype(np.int32)
+
+def random_game_states(count, max_plies=80, backend="bitboard", seed=None):
+    """
+    Positions from random games, for testing and benchmarks.
+    """
+    from engine import create_game_state
+    generator = random.Random(seed)
+    game_states = []
+    while len(game_states) < count:
+        game_state = create_game_state(backend)
+        for _ in range(generator.randrange(max_plies)):
+            moves = game_state.get_valid_moves()
+            if not moves:
+                break
+            game_state.make_move(generator.choice(moves))
+        game_states.append(game_state)
+    return game_states
+
+def compare_with_engine(game_states, seconds_report=True):
+    """
+    Count the legal moves of game_states with GameState.get_valid_moves and
+    with count_legal_moves, print both speeds. Returns the positions that disagree.
+    """
+    start = time.perf_counter()
+    expected = [len(game_state.get_valid_moves()) for game_state in game_states]
+    engine_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    bitboards, white_turn, castling, en_passant = encode_game_states(game_states)
+    encode_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    counts = count_legal_moves(bitboards, white_turn, castling, en_passant)
+    batch_seconds = time.perf_counter() - start
+    if seconds_report:
+        count = len(game_states)
+        print(f"engine      {count / engine_seconds:12,.0f} positions/s")
+        print(f"vectorized  {count / batch_seconds:12,.0f} positions/s  "
+              f"(+ encoding {count / encode_seconds:,.0f} positions/s)")
+    return [game_state for game_state, want, got in zip(game_states, expected, counts)
+            if want != got]
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time the vectorized move generator")
+    parser.add_argument("--positions", type=int, default=2000)
+    parser.add_argument("--plies", type=int, default=80, help="random game length, at most")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    game_states = random_game_states(args.positions, args.plies, seed=args.seed)
+    wrong = compare_with_engine(game_states)
+    if wrong:
+        from fen import get_fen
+        print(f"{len(wrong)} positions disagree, e.g. {get_fen(wrong[0])}")
+    else:
+        print("All move counts match")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# Zobrist hashing: a 64 bit key that identifies a position
+import random
+
+# NOTE's
+"""
+Every (piece, square) pair, the side to move, each set of castling rights
+and each en passant file gets a fixed random 64 bit number. The key of a
+position is all of its numbers XOR'ed together, so a move only has to XOR
+out what changed and XOR in what is new (make_move/undo_last_move do this),
+instead of looking at all 64 squares again.
+The numbers come from a fixed seed, so keys are the same in every process
+(and every run), which matters for anything stored or shared between them.
+"""
+
+_random = random.Random(20230101)
+
+#PIECE_KEYS[piece][row * 8 + col], "__" is all zeros so empty squares cost nothing
+PIECE_KEYS = {"__": (0,) * 64}
+for _piece in ("wP", "wN", "wB", "wR", "wQ", "wK",
+               "bP", "bN", "bB", "bR", "bQ", "bK"):
+    PIECE_KEYS[_piece] = tuple(_random.getrandbits(64) for _ in range(64))
+
+#Black to move
+SIDE_KEY = _random.getrandbits(64)
+
+#CASTLING_KEYS[castling_index(rights)], index 0 (no rights) is 0
+_castling_bits = [_random.getrandbits(64) for _ in range(4)]
+CASTLING_KEYS = tuple(
+    (_castling_bits[0] if index & 1 else 0) ^ (_castling_bits[1] if index & 2 else 0) ^
+    (_castling_bits[2] if index & 4 else 0) ^ (_castling_bits[3] if index & 8 else 0)
+    for index in range(16))
+
+#EN_PASSANT_KEYS[col] of the en passant square
+EN_PASSANT_KEYS = tuple(_random.getrandbits(64) for _ in range(8))
+
+def castling_index(rights):
+    """
+    CastlingRights -> 4 bit number (wK = 1, wQ = 2, bK = 4, bQ = 8).
+    """
+    return rights.wK_side | rights.wQ_side << 1 | rights.bK_side << 2 | rights.bQ_side << 3
+
+def state_key(rights, en_passant_coords):
+    """
+    Castling and en passant part of the key.
+    """
+    key = CASTLING_KEYS[castling_index(rights)]
+    if en_passant_coords:
+        key ^= EN_PASSANT_KEYS[en_passant_coords[1]]
+    return key
+
+def compute_hash(game_state):
+    """
+    Key of game_state computed from scratch (all 64 squares).
+    """
+    key = 0
+    for row in range(8):
+        for col in range(8):
+            key ^= PIECE_KEYS[game_state.board[row][col]][row * 8 + col]
+    if not game_state.white_turn:
+        key ^= SIDE_KEY
+    return key ^ state_key(game_state.get_castling_rights, game_state.en_passant_coords)